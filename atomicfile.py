@@ -0,0 +1,93 @@
+"""Atomic file replacement
+
+Files are written to a temporary file in the same directory & moved over the
+target with os.replace(), so readers (and crashes) only ever see the old or
+the new contents.  A WriteGroup replaces several files (& appends to logs)
+together & optionally fsyncs them as one batch: all data first, then each
+directory once.
+"""
+
+import os
+
+
+def _write_temp(path, data, fsync):
+    """Writes 'data' (str or bytes) to a temporary file next to 'path' &
+       returns its name"""
+    # unlike tempfile.mkstemp(), honor the umask like a plain open() would
+    temp_path = f"{path}.{os.getpid()}.{os.urandom(4).hex()}.tmp"
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        with os.fdopen(fd, "wb") as outfile:
+            outfile.write(data.encode() if isinstance(data, str) else data)
+            if fsync:
+                outfile.flush()
+                os.fsync(outfile.fileno())
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return temp_path
+
+
+def _fsync_directory(directory):
+    """Makes the renames in 'directory' durable"""
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_atomic(path, data, fsync=False):
+    """Atomically replaces the contents of 'path' with 'data'"""
+    group = WriteGroup(fsync)
+    group.write(path, data)
+    group.commit()
+
+
+class WriteGroup(object):
+    """Set of file replacements (& appends) made together by commit()"""
+    def __init__(self, fsync=False):
+        self.fsync = fsync
+        self._files = {}  # path -> data
+        self._appends = []  # (path, data)
+
+    def __len__(self):
+        return len(self._files) + len(self._appends)
+
+    def write(self, path, data):
+        """Schedules 'path' to be replaced with 'data' (str or bytes)"""
+        self._files[path] = data
+
+    def append(self, path, data):
+        """Schedules 'data' (str or bytes) to be appended to 'path', once the
+           scheduled replacements are in place"""
+        self._appends.append((path, data))
+
+    def commit(self):
+        """Writes & moves every scheduled file into place"""
+        temp_paths = []
+        try:
+            for path, data in self._files.items():
+                temp_paths.append((_write_temp(path, data, self.fsync), path))
+        except BaseException:
+            for temp_path, _ in temp_paths:
+                os.unlink(temp_path)
+            raise
+
+        for temp_path, path in temp_paths:
+            os.replace(temp_path, path)
+        for path, data in self._appends:
+            with open(path, "ab") as outfile:
+                outfile.write(data.encode() if isinstance(data, str) else data)
+                if self.fsync:
+                    outfile.flush()
+                    os.fsync(outfile.fileno())
+
+        if self.fsync:
+            directories = {os.path.dirname(os.path.abspath(path))
+                           for path in list(self._files) +
+                           [path for path, _ in self._appends]}
+            for directory in sorted(directories):
+                _fsync_directory(directory)
+        self._files = {}
+        self._appends = []
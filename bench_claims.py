@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+"""
+Work-queue throughput benchmark: claims per second.
+
+Fills the backlog of a scratch repository & lets a number of worker
+processes claim tasks until it is empty.
+
+    ./bench_claims.py -w 1 -w 8 -w 32 -t 2000 -d /mnt/shared
+"""
+
+import argparse
+import glob
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+WORKER_SCRIPT = """
+import queue
+import sys
+import taskinfo
+claims = 0
+while True:
+    with taskinfo.TaskMaster(worker=sys.argv[1]) as taskmaster:
+        try:
+            taskmaster.claim()
+        except queue.Empty:
+            break
+    claims += 1
+print(claims)
+"""
+
+FILL_SCRIPT = """
+import sys
+import taskinfo
+with taskinfo.TaskMaster() as taskmaster:
+    for i in range(int(sys.argv[1])):
+        taskmaster.backlog.put(taskinfo.TaskProxy(f"{i:032x}"), i % 5)
+"""
+
+
+def run(workers, tasks, directory=None):
+    """Runs one round in a scratch copy of the tool (in 'directory');
+       returns claims/s"""
+    scratch = tempfile.mkdtemp(dir=directory)
+    try:
+        source_dir = os.path.dirname(os.path.realpath(__file__))
+        for filename in glob.glob(os.path.join(source_dir, "*.py")):
+            shutil.copy(filename, scratch)
+        os.makedirs(os.path.join(scratch, ".tasks"))
+        subprocess.run([sys.executable, "-c", FILL_SCRIPT, str(tasks)],
+                       cwd=scratch, check=True)
+
+        start = time.monotonic()
+        processes = [subprocess.Popen(
+            [sys.executable, "-c", WORKER_SCRIPT, f"worker{i}"],
+            cwd=scratch, stdout=subprocess.PIPE, text=True)
+                     for i in range(workers)]
+        claims = sum(int(process.communicate()[0]) for process in processes)
+        elapsed = time.monotonic() - start
+        assert claims == tasks, f"{claims} claims for {tasks} tasks"
+        return claims / elapsed
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def main():
+    """Parses the command line & prints one result line per round"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-w", "--workers", type=int, action="append",
+                        help="number of worker processes (repeatable)")
+    parser.add_argument("-t", "--tasks", type=int, default=500,
+                        help="number of backlog tasks")
+    parser.add_argument("-d", "--directory", default=None,
+                        help="where to create the scratch repository (e.g. "
+                             "a shared or network file system)")
+    args = parser.parse_args()
+
+    print(f"{'workers':>8}  {'claims/s':>10}")
+    for workers in args.workers or [1, 4, 16]:
+        claims = run(workers, args.tasks, args.directory)
+        print(f"{workers:>8}  {claims:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
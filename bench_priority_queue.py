@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+"""
+Multi-threaded contention benchmark for priority_queue.PriorityQueue.
+
+A single producer keeps putting & getting items while a number of reader
+threads iterate the queue; the producer's throughput shows how much the
+readers get in its way.
+
+    ./bench_priority_queue.py -r 0 -r 4 -r 16 -s 5000
+"""
+
+import argparse
+import threading
+import time
+
+import priority_queue
+
+
+def run(readers, size, duration):
+    """Runs one benchmark round; returns (producer ops/s, reader scans/s)"""
+    queue = priority_queue.PriorityQueue()
+    for i in range(size):
+        queue.put(object(), i % 5)
+
+    stop = threading.Event()
+    scans = [0] * readers
+
+    def read(slot):
+        """Iterates the queue until told to stop"""
+        while not stop.is_set():
+            for _ in queue:
+                pass
+            scans[slot] += 1
+
+    threads = [threading.Thread(target=read, args=(slot,))
+               for slot in range(readers)]
+    for thread in threads:
+        thread.start()
+
+    operations = 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        item, priority = queue.get_tuple()
+        queue.put(item, priority)
+        operations += 2
+
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return operations / duration, sum(scans) / duration
+
+
+def main():
+    """Parses the command line & prints one result line per round"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-r", "--readers", type=int, action="append",
+                        help="number of reader threads (repeatable)")
+    parser.add_argument("-s", "--size", type=int, default=1000,
+                        help="number of queued items")
+    parser.add_argument("-d", "--duration", type=float, default=2.0,
+                        help="seconds per round")
+    args = parser.parse_args()
+
+    print(f"{'readers':>8}  {'producer ops/s':>14}  {'scans/s':>10}")
+    for readers in args.readers or [0, 1, 4, 16]:
+        ops, scans = run(readers, args.size, args.duration)
+        print(f"{readers:>8}  {ops:>14.0f}  {scans:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,7 @@
 Command to move a task from the backlog to the active stack
 """
 
+import completion
 import taskinfo
 from custom_logger import get_logger
 
@@ -31,4 +32,5 @@ def create_parser(subparsers):
     subparser.set_defaults(func=process_command)
     subparser.add_argument("-e", "--edit", action="store_true",
                            help="Invoke an editor for the task")
-    subparser.add_argument("id", help="Task id to activate")
+    id_argument = subparser.add_argument("id", help="Task id to activate")
+    id_argument.completer = completion.backlog_ids
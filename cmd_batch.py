@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+"""
+Command to run many sub-commands in one session (one load, one commit)
+"""
+
+import contextlib
+import io
+import json
+import shlex
+import sys
+
+import main
+import taskinfo
+from custom_logger import HANDLER, get_logger
+
+# log = get_logger('task')
+
+# commands that cannot share a session: claim publishes on its own
+EXCLUDED_COMMANDS = ["batch", "claim", "serve"]
+
+
+def _read_commands(infile):
+    """Yields (line number, line) for each command in 'infile', skipping
+       blank lines & '#' comments"""
+    for number, line in enumerate(infile, 1):
+        line = line.strip()
+        if line and not line.startswith("#"):
+            yield number, line
+
+
+def _split(line):
+    """Returns the argument list of command 'line': either a JSON array of
+       arguments or a shell-quoted command line"""
+    if not line.startswith("["):
+        return shlex.split(line)
+
+    command = json.loads(line)
+    if not all(isinstance(argument, str) for argument in command):
+        raise ValueError("JSON commands must be arrays of strings")
+    return command
+
+
+def _parse(parser, command, output):
+    """Returns the parsed arguments of 'command', or None if argparse
+       printed the help (to 'output')"""
+    try:
+        return parser.parse_args(command)
+    except SystemExit as exit_request:
+        if not exit_request.code:  # --help
+            return None
+        # argparse printed the usage & the error
+        message = output.getvalue().strip().splitlines()
+        raise ValueError(message[-1] if message else "Invalid command") \
+            from None
+
+
+class CapturedOutput(io.StringIO):
+    """Captured command output, posing as a terminal if 'tty' is set (so
+       that colors are kept)"""
+    def __init__(self, tty=False):
+        super().__init__()
+        self.tty = tty
+
+    def isatty(self):
+        return self.tty
+
+
+def run_command(parser, command, output=None):
+    """Runs the sub-command 'command' (argument list) in the open session,
+       capturing its output in 'output' (a CapturedOutput), & returns the
+       output.  Raises ValueError for commands that cannot run in a shared
+       session."""
+    if command and command[0] in EXCLUDED_COMMANDS:
+        raise ValueError(f"'{command[0]}' cannot run in a batch")
+
+    if output is None:
+        output = CapturedOutput()
+    # the command's printouts & log messages (at its -v level) are part of
+    # its result
+    level = get_logger('task').level
+    stream = HANDLER.setStream(output)
+    try:
+        with contextlib.redirect_stdout(output), \
+                contextlib.redirect_stderr(output):
+            parsed_args = _parse(parser, command, output)
+            if parsed_args is not None:
+                if not hasattr(parsed_args, "func"):
+                    raise ValueError("No command given")
+                main.set_verbosity(parsed_args.verbosity)
+                parsed_args.func(parsed_args)
+    finally:
+        HANDLER.setStream(stream)
+        get_logger('task').setLevel(level)
+    return output.getvalue()
+
+
+def process_command(args):
+    """Process sub-command 'batch'"""
+    log = get_logger('task')
+    parser = main.create_command_line_parser(main.load_manifest())
+    if args.file == "-":
+        infile = contextlib.nullcontext(sys.stdin)
+    else:
+        infile = open(args.file)
+    failures = 0
+    with infile as commands, taskinfo.TaskMaster() as taskmaster:
+        for number, line in _read_commands(commands):
+            savepoint = taskmaster.savepoint() if args.keep_going else None
+            result = {"line": number, "command": line}
+            try:
+                result["output"] = run_command(parser, _split(line))
+                result["ok"] = True
+            except Exception as error:  # pylint: disable=broad-except
+                log.debug("batch line %d failed", number, exc_info=True)
+                result["ok"] = False
+                result["error"] = str(error) or type(error).__name__
+                failures += 1
+            print(json.dumps(result), flush=True)
+
+            if not result["ok"]:
+                if not args.keep_going:
+                    # discard the whole batch
+                    print(f"Batch aborted at line {number}; nothing saved",
+                          file=sys.stderr)
+                    raise RuntimeError(f"Batch aborted at line {number}")
+                taskmaster.rollback(savepoint)
+
+    if failures:
+        print(f"{failures} batch commands failed", file=sys.stderr)
+        raise RuntimeError(f"{failures} batch commands failed")
+
+
+def create_parser(subparsers):
+    """Create argument subparser for command 'batch'"""
+    subparser = subparsers.add_parser(
+        'batch', help='Run sub-commands read from a file, in one session')
+    subparser.set_defaults(func=process_command)
+    subparser.add_argument("file", nargs="?", default="-",
+                           help="File of commands, one per line (shell "
+                                "syntax or a JSON array); defaults to stdin")
+    subparser.add_argument("-k", "--keep-going", action="store_true",
+                           help="Skip failed commands (undoing their "
+                                "changes) instead of discarding the batch")
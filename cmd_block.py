@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+
+"""
+Command to block the current task on another task
+"""
+
+import completion
+import taskinfo
+from custom_logger import get_logger
+
+# log = get_logger('task')
+
+
+def process_command(args):
+    """Process sub-command 'block'"""
+
+    with taskinfo.TaskMaster() as taskmaster:
+        task = taskmaster.current_task
+        if task is None:
+            print("No tasks found!")
+            return
+
+        if args.edit:
+            task.edit()
+
+        taskmaster.block(args.id)
+        log = get_logger('task')
+        log.debug("Blocked task '%s' on '%s'", task.id, args.id)
+
+
+def create_parser(subparsers):
+    """Create argument subparser for command 'block'"""
+    subparser = subparsers.add_parser(
+        'block', help='Block the current task until another task is done')
+    subparser.set_defaults(func=process_command)
+    subparser.add_argument("-e", "--edit", action="store_true",
+                           help="Invoke an editor for the task")
+    id_argument = subparser.add_argument("id",
+                                         help="Id of the blocking task")
+    id_argument.completer = completion.live_ids
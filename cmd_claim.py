@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+
+"""
+Command to claim the next backlog task for a worker (work-queue mode)
+"""
+
+import queue
+
+import taskinfo
+from cmd_show import print_task_summary
+from custom_logger import get_logger
+
+# log = get_logger('task')
+
+
+def process_command(args):
+    """Process sub-command 'claim'"""
+
+    with taskinfo.TaskMaster(worker=args.worker) as taskmaster:
+        try:
+            task = taskmaster.claim(args.lease * 60)
+        except queue.Empty:
+            print("No tasks found!")
+            return
+
+        log = get_logger('task')
+        log.debug("Worker '%s' claimed task '%s'", taskmaster.worker, task.id)
+        print_task_summary(task.view())
+
+
+def create_parser(subparsers):
+    """Create argument subparser for command 'claim'"""
+    subparser = subparsers.add_parser(
+        'claim', help='Claim the top backlog task for a worker')
+    subparser.set_defaults(func=process_command)
+    subparser.add_argument("-w", "--worker", default=None,
+                           help="Worker name (defaults to $TASKWORKER)")
+    subparser.add_argument("-l", "--lease", type=int,
+                           default=taskinfo.DEFAULT_LEASE // 60,
+                           help="Lease duration in minutes")
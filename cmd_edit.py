@@ -4,6 +4,7 @@
 Command to edit a task
 """
 
+import completion
 import taskinfo
 # from custom_logger import get_logger
 
@@ -25,5 +26,7 @@ def process_command(args):
 def create_parser(subparsers):
     """Create argument subparser for command 'edit'"""
     subparser = subparsers.add_parser('edit', help='Edit a task')
-    subparser.add_argument("id", nargs="?", help="Task id to edit")
+    id_argument = subparser.add_argument("id", nargs="?",
+                                         help="Task id to edit")
+    id_argument.completer = completion.live_ids
     subparser.set_defaults(func=process_command)
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+"""
+Command to list closed tasks
+"""
+
+import datetime
+
+import taskinfo
+from cmd_show import print_task_summary
+# from custom_logger import get_logger
+
+# log = get_logger('task')
+
+
+def _date(text):
+    """Parses a YYYY-MM-DD command-line date"""
+    return datetime.datetime.strptime(text, "%Y-%m-%d").date()
+
+
+def process_command(args):
+    """Process sub-command 'history'"""
+
+    with taskinfo.TaskMaster() as taskmaster:
+        closed_tasks = taskmaster.history(args.since, args.until)
+
+    if not closed_tasks:
+        print("No tasks found!")
+        return
+
+    for closed_at, task in closed_tasks:
+        print(closed_at.strftime("%Y-%m-%d %H:%M"), end="")
+        print_task_summary(task.view())
+
+
+def create_parser(subparsers):
+    """Create argument subparser for command 'history'"""
+    subparser = subparsers.add_parser('history', help='List closed tasks')
+    subparser.set_defaults(func=process_command)
+    subparser.add_argument("-s", "--since", type=_date, default=None,
+                           help="Only tasks closed on or after YYYY-MM-DD")
+    subparser.add_argument("-u", "--until", type=_date, default=None,
+                           help="Only tasks closed on or before YYYY-MM-DD")
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+
+"""
+Command to migrate the task repository to the current storage layout
+"""
+
+import gitrepo
+from custom_logger import get_logger
+
+# log = get_logger('task')
+
+
+def process_command(args):
+    """Process sub-command 'migrate'"""
+    taskrepo = gitrepo.get_repository()
+    try:
+        count = taskrepo.migrate(batch_size=args.batch_size)
+    finally:
+        taskrepo.close()
+
+    log = get_logger('task')
+    log.info("Migrated %d tasks", count)
+    print(f"Migrated {count} tasks to the fan-out layout")
+
+
+def create_parser(subparsers):
+    """Create argument subparser for command 'migrate'"""
+    subparser = subparsers.add_parser(
+        'migrate', help='Move task files into the fan-out directory layout')
+    subparser.set_defaults(func=process_command)
+    subparser.add_argument("-b", "--batch-size", type=int, default=1000,
+                           help="Number of tasks moved per commit")
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+"""
+Command to run the task daemon: a long-lived process serving the commands
+that the task tool forwards to it over a Unix socket (see daemon)
+"""
+
+import asyncio
+import concurrent.futures
+import datetime
+import json
+import os
+import signal
+
+import cmd_batch
+import daemon
+import main
+import taskinfo
+from custom_logger import get_logger
+
+# log = get_logger('task')
+
+GROUP_SIZE = 64  # most requests saved together, in one commit
+MAX_TIMER = 60  # seconds between checks for sleeping tasks to wake
+
+
+class TaskServer(object):
+    """Serves task commands over the Unix socket 'path'.  The repository
+       stays loaded in one TaskMaster, which is only reloaded when another
+       process changed it.  Commands run one at a time; those that arrive
+       while a group is being saved form the next group, which is saved as
+       one commit.  Sleeping tasks are woken by a timer."""
+    def __init__(self, path=daemon.SOCKET):
+        self.path = path
+        self._parser = main.create_command_line_parser(main.load_manifest())
+        self._taskmaster = None
+        self._requests = None  # queue of (request, future) pairs
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._timer = None
+
+    async def serve(self):
+        """Serves requests until cancelled"""
+        if daemon.is_running(self.path):
+            raise RuntimeError(f"A task daemon is already serving {self.path}")
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # left behind by a daemon that died
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        self._requests = asyncio.Queue()
+        self._requests.put_nowait((None, None))  # wake overdue tasks
+        server = await asyncio.start_unix_server(self._handle, path=self.path)
+        worker = asyncio.ensure_future(self._process())
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGTERM, asyncio.current_task().cancel)
+        get_logger('task').info("serving %s", self.path)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            worker.cancel()
+            if self._timer is not None:
+                self._timer.cancel()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    async def _handle(self, reader, writer):
+        """Answers one client connection"""
+        try:
+            request = json.loads(await reader.readline())
+            if not isinstance(request, dict) or \
+                    not isinstance(request.get("args"), list):
+                raise ValueError("no argument list")
+        except ValueError as error:
+            response = {"status": 1, "output": "",
+                        "error": f"Bad request: {error}"}
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._requests.put_nowait((request, future))
+            response = await future
+
+        writer.write(json.dumps(response).encode() + b"\n")
+        await writer.drain()
+        writer.close()
+        await writer.wait_closed()
+
+    async def _process(self):
+        """Runs the queued requests, group by group"""
+        loop = asyncio.get_running_loop()
+        while True:
+            group = [await self._requests.get()]
+            while not self._requests.empty() and len(group) < GROUP_SIZE:
+                group.append(self._requests.get_nowait())
+
+            responses, next_wake = await loop.run_in_executor(
+                self._executor, self._run_group,
+                [request for request, _ in group])
+            for (_, future), response in zip(group, responses):
+                if future is not None and not future.cancelled():
+                    future.set_result(response)
+            self._arm_timer(next_wake)
+
+    def _arm_timer(self, next_wake):
+        """Schedules a wake-up request for datetime 'next_wake' (at most
+           MAX_TIMER seconds from now)"""
+        if self._timer is not None:
+            self._timer.cancel()
+        delay = MAX_TIMER
+        if next_wake is not None:
+            delay = (next_wake - datetime.datetime.now()).total_seconds()
+            delay = min(max(delay, 0), MAX_TIMER)
+        self._timer = asyncio.get_running_loop().call_later(
+            delay, self._requests.put_nowait, (None, None))
+
+    def _session(self):
+        """Returns the TaskMaster to run the next group in"""
+        if self._taskmaster is None or not self._taskmaster.is_current():
+            get_logger('task').debug("loading the repository")
+            self._taskmaster = taskinfo.TaskMaster()
+            self._taskmaster.persistent = True  # keep the blob reader
+        return self._taskmaster
+
+    def _run_group(self, requests):
+        """Runs 'requests' (None: wake sleeping tasks) in one session (in
+           the executor's thread).  Returns their responses & the time the
+           next sleeping task is due."""
+        log = get_logger('task')
+        taskmaster = self._session()
+        responses = []
+        try:
+            with taskmaster:
+                for request in requests:
+                    responses.append(self._run_request(taskmaster, request))
+        except Exception as error:  # pylint: disable=broad-except
+            log.exception("saving a group of %d requests failed",
+                          len(requests))
+            self._taskmaster = None  # reload from the repository
+            responses = [{"status": 1, "output": "",
+                          "error": f"Nothing saved: {error}"}
+                         for _ in requests]
+            return responses, None
+        return responses, taskmaster.sleeping.next_wake
+
+    def _run_request(self, taskmaster, request):
+        """Runs one request in the open session & returns its response; the
+           changes of a failed command are undone"""
+        if request is None:
+            taskmaster.wake_due()
+            return None
+
+        output = cmd_batch.CapturedOutput(bool(request.get("tty")))
+        savepoint = taskmaster.savepoint()
+        try:
+            cmd_batch.run_command(self._parser, request["args"], output)
+        except RuntimeError as error:  # the command's own failure status
+            taskmaster.rollback(savepoint)
+            return {"status": 1, "output": output.getvalue(),
+                    "error": str(error) or None}
+        except Exception as error:  # pylint: disable=broad-except
+            get_logger('task').debug("request failed", exc_info=True)
+            taskmaster.rollback(savepoint)
+            return {"status": 1, "output": output.getvalue(),
+                    "error": str(error) or type(error).__name__}
+        return {"status": 0, "output": output.getvalue(), "error": None}
+
+
+def process_command(args):  # pylint: disable=unused-argument
+    """Process sub-command 'serve'"""
+    server = TaskServer()
+    try:
+        asyncio.run(server.serve())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass  # stopped with Ctrl-C or SIGTERM
+    except RuntimeError as error:
+        get_logger('task').error("%s", error)
+        raise
+
+
+def create_parser(subparsers):
+    """Create argument subparser for command 'serve'"""
+    subparser = subparsers.add_parser(
+        'serve', help='Run the task daemon, which serves the other commands')
+    subparser.set_defaults(func=process_command)
@@ -6,18 +6,24 @@ Command to show a task
 
 from __future__ import print_function
 
+import completion
 import taskinfo
 from ansi_color import TermColor
 # from custom_logger import get_logger
 
 
-def print_task_summary(task_data, color=None):
-    """Print one line summary of task information"""
+def print_task_summary(task_data, color=None, index=None):
+    """Print one line summary of task information.  With a TaskIndex, the id
+       is abbreviated to its shortest unique prefix."""
     tc = TermColor()
     if color is None:
         color = tc.light_green
+    if index is not None:
+        short_id = index.shortest_prefix(task_data["id"])
+    else:
+        short_id = task_data["id"][:taskinfo.TaskIndex.MIN_PREFIX]
     print("  {c1}{id}{endc}  {c2}{pri}{endc}  {desc}".format(
-        id=task_data["id"][:7],
+        id=short_id,
         pri=task_data["priority"],
         desc=task_data["description"],
         c1=color,
@@ -41,8 +47,8 @@ def print_tasks(tm):
         # print("=" * len(group_name))
         found = False
         for task in group:  # .find_all():
-            data = task.dict()
-            print_task_summary(data, color)
+            data = task.view()
+            print_task_summary(data, color, tm.index)
             found = True
         if not found:
             print("  None")
@@ -56,17 +62,19 @@ def process_command(args):
             return
 
         # stack_size = len(taskmaster.stack)
+        index = None  # only built (by the prefix lookup) for an id
         if args.id is None:
             cur_task = taskmaster.current_task
         else:
             cur_task = taskmaster.find(args.id)
+            index = taskmaster.index
 
     if not cur_task:
         print("No tasks found!")
         return
 
-    data = cur_task.dict()
-    print_task_summary(data)
+    data = cur_task.view()
+    print_task_summary(data, index=index)
 
 
 def create_parser(subparsers):
@@ -75,5 +83,6 @@ def create_parser(subparsers):
     subparser.set_defaults(func=process_command)
     subparser.add_argument("-a", "--show-all", action="store_true",
                            help="Show all tasks")
-    subparser.add_argument("id", nargs="?", default=None,
-                           help="Task id")
+    id_argument = subparser.add_argument("id", nargs="?", default=None,
+                                         help="Task id")
+    id_argument.completer = completion.live_ids
@@ -17,6 +17,10 @@ def process_command(args):
 
     with taskinfo.TaskMaster() as taskmaster:
         task = taskmaster.current_task
+        if task is None:
+            print("No tasks found!")
+            return
+
         if args.edit:
             task.edit()
 
@@ -0,0 +1,91 @@
+"""Shell completion of task ids
+
+The completers (for argcomplete) read the small id/summary index kept by
+every saving task command, so a tab press loads no structure or task (only
+the module of the command being completed is imported, to build its
+parser).  The index is a snapshot ('ids.json' in the task repository: a map
+of structure name -> {task id: summary}) followed by a log of the changes
+saved since ('ids.log': one such map per line, in which a None summary
+removes the task & the structure name ANY_LOCATION updates the summary of a
+task wherever it is).  Saving appends to the log; the snapshot is rewritten
+once the log outgrows it.  The module only imports the standard library.
+"""
+
+import json
+import os
+
+ID_INDEX_FILE = "ids.json"
+ID_LOG_FILE = "ids.log"
+ANY_LOCATION = "*"
+
+# same place as gitrepo.DEFAULT_REPOSITORY_PATH, which is not imported here
+# to keep completion cheap
+ID_INDEX = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                        ".tasks", ID_INDEX_FILE)
+
+
+def log_file(index_file):
+    """Returns the path of the change log of the snapshot 'index_file'"""
+    return os.path.join(os.path.dirname(index_file), ID_LOG_FILE)
+
+
+def apply_changes(index, changes):
+    """Applies the {structure name: {task id: summary or None}} 'changes'
+       (a line of the log) to 'index'"""
+    for location, tasks in changes.items():
+        if location == ANY_LOCATION:
+            for held in index.values():
+                for task_id, summary in tasks.items():
+                    if task_id in held:
+                        held[task_id] = summary
+            continue
+
+        held = index.setdefault(location, {})
+        for task_id, summary in tasks.items():
+            if summary is None:
+                held.pop(task_id, None)
+            else:
+                held[task_id] = summary
+
+
+def load_index(index_file=ID_INDEX):
+    """Returns the {structure name: {task id: summary}} index, with the
+       logged changes applied.  Raises OSError or ValueError if there is no
+       (valid) snapshot."""
+    with open(index_file) as infile:
+        index = json.loads(infile.read())
+    try:
+        with open(log_file(index_file)) as infile:
+            for line in infile:
+                apply_changes(index, json.loads(line))
+    except FileNotFoundError:
+        pass
+    return index
+
+
+def candidates(prefix, locations=None, index_file=ID_INDEX):
+    """Returns the {task id: summary} map of the tasks whose id starts with
+       'prefix', held by the structures named in 'locations' (all of them
+       if None)"""
+    try:
+        index = load_index(index_file)
+    except (OSError, ValueError, AttributeError):
+        return {}
+
+    found = {}
+    for location, tasks in index.items():
+        if locations is None or location in locations:
+            found.update((task_id, summary)
+                         for task_id, summary in tasks.items()
+                         if task_id.startswith(prefix))
+    return found
+
+
+def backlog_ids(prefix, **_):
+    """Completer: ids of the backlog tasks"""
+    return candidates(prefix, ["backlog"])
+
+
+def live_ids(prefix, **_):
+    """Completer: ids of all tasks that are not closed"""
+    return candidates(prefix)
@@ -5,7 +5,6 @@ Custom logging support.  Enables level-specific formatting.
 """
 
 import logging
-import logging.config
 # logging.basicConfig()
 
 
@@ -0,0 +1,75 @@
+"""Client side of the task daemon
+
+While 'task serve' runs (see cmd_serve), the task tool forwards commands to
+it over a Unix socket in the task repository instead of loading the
+repository itself.  A request is one JSON line, {"args": [command line
+arguments], "tty": stdout is a terminal}; the daemon answers with one JSON
+line, {"status": exit status, "output": text, "error": message or null},
+once the command's changes are committed.  This module only imports the
+standard library, so that forwarding stays cheap.
+"""
+
+import json
+import os
+import socket
+
+SOCKET_FILE = "task.sock"
+
+# same place as gitrepo.DEFAULT_REPOSITORY_PATH, which is not imported here
+# to keep the client cheap
+SOCKET = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                      ".tasks", SOCKET_FILE)
+
+# commands that always run in the calling process: interactive ones, ones
+# reading stdin & ones that publish on their own
+LOCAL_COMMANDS = ["batch", "claim", "debug", "edit", "migrate", "serve"]
+
+# worker sessions (see taskinfo.WORKER_ENV) are not served by the daemon
+WORKER_ENV = "TASKWORKER"
+
+
+def _connect(path):
+    """Returns a socket connected to the daemon at 'path', or None if no
+       daemon is running"""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+    except OSError:  # no socket, or a stale one
+        client.close()
+        return None
+    return client
+
+
+def is_running(path=SOCKET):
+    """Returns True if a daemon is listening on 'path'"""
+    client = _connect(path)
+    if client is None:
+        return False
+    client.close()
+    return True
+
+
+def forward(params, tty=False, path=SOCKET):
+    """Runs the command given by the argument list 'params' in the daemon
+       listening on 'path' & returns its response, or None if no daemon is
+       running (the command should then run in-process).  Raises
+       RuntimeError if the daemon fails to answer."""
+    if not os.path.exists(path):
+        return None
+    client = _connect(path)
+    if client is None:
+        return None
+
+    request = json.dumps({"args": params, "tty": tty})
+    chunks = []
+    try:
+        with client:
+            client.sendall(request.encode() + b"\n")
+            while True:
+                chunk = client.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        return json.loads(b"".join(chunks))
+    except (OSError, ValueError):
+        raise RuntimeError("The task daemon did not answer") from None
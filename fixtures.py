@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+"""
+Fixtures shared by the test cases (tc_*.py) which run task code in separate
+processes
+"""
+
+import glob
+import os
+import shutil
+import subprocess
+import sys
+import unittest
+import completion
+
+
+class SandboxTestCase(unittest.TestCase):
+    """Test case running task code in separate processes, from a copy of the
+       sources in a scratch directory (& so against a repository of its
+       own)"""
+    def setUp(self):
+        """Copies the sources (& the 'task' script) to the scratch
+           directory"""
+        self.test_dir = os.path.realpath("./temp/")
+        self.repository = os.path.join(self.test_dir, ".tasks")
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+        os.makedirs(self.test_dir)
+        source_dir = os.path.dirname(os.path.realpath(__file__))
+        for filename in glob.glob(os.path.join(source_dir, "*.py")) + \
+                [os.path.join(source_dir, "task")]:
+            shutil.copy(filename, self.test_dir)
+
+    def tearDown(self):
+        """Removes the scratch directory"""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _run(self, script, *args):
+        """Runs the Python 'script' (with the command line arguments 'args')
+           in the scratch directory & returns its output"""
+        return subprocess.run(
+            [sys.executable, "-c", script] + list(args), cwd=self.test_dir,
+            stdout=subprocess.PIPE, text=True, check=True).stdout
+
+    def _task(self, args, commands=None):
+        """Runs the task tool with the standard input 'commands'; returns
+           (exit status, stdout)"""
+        process = subprocess.run(
+            [sys.executable, "task"] + args, cwd=self.test_dir,
+            input=commands, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            text=True, check=False)
+        return process.returncode, process.stdout
+
+    def _summaries(self):
+        """Returns the summaries of the open tasks, per structure"""
+        index = completion.load_index(
+            os.path.join(self.repository, completion.ID_INDEX_FILE))
+        return {location: sorted(tasks.values())
+                for location, tasks in index.items() if tasks}
+
+    def _commit_count(self):
+        """Returns the number of commits in the task repository"""
+        output = subprocess.check_output(
+            ["git", "rev-list", "--count", "HEAD"], cwd=self.repository)
+        return int(output)
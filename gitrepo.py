@@ -1,130 +1,764 @@
-"""Library of git repository operations"""
-
+"""Library of git repository operations
+
+Thread safety: no operation changes the process' working directory; git is
+always invoked with an explicit 'git -C <repository>' and files are accessed
+by absolute path.  Writes (and initialization) are serialized by one lock per
+repository location, shared by every GitRepository/TaskRepo instance for that
+location in the process.  Reads go through the BlobReader, which serializes
+its pipe round-trips internally, so tasks can be loaded and written from a
+thread pool.  TaskRepo transactions are per-thread: each thread's writes
+are buffered, then published or discarded, independently of the others.
+"""
+
+import contextlib
 import logging
 import os
-import shlex
+import shutil
 import subprocess
+import tempfile
+import threading
+
+import packstore
+import repolock
 
 # Constants
 EXEC_DIR = os.path.dirname(os.path.realpath(__file__))
 DEFAULT_REPOSITORY_PATH = os.path.join(EXEC_DIR, ".tasks")
+BARE_ENV = "TASKBARE"
+PACKED_ENV = "TASKPACKED"
+VALIDATED_MARKER = "task-validated"
+NULL_SHA = "0" * 40
+FANOUT_WIDTH = 2  # task file name characters used as directory name
 
 # Globals
 logger = logging.getLogger("task")
 REPOSITORY = None
+_REPOSITORY_GUARD = threading.Lock()
+_REPOSITORY_LOCKS = {}
+_REPOSITORY_LOCKS_GUARD = threading.Lock()
 
 
 class InvalidRepository(RuntimeError):
     """Exception raised when a bad/invalid Git repository is detected"""
 
 
-class GitRepository(object):
-    """Class representing a Git repository"""
+class BlobReader(object):
+    """Long-lived 'git cat-file --batch' process used to stream blobs out of
+       the object database.  Each read is a single pipe round-trip; the
+       process is started on first use and kept until close() is called."""
     def __init__(self, location):
-        self._dir_stack = []
         self._location = location
-        self._init_check()
+        self._lock = threading.Lock()
+        self._process = None
+
+    def _start(self):
+        """Spawns the 'git cat-file --batch' process"""
+        logger.debug("starting git cat-file --batch @%s", self._location)
+        self._process = subprocess.Popen(
+            ["git", "cat-file", "--batch"],
+            cwd=self._location,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL)
+
+    def read(self, object_name):
+        """Returns the contents of 'object_name' (e.g. 'HEAD:path') as bytes,
+           or None if no such blob exists"""
+        with self._lock:
+            if self._process is None or self._process.poll() is not None:
+                self._start()
+
+            self._process.stdin.write(object_name.encode() + b"\n")
+            self._process.stdin.flush()
+            header = self._process.stdout.readline()
+            if not header:
+                self._close_locked()
+                raise IOError(
+                    "git cat-file terminated while reading '{}'".format(
+                        object_name))
+
+            fields = header.split()
+            if len(fields) != 3 or fields[1] != b"blob":
+                # '<name> missing', '<name> ambiguous' or a non-blob object
+                if len(fields) == 3:
+                    # discard the contents of the non-blob object
+                    self._process.stdout.read(int(fields[2]) + 1)
+                return None
+
+            data = self._process.stdout.read(int(fields[2]))
+            self._process.stdout.read(1)  # trailing LF
+            return data
+
+    def close(self):
+        """Terminates the 'git cat-file' process, if running"""
+        with self._lock:
+            self._close_locked()
+
+    def _close_locked(self):
+        """Terminates the 'git cat-file' process; caller holds the lock"""
+        if self._process is None:
+            return
+
+        process, self._process = self._process, None
+        try:
+            process.stdin.close()
+        except (IOError, OSError):
+            pass
+        process.wait()
+        process.stdout.close()
+
+
+def repository_lock(location):
+    """Returns the process-wide lock serializing writes to the repository at
+       'location'; every GitRepository for that location shares it"""
+    key = os.path.realpath(location)
+    with _REPOSITORY_LOCKS_GUARD:
+        lock = _REPOSITORY_LOCKS.get(key)
+        if lock is None:
+            lock = threading.RLock()
+            _REPOSITORY_LOCKS[key] = lock
+        return lock
+
+
+class GitRepository(object):
+    """Class representing a Git repository.
+
+       A 'bare' repository has no working tree: files are written straight
+       into the object database as blobs and published by building a tree
+       (in a private, temporary index) & commit and advancing HEAD."""
+    def __init__(self, location, bare=False):
+        self._location = os.path.abspath(location)
+        self._bare = bare
+        self._lock = repository_lock(self._location)
+        with self._lock:
+            self._init_check()
 
     def _init_check(self):
         """Checks if this is a valid git repository, else initializes one"""
         if not os.path.exists(self._location):
             os.makedirs(self._location)
+        elif self._quick_check():
+            logger.debug("known git repo found @%s", self._location)
+            return
 
-        with self:
-            try:
-                git_root = self._git_command("rev-parse --show-toplevel",
-                                             quiet=True)
-                if os.path.abspath(os.path.normpath(git_root)) != \
-                        os.path.abspath(os.path.normpath(self._location)):
-                    raise InvalidRepository(
-                        "(invalid) git root found @{}".format(
-                            git_root))
-
-                logger.debug("valid git repo found @%s", self._location)
-            except (subprocess.CalledProcessError, InvalidRepository):
-                self._git_command("init")
-
-    def __enter__(self):
-        """'with' context entry handler"""
-        self._dir_stack.append(os.getcwd())
-        os.chdir(self._location)
-
-    def __exit__(self, obj_type, obj_value, traceback):
-        """'with' context exit handler"""
-        old_pwd = self._dir_stack.pop()
-        os.chdir(old_pwd)
-
-    def _git_command(self, command, quiet=False):
-        """Invoke 'git <command>' in the shell"""
-        command = "git {}".format(command)
-        with self:
-            try:
-                logger.debug(command)
-                output = subprocess.check_output(command, shell=True)
-                logger.debug(output)
-            except subprocess.CalledProcessError as e:
-                error_msg = "git cmd: {}\n{}".format(command, e.output)
-                if quiet:
-                    logger.debug(error_msg)
-                else:
-                    logger.error(error_msg)
-                raise
+        if self._bare:
+            self._init_check_bare()
+        else:
+            self._init_check_worktree()
+        self._write_marker()
+
+    @property
+    def _git_dir(self):
+        """Property accessor for the repository's git directory"""
+        if self._bare:
+            return self._location
+        return os.path.join(self._location, ".git")
+
+    def _marker_key(self):
+        """Returns the identity of the repository as recorded in the marker:
+           inodes of the repository & git directories and mtime of its
+           config (re-initialization or core.bare changes touch it)"""
+        location_stat = os.stat(self._location)
+        git_dir_stat = os.stat(self._git_dir)
+        config_stat = os.stat(os.path.join(self._git_dir, "config"))
+        return "{}:{} {}:{} {}\n".format(
+            location_stat.st_dev, location_stat.st_ino,
+            git_dir_stat.st_dev, git_dir_stat.st_ino,
+            config_stat.st_mtime_ns)
+
+    def _quick_check(self):
+        """Cheap validation that avoids starting git: HEAD must exist and
+           the marker left by the last full check must still match.  Returns
+           False if anything looks wrong."""
+        try:
+            if not os.path.isfile(os.path.join(self._git_dir, "HEAD")):
+                return False
+
+            with open(os.path.join(self._git_dir, VALIDATED_MARKER)) as infile:
+                return infile.read() == self._marker_key()
+        except (IOError, OSError):
+            return False
+
+    def _write_marker(self):
+        """Records that the repository passed a full validation"""
+        try:
+            key = self._marker_key()
+            with open(os.path.join(self._git_dir, VALIDATED_MARKER),
+                      'w') as outfile:
+                outfile.write(key)
+        except (IOError, OSError) as e:
+            # not fatal; the next start simply does the full check again
+            logger.debug("cannot write validation marker: %s", e)
+
+    def _init_check_worktree(self):
+        """Checks if this is a valid (non-bare) git repository, else
+           initializes one"""
+        try:
+            git_root = self._git(["rev-parse", "--show-toplevel"],
+                                 quiet=True).strip()
+            if os.path.realpath(git_root) != os.path.realpath(self._location):
+                raise InvalidRepository(
+                    "(invalid) git root found @{}".format(
+                        git_root))
+
+            logger.debug("valid git repo found @%s", self._location)
+        except (subprocess.CalledProcessError, InvalidRepository):
+            self._git(["init"])
+
+    def _init_check_bare(self):
+        """Checks if this is a valid bare git repository, else initializes
+           one"""
+        try:
+            git_dir = self._git(["rev-parse", "--absolute-git-dir"],
+                                quiet=True).strip()
+            if os.path.realpath(git_dir) != os.path.realpath(self._location):
+                raise InvalidRepository(
+                    "(invalid) git dir found @{}".format(git_dir))
+
+            logger.debug("valid bare git repo found @%s", self._location)
+        except (subprocess.CalledProcessError, InvalidRepository):
+            self._git(["init", "--bare"])
+
+    def _git(self, args, data=None, env=None, quiet=False):
+        """Invoke 'git <args>' (no shell) inside the repository, optionally
+           feeding it 'data' on stdin.  Returns stdout as a string."""
+        command = ["git", "-C", self._location] + list(args)
+        logger.debug(" ".join(command))
+        try:
+            output = subprocess.run(
+                command, env=env, input=data,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                universal_newlines=True, check=True).stdout
+            logger.debug(output)
+        except subprocess.CalledProcessError as e:
+            error_msg = "git cmd: {}\n{}{}".format(
+                " ".join(command), e.stdout, e.stderr)
+            if quiet:
+                logger.debug(error_msg)
+            else:
+                logger.error(error_msg)
+            raise
 
         return output
 
-    def add(self, filename):
-        """Stages 'filename' for commit"""
-        command = "add {}".format(filename)
-        self._git_command(command)
+    def path(self, relative_path):
+        """Returns the absolute path of 'relative_path' in the repository"""
+        return os.path.join(self._location, relative_path)
+
+    def add(self, *filenames):
+        """Stages 'filenames' for commit"""
+        self._git(["add", "--"] + list(filenames))
 
     def commit(self, message):
         """Commits any pending changes"""
-        escaped_message = shlex.quote(message)
-        command = "commit -m {}".format(escaped_message)
         try:
-            self._git_command(command)
-        except subprocess.CalledProcessError as e:
+            self._git(["commit", "-m", message])
+        except subprocess.CalledProcessError:
             print("No change detected.  Ignoring update.")
 
+    def write_files(self, files, message, removals=()):
+        """Writes the 'files' map of {relative path: data}, deletes the
+           'removals' paths (if present) & commits all of it at once with
+           'message'"""
+        with self._lock:
+            if self._bare:
+                self._write_objects(files, message, removals)
+                return
+
+            for path, data in files.items():
+                path = self.path(path)
+                # create the directory if it does not exist
+                dirname = os.path.dirname(path)
+                if not os.path.exists(dirname):
+                    os.makedirs(dirname)
+
+                with open(path, 'w') as outfile:
+                    outfile.write(data)
+
+            self._remove(removals)
+            if files:
+                self.add(*files)
+            self.commit(message)
+
+    def commit_paths(self, paths, message, removals=()):
+        """Commits the current contents of the existing files at 'paths'
+           (relative to the repository location), deletes the 'removals'
+           paths (if present) & commits all of it with 'message'"""
+        with self._lock:
+            if self._bare:
+                self._write_objects({}, message, removals,
+                                    {path: self.path(path) for path in paths})
+                return
+
+            self._remove(removals)
+            self.add(*paths)
+            self.commit(message)
+
+    def _remove(self, paths):
+        """Deletes & unstages 'paths', ignoring those that do not exist"""
+        if not paths:
+            return
+
+        for path in paths:
+            if os.path.exists(self.path(path)):
+                os.remove(self.path(path))
+        self._git(["rm", "--cached", "--ignore-unmatch", "--quiet", "--"] +
+                  list(paths))
+
+    def _write_objects(self, files, message, removals, sources=None):
+        """Bare-mode write_files(): stores 'files' (and the contents of the
+           'sources' map of {relative path: file to read}) as blobs, builds
+           the new tree in a private index & commits it on top of HEAD"""
+        try:
+            parent = self._git(["rev-parse", "--verify", "-q", "HEAD"],
+                               quiet=True).strip()
+        except subprocess.CalledProcessError:
+            parent = None  # first commit
+
+        scratch = tempfile.mkdtemp(prefix="task-", dir=self._location)
+        try:
+            # one 'hash-object' process stores every blob
+            blob_paths = dict(sources or {})
+            for idx, (path, data) in enumerate(files.items()):
+                blob_path = os.path.join(scratch, str(idx))
+                with open(blob_path, 'w') as outfile:
+                    outfile.write(data)
+                blob_paths[path] = blob_path
+            blobs = []
+            if blob_paths:
+                blobs = self._git(
+                    ["hash-object", "-w", "--no-filters", "--stdin-paths"],
+                    data="\n".join(blob_paths.values()) + "\n").split()
+
+            env = dict(os.environ,
+                       GIT_INDEX_FILE=os.path.join(scratch, "index"))
+            if parent is not None:
+                self._git(["read-tree", parent], env=env)
+            index_info = "".join(
+                "0 {}\t{}\n".format(NULL_SHA, path) for path in removals)
+            index_info += "".join(
+                "100644 {}\t{}\n".format(blob, path)
+                for blob, path in zip(blobs, blob_paths))
+            self._git(["update-index", "--index-info"], data=index_info,
+                      env=env)
+            tree = self._git(["write-tree"], env=env).strip()
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+        if parent is not None and \
+                tree == self._git(["rev-parse", parent + "^{tree}"]).strip():
+            print("No change detected.  Ignoring update.")
+            return
+
+        commit_args = ["commit-tree", tree]
+        if parent is not None:
+            commit_args.extend(["-p", parent])
+        commit = self._git(commit_args, data=message).strip()
+        # compare-and-swap: fails if HEAD moved since it was read
+        self._git(["update-ref", "-m", "task: commit", "HEAD", commit,
+                   parent or ""])
+
+    def head(self):
+        """Returns the commit id of HEAD, read straight from the git
+           directory (no git process), or None if there are no commits"""
+        with open(os.path.join(self._git_dir, "HEAD")) as infile:
+            ref = infile.read().strip()
+        if not ref.startswith("ref: "):
+            return ref  # detached HEAD
+
+        ref = ref[len("ref: "):]
+        try:
+            with open(os.path.join(self._git_dir, ref)) as infile:
+                return infile.read().strip()
+        except FileNotFoundError:
+            pass
+
+        try:
+            with open(os.path.join(self._git_dir, "packed-refs")) as infile:
+                for line in infile:
+                    fields = line.split()
+                    if len(fields) == 2 and fields[1] == ref:
+                        return fields[0]
+        except FileNotFoundError:
+            pass
+        return None
+
+    def changed_paths(self, old_revision, new_revision):
+        """Returns the list of paths that differ between two revisions"""
+        return self._git(["diff", "--name-only", "--no-renames",
+                          old_revision, new_revision],
+                         quiet=True).splitlines()
+
+    def list_tree(self, path, revision="HEAD"):
+        """Returns a list of (object type, name) tuples for the entries of
+           directory 'path' at 'revision'; empty if there is no such
+           revision (e.g. no commits yet)"""
+        try:
+            listing = self._git(["ls-tree", revision, path + "/"], quiet=True)
+        except subprocess.CalledProcessError:
+            return []
+
+        entries = []
+        for line in listing.splitlines():
+            meta, entry_path = line.split("\t", 1)
+            entries.append((meta.split()[1], os.path.basename(entry_path)))
+        return entries
+
+    @property
+    def bare(self):
+        """Property accessor for bare (working-tree-free) mode"""
+        return self._bare
+
     @property
     def location(self):
         """Property accessor for repository location"""
         return self._location
 
 
+class _Transaction(threading.local):
+    """State of the write transaction of the calling thread"""
+    def __init__(self):
+        super().__init__()
+        self.depth = 0
+        self.pending = None
+        self.messages = None
+        self.overwritten = None  # (task file, replaced data or None)
+        self.rollback = False
+
+
 class TaskRepo(object):
-    """Class wrapping a Git repository to store task objects"""
-    def __init__(self, location):
-        self.repo = GitRepository(location)
+    """Class wrapping a Git repository to store task objects.
+
+       Writes can be grouped with begin()/commit()/abort() (or the
+       transaction() context manager): while a transaction is open, task
+       files are buffered in memory and are published in a single commit
+       when the outermost transaction commits.  Aborting discards them.
+       Each thread has a transaction of its own.
+
+       With 'bare' set, tasks live only in the object database of a bare
+       repository.  By default, an existing repository keeps its layout and
+       a new one is bare if the TASKBARE environment variable is set to 1.
+
+       With 'packed' set, tasks are written to a single packed store (see
+       packstore) that is committed as a whole; tasks still stored as files
+       remain readable.  By default, it is used if the repository already
+       has one or if the TASKPACKED environment variable is set to 1."""
+    def __init__(self, location, bare=None, packed=None):
+        self._location = os.path.abspath(location)
+        if bare is None:
+            bare = TaskRepo._detect_bare(self._location)
+        self._bare = bare
+        self._store = packstore.PackedTaskStore(self._location)
+        if packed is None:
+            packed = self._store.exists() or \
+                os.environ.get(PACKED_ENV) == "1"
+        if not packed:
+            self._store = None
+        self._lock = threading.RLock()  # serializes publishing
+        self._repo = None
+        self._reader = BlobReader(self._location)
+        self._txn = _Transaction()  # per thread
+
+    @property
+    def repo(self):
+        """Property accessor for the underlying Git repository.  It is only
+           validated/initialized on first use so that sessions which never
+           touch task data never touch the disk either."""
+        with self._lock:
+            if self._repo is None:
+                self._repo = GitRepository(self._location, bare=self._bare)
+            return self._repo
+
+    @staticmethod
+    def _detect_bare(location):
+        """Returns True if 'location' is (or should become) a bare
+           repository"""
+        if os.path.exists(os.path.join(location, ".git")):
+            return False
+
+        if os.path.isfile(os.path.join(location, "HEAD")):
+            return True
+
+        return os.environ.get(BARE_ENV) == "1"
 
     def read_task(self, task_file):
         """Reads 'task_file' & returns its string contents"""
-        task_path = os.path.join(self.task_path, task_file)
-        with self.repo:
-            with open(task_path) as infile:
-                data = infile.read()
-
-        return data
+        pending = self._txn.pending
+        if pending is not None and task_file in pending:
+            return pending[task_file]
+
+        repo = self.repo  # the reader runs inside the repository
+        if self._store is not None:
+            record = self._store.read(os.path.splitext(task_file)[0])
+            if record is not None:
+                return str(record, "utf-8")
+
+        # both layouts are readable while a migration is in progress
+        task_paths = [self._task_file_path(task_file),
+                      self._flat_task_file_path(task_file)]
+        for task_path in task_paths:
+            data = self._reader.read("HEAD:{}".format(task_path))
+            if data is not None:
+                return data.decode()
+
+        if not repo.bare:
+            # not committed (yet); fall back to the working tree
+            for task_path in task_paths:
+                if os.path.exists(repo.path(task_path)):
+                    with open(repo.path(task_path)) as infile:
+                        return infile.read()
+
+        raise IOError("No such task: '{}'".format(task_file))
 
     def write_task(self, task_file, data, commit_message=None):
         """Writes 'data' to 'task_file' & commits the update with an
            optional custom 'commit_message'"""
-        task_path = os.path.join(self.task_path, task_file)
-        with self.repo:
-            # create the directory if it does not exist
-            dirname = os.path.dirname(task_path)
-            if not os.path.exists(dirname):
-                os.makedirs(dirname)
-
-            with open(task_path, 'w') as outfile:
-                outfile.write(data)
-
         if commit_message is None:
             task_id, _ = os.path.splitext(task_file)
             commit_message = "Update task {}".format(task_id)
 
-        self.repo.add(task_path)
-        self.repo.commit(commit_message)
+        txn = self._txn
+        if txn.pending is not None:
+            # defer until the transaction commits
+            txn.overwritten.append((task_file, txn.pending.get(task_file)))
+            txn.pending[task_file] = data
+            txn.messages.append(commit_message)
+            return
+
+        self._publish({task_file: data}, commit_message)
+
+    def _publish(self, task_files, commit_message):
+        """Writes the 'task_files' map of {task_file: data} & commits all of
+           them at once with 'commit_message'.  Tasks are always written in
+           the fan-out layout (or the packed store); flat copies are removed
+           by the same commit."""
+        with self._lock:  # one publisher at a time
+            repo = self.repo  # the store lives inside the repository
+            removals = [self._flat_task_file_path(task_file)
+                        for task_file in task_files]
+            if self._store is not None:
+                for task_file, data in task_files.items():
+                    self._store.write(os.path.splitext(task_file)[0],
+                                      data.encode())
+                pack_file = self._store.pack_file
+                self._store.flush()
+                removals.extend(self._task_file_path(task_file)
+                                for task_file in task_files)
+                if self._store.pack_file != pack_file:
+                    # compacted into a new segment
+                    removals.extend(self._store.stale_files())
+                repo.commit_paths(
+                    [self._store.pack_file, self._store.index_file],
+                    commit_message, removals)
+                return
+
+            files = {self._task_file_path(task_file): data
+                     for task_file, data in task_files.items()}
+            repo.write_files(files, commit_message, removals)
+
+    def _task_file_path(self, task_file):
+        """Returns the repository path of 'task_file' in the fan-out layout:
+           tasks/<first 2 chars>/<remaining chars>"""
+        return os.path.join(self.task_path, task_file[:FANOUT_WIDTH],
+                            task_file[FANOUT_WIDTH:])
+
+    def _flat_task_file_path(self, task_file):
+        """Returns the repository path of 'task_file' in the legacy flat
+           layout: tasks/<task_file>"""
+        return os.path.join(self.task_path, task_file)
+
+    def flat_task_files(self):
+        """Returns the names of the committed task files that still use the
+           flat layout"""
+        return [name for obj_type, name in self.repo.list_tree(self.task_path)
+                if obj_type == "blob"]
+
+    def migrate(self, batch_size=1000):
+        """Moves flat-layout task files into the fan-out layout, committing
+           every 'batch_size' tasks.  Safe to run while the repository is in
+           use: task commands wait for the exclusive repository lock (see
+           repolock), held throughout, to save, and readers find tasks in
+           either layout.  Returns the number of migrated tasks."""
+        os.makedirs(self._location, exist_ok=True)
+        with repolock.RepositoryLock(self._location).exclusive():
+            task_files = self.flat_task_files()
+            for start in range(0, len(task_files), batch_size):
+                batch = task_files[start:start + batch_size]
+                task_data = {task_file: self.read_task(task_file)
+                             for task_file in batch}
+                self._publish(task_data, "Migrate {} tasks to {}/xx/".format(
+                    len(batch), self.task_path))
+
+        return len(task_files)
+
+    def begin(self):
+        """Opens a write transaction of the calling thread.  Transactions
+           nest; only the outermost one publishes the buffered task files."""
+        txn = self._txn
+        txn.depth += 1
+        if txn.depth == 1:
+            if self._store is not None:
+                self._store.refresh()  # other processes may have saved
+            txn.pending = {}
+            txn.messages = []
+            txn.overwritten = []
+            txn.rollback = False
+
+    def commit(self):
+        """Closes a write transaction, publishing all buffered task files in
+           one commit if this is the outermost transaction"""
+        txn = self._txn
+        if txn.depth == 0:
+            raise RuntimeError("commit() called outside of a transaction")
+
+        txn.depth -= 1
+        if txn.depth > 0:
+            return
+
+        pending, messages = txn.pending, txn.messages
+        try:
+            if not txn.rollback and pending:
+                # the buffer stays readable until the commit has landed
+                self._publish(
+                    pending, TaskRepo._combine_messages(messages,
+                                                        len(pending)))
+        finally:
+            txn.pending = None
+            txn.messages = None
+            txn.overwritten = None
+
+    def abort(self):
+        """Closes a write transaction; nothing buffered by the (outermost)
+           transaction is committed"""
+        txn = self._txn
+        if txn.depth == 0:
+            raise RuntimeError("abort() called outside of a transaction")
+
+        txn.depth -= 1
+        txn.rollback = True
+        if txn.depth == 0:
+            txn.pending = None
+            txn.messages = None
+            txn.overwritten = None
+
+    def flush(self):
+        """Publishes the task files buffered so far by the calling thread's
+           open transaction, if any, in one commit.  The transaction stays
+           open; its earlier savepoints no longer undo anything."""
+        txn = self._txn
+        if txn.depth == 0:
+            return  # nothing is buffered
+        if txn.rollback:
+            raise RuntimeError("flush() called in an aborted transaction")
+
+        if txn.pending:
+            self._publish(txn.pending, TaskRepo._combine_messages(
+                txn.messages, len(txn.pending)))
+        txn.pending = {}
+        txn.messages = []
+        txn.overwritten = []
+
+    def savepoint(self):
+        """Returns a marker of the task writes buffered so far by the open
+           transaction, for rollback_to()"""
+        if self._txn.depth == 0:
+            raise RuntimeError("savepoint() called outside of a transaction")
+        return len(self._txn.messages)
+
+    def rollback_to(self, savepoint):
+        """Discards the task writes buffered since 'savepoint' (see
+           savepoint()); the transaction stays open"""
+        txn = self._txn
+        if txn.depth == 0:
+            raise RuntimeError("rollback_to() called outside of a transaction")
+        for task_file, data in reversed(txn.overwritten[savepoint:]):
+            if data is None:
+                del txn.pending[task_file]
+            else:
+                txn.pending[task_file] = data
+        del txn.overwritten[savepoint:]
+        del txn.messages[savepoint:]
+
+    @property
+    def pending(self):
+        """Property accessor: True if the calling thread's open transaction
+           has buffered task writes"""
+        return bool(self._txn.pending)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Context manager wrapping begin() & commit()/abort()"""
+        self.begin()
+        try:
+            yield self
+        except BaseException:
+            self.abort()
+            raise
+        self.commit()
+
+    @staticmethod
+    def _combine_messages(messages, task_count):
+        """Combines the commit messages of 'task_count' task updates"""
+        unique = list(dict.fromkeys(messages))  # de-duplicate, keep order
+        if len(unique) == 1:
+            return unique[0]
+
+        lines = ["Update {} tasks".format(task_count), ""]
+        lines.extend("* {}".format(message) for message in unique)
+        return "\n".join(lines)
+
+    def head(self):
+        """Returns the commit id of the current task data (HEAD), or None"""
+        return self.repo.head()
+
+    def changed_task_ids(self, old_head, new_head):
+        """Returns the set of ids of the tasks changed between 'old_head' and
+           'new_head', or None if that cannot be determined (e.g. 'old_head'
+           is gone, or the packed store was compacted)"""
+        try:
+            paths = self.repo.changed_paths(old_head, new_head)
+        except subprocess.CalledProcessError:
+            return None
+
+        task_ids = set()
+        for path in paths:
+            directory, task_file = os.path.split(path)
+            if directory == self.task_path:
+                task_ids.add(os.path.splitext(task_file)[0])  # flat
+            elif os.path.dirname(directory) == self.task_path:
+                task_ids.add(os.path.basename(directory) +
+                             os.path.splitext(task_file)[0])  # fan-out
+            elif self._store is not None and path == self._store.index_file:
+                changed = self._changed_packed_ids(old_head, new_head)
+                if changed is None:
+                    return None
+                task_ids.update(changed)
+        return task_ids
+
+    def _changed_packed_ids(self, old_head, new_head):
+        """Returns the set of ids of the tasks whose packed record changed
+           between 'old_head' and 'new_head' (a rewritten record is appended
+           at a new offset), or None if the segment was compacted"""
+        indexes = []
+        for revision in (old_head, new_head):
+            data = self._reader.read(
+                "{}:{}".format(revision, self._store.index_file))
+            try:
+                indexes.append(packstore.index_entries(data) if data
+                               else (0, {}))
+            except ValueError:
+                return None
+
+        (old_generation, old_entries), (new_generation, new_entries) = \
+            indexes
+        if old_entries and old_generation != new_generation:
+            return None  # every record moved
+        return {task_id for task_id in old_entries.keys() | new_entries.keys()
+                if old_entries.get(task_id) != new_entries.get(task_id)}
+
+    def close(self):
+        """Releases the resources (reader process) held by the repository"""
+        self._reader.close()
 
     @property
     def task_path(self):
@@ -138,8 +772,9 @@ def get_repository(location=None):
     if location is None:
         location = DEFAULT_REPOSITORY_PATH
 
-    if REPOSITORY is None:
-        REPOSITORY = TaskRepo(location)
+    with _REPOSITORY_GUARD:
+        if REPOSITORY is None:
+            REPOSITORY = TaskRepo(location)
 
     return REPOSITORY
 
@@ -154,3 +789,9 @@ def read_task(task_file):
     """Reads & returns string data from 'task_file'"""
     taskrepo = get_repository()
     return taskrepo.read_task(task_file)
+
+
+def close():
+    """Releases resources held by the repository singleton, if any"""
+    if REPOSITORY is not None:
+        REPOSITORY.close()
@@ -0,0 +1,169 @@
+"""Archive of closed tasks.
+
+Closed tasks are appended to monthly segments ('YYYY-MM.jsonl.gz', named by
+the UTC month; one JSON record per line holding the close time & the task's
+data) next to a small index of the ids in each segment ('YYYY-MM.ids').
+Appends add a new gzip member to the segment, so nothing is ever rewritten.
+Segments & indexes are only opened when a lookup misses the live structures
+or a history query covers their month; opening the graveyard itself costs
+nothing, however many tasks have been closed.  History queries take local
+dates, like the closing times shown to the user.
+"""
+
+import bisect
+import datetime
+import gzip
+import json
+import os
+import time
+
+SEGMENT_SUFFIX = ".jsonl.gz"
+INDEX_SUFFIX = ".ids"
+
+
+def _segment_name(closed):
+    """Returns the name of the segment holding tasks closed at 'closed'
+       (seconds since the epoch)"""
+    closed_at = datetime.datetime.fromtimestamp(closed, datetime.timezone.utc)
+    return closed_at.strftime("%Y-%m")
+
+
+class Graveyard(object):
+    """Lazily opened, time-segmented archive of closed tasks.  Iterating
+       yields only the tasks buried (& not yet flushed) in this session."""
+    def __init__(self, directory):
+        self._directory = directory
+        self._pending = []  # (closed, task) buried since the last flush
+        self._indexes = {}  # segment name -> sorted list of ids
+
+    def __iter__(self):
+        """Object iterator over the tasks buried in this session"""
+        for _, task in self._pending:
+            yield task
+
+    @property
+    def pending(self):
+        """Property accessor: True if tasks were buried since the last
+           flush"""
+        return bool(self._pending)
+
+    def bury(self, task, closed=None):
+        """Archives 'task', closed at 'closed' (seconds since the epoch;
+           defaults to now).  Nothing is written before flush()."""
+        if closed is None:
+            closed = time.time()
+        self._pending.append((closed, task))
+
+    def savepoint(self):
+        """Returns a marker of the tasks buried so far, for rollback_to()"""
+        return len(self._pending)
+
+    def rollback_to(self, savepoint):
+        """Forgets the tasks buried (& not flushed) since 'savepoint'"""
+        del self._pending[savepoint:]
+
+    def flush(self):
+        """Appends the tasks buried since the last flush to their segments"""
+        if not self._pending:
+            return
+
+        os.makedirs(self._directory, exist_ok=True)
+        segments = {}
+        for closed, task in self._pending:
+            segments.setdefault(_segment_name(closed), []).append(
+                (closed, task))
+
+        for name, buried in sorted(segments.items()):
+            records = "".join(
+                json.dumps({"closed": closed, "task": task.dict()},
+                           sort_keys=True) + "\n"
+                for closed, task in buried)
+            with gzip.open(self._path(name, SEGMENT_SUFFIX), "at") as outfile:
+                outfile.write(records)
+            with open(self._path(name, INDEX_SUFFIX), "a") as outfile:
+                outfile.write("".join(task.id + "\n" for _, task in buried))
+            self._indexes.pop(name, None)
+        self._pending = []
+
+    def _path(self, name, suffix):
+        """Returns the path of segment 'name''s file with 'suffix'"""
+        return os.path.join(self._directory, name + suffix)
+
+    def segments(self):
+        """Returns the sorted list of segment names"""
+        try:
+            filenames = os.listdir(self._directory)
+        except FileNotFoundError:
+            return []
+        return sorted(filename[:-len(INDEX_SUFFIX)] for filename in filenames
+                      if filename.endswith(INDEX_SUFFIX))
+
+    def _index(self, name):
+        """Returns the sorted ids of segment 'name', loading them once"""
+        ids = self._indexes.get(name)
+        if ids is None:
+            with open(self._path(name, INDEX_SUFFIX)) as infile:
+                ids = sorted(set(infile.read().split()))
+            self._indexes[name] = ids
+        return ids
+
+    def matches(self, prefix):
+        """Returns the sorted list of archived ids starting with 'prefix'"""
+        found = set()
+        for name in self.segments():
+            ids = self._index(name)
+            position = bisect.bisect_left(ids, prefix)
+            while position < len(ids) and ids[position].startswith(prefix):
+                found.add(ids[position])
+                position += 1
+        return sorted(found)
+
+    def _records(self, names):
+        """Yields the (closed, task dict) records of segments 'names'"""
+        for name in names:
+            with gzip.open(self._path(name, SEGMENT_SUFFIX), "rt") as infile:
+                for line in infile:
+                    record = json.loads(line)
+                    yield record["closed"], record["task"]
+
+    def find(self, task_id):
+        """Returns (closed, task dict) for the archived task 'task_id' (the
+           latest record if it was closed more than once), or None"""
+        names = []
+        for name in self.segments():
+            ids = self._index(name)
+            position = bisect.bisect_left(ids, task_id)
+            if position < len(ids) and ids[position] == task_id:
+                names.append(name)
+        found = None
+        for closed, task_dict in self._records(names):
+            if task_dict["id"] == task_id:
+                found = (closed, task_dict)
+        return found
+
+    def history(self, since=None, until=None):
+        """Returns the list of (closed, task dict) records of tasks closed
+           between datetime.date 'since' & 'until' (inclusive, in local
+           time, as closing times are shown), oldest first"""
+        # the local days' bounds, as times (segments are named in UTC)
+        start = end = None
+        first, last = "", "9999-99"
+        if since is not None:
+            start = datetime.datetime.combine(since,
+                                              datetime.time()).timestamp()
+            first = _segment_name(start)
+        if until is not None:
+            end = datetime.datetime.combine(until + datetime.timedelta(1),
+                                            datetime.time()).timestamp()
+            last = _segment_name(end)
+        names = [name for name in self.segments() if first <= name <= last]
+
+        records = []
+        for closed, task_dict in self._records(names):
+            if start is not None and closed < start:
+                continue
+            if end is not None and closed >= end:
+                continue
+            records.append((closed, task_dict))
+        records.sort(key=lambda record: record[0])
+        return records
@@ -6,18 +6,21 @@
 # logger.setLevel(logging.INFO)
 
 import argparse
+import importlib
+import json
 import logging
 import os
-try:
-    import argcomplete
-except ImportError:
-    argcomplete = None
+import sys
 
+import atomicfile
+import daemon
 from custom_logger import get_logger
 log = get_logger('task')
 
 version = "1.0.0"
 
+MANIFEST_FILE = ".commands.json"  # cached cmd_* modules & their commands
+
 
 # def initialize_settings(settings_file_name):
 #     global settings
@@ -30,58 +33,173 @@ version = "1.0.0"
 #                       separators=(',', ': '))
 
 
-def find_commands():
-    """Dynamically discover cmd_*.py files and return the list of names
-       to import"""
-    all_commands = []
-    for (_, _, filenames) in os.walk(os.path.dirname(
-            os.path.realpath(__file__))):
-        filenames = [filename for filename in filenames
-                     if filename.startswith("cmd_") and
-                     filename.endswith(".py")]
-        commands = [filename[:-3] for filename in filenames]
-        all_commands.extend(commands)
-    return all_commands
+class _CommandRecorder(object):  # pylint: disable=too-few-public-methods
+    """Stands in for the subparsers object passed to a command's
+       create_parser(), recording the name & help of the command it adds"""
+    def __init__(self):
+        self.command = None
 
+    def add_parser(self, name, **kwargs):
+        """Records the command & returns a throwaway parser to declare its
+           arguments on"""
+        if self.command is not None:
+            raise TypeError("Cannot record several subparsers")
+        self.command = {"name": name, "help": kwargs.get("help")}
+        return argparse.ArgumentParser(prog=name)
+
+
+def _describe_command(module_name):
+    """Returns the {"name", "help"} description of the command declared by
+       module 'module_name', or None if it cannot be told without building
+       its parser (the module is then imported on every run)"""
+    module = importlib.import_module(module_name)
+    recorder = _CommandRecorder()
+    try:
+        module.create_parser(recorder)
+    except (AttributeError, TypeError) as error:
+        log.debug("cannot describe the command of %s: %s", module_name,
+                  error)
+        return None
+    return recorder.command
+
+
+def _scan_commands(directory):
+    """Returns the {cmd_* module name: mtime} map of 'directory' (not
+       recursive)"""
+    modules = {}
+    for filename in os.listdir(directory):
+        if filename.startswith("cmd_") and filename.endswith(".py"):
+            path = os.path.join(directory, filename)
+            modules[filename[:-3]] = os.stat(path).st_mtime_ns
+    return modules
+
+
+def _manifest_is_current(directory, manifest, manifest_mtime):
+    """Returns True if no cmd_*.py file of 'directory' was added, removed
+       or changed since 'manifest' (stamped 'manifest_mtime') was made"""
+    if os.stat(directory).st_mtime_ns != manifest_mtime:
+        return False  # files were added, removed or renamed
+    try:
+        return all(
+            os.stat(os.path.join(directory, module + ".py")).st_mtime_ns ==
+            entry["mtime"] for module, entry in manifest.items())
+    except OSError:
+        return False
+
+
+def load_manifest(directory=None):
+    """Return the {cmd_* module: command description (or None)} manifest
+       cached in the program 'directory' (see _describe_command()).  It is
+       refreshed when a cmd_*.py file changes, importing only the changed
+       modules.  Only the directory itself is searched; not the task
+       repository below it."""
+    if directory is None:
+        directory = os.path.dirname(os.path.realpath(__file__))
+    path = os.path.join(directory, MANIFEST_FILE)
+
+    try:
+        with open(path) as infile:
+            manifest_mtime = os.fstat(infile.fileno()).st_mtime_ns
+            manifest = json.loads(infile.read())
+        if _manifest_is_current(directory, manifest, manifest_mtime):
+            return {module: entry["command"]
+                    for module, entry in manifest.items()}
+    except (OSError, ValueError, TypeError, KeyError, AttributeError):
+        manifest = {}  # missing or damaged: rebuild it
+    if not isinstance(manifest, dict):
+        manifest = {}
+
+    directory_mtime = os.stat(directory).st_mtime_ns
+    entries = {}
+    for module, mtime in _scan_commands(directory).items():
+        entry = manifest.get(module)
+        if not isinstance(entry, dict) or entry.get("mtime") != mtime or \
+                "command" not in entry:
+            entry = {"mtime": mtime, "command": _describe_command(module)}
+        entries[module] = entry
+    try:
+        if os.stat(directory).st_mtime_ns == directory_mtime:
+            atomicfile.write_atomic(path, json.dumps(entries, sort_keys=True))
+            # writing the manifest changes the directory's mtime: stamp the
+            # manifest with it (touching a file leaves the directory as is)
+            directory_mtime = os.stat(directory).st_mtime_ns
+            os.utime(path, ns=(directory_mtime, directory_mtime))
+    except OSError as error:  # e.g. a read-only installation
+        log.debug("cannot cache the command manifest: %s", error)
+    return {module: entry["command"] for module, entry in entries.items()}
+
+
+def find_commands(directory=None):
+    """Return the sorted list of cmd_* modules in the program 'directory'"""
+    return sorted(load_manifest(directory))
+
+
+def _selected_command(params):
+    """Returns the command named by the command-line arguments 'params'
+       (the first one that is not an option), or None"""
+    for param in params:
+        if not param.startswith("-"):
+            return param
+    return None
+
+
+def create_command_line_parser(commands, params=None):
+    """Create top level command-line parser from the {module: command
+       description} map 'commands' (see load_manifest()).  Given the
+       command-line arguments 'params', only the module of the command they
+       select is imported to build its parser; the other commands are only
+       listed (for --help & completion)."""
+    if "_ARGCOMPLETE" in os.environ:  # only set while completing
+        # the command is selected by the line being completed
+        line = os.environ.get("COMP_LINE", "")
+        params = line[:int(os.environ.get("COMP_POINT", len(line)))].split()
+        params = params[1:]
+    selected = _selected_command(params) if params is not None else None
 
-def create_command_line_parser(modules):
-    """Create top level command-line parser"""
     parser = argparse.ArgumentParser()
     parser.add_argument('--version', action='version',
                         version='%(prog)s version {}'.format(version))
     parser.add_argument("-v", "--verbosity", action="count", default=0,
                         help="increase output verbosity")
-    subparsers = parser.add_subparsers(title="commands", metavar=None)
+    subparsers = parser.add_subparsers(title="commands", metavar=None,
+                                       dest="command")
+
+    for module_name, command in sorted(commands.items()):
+        if params is None or command is None or command["name"] == selected:
+            importlib.import_module(module_name).create_parser(subparsers)
+        else:
+            subparsers.add_parser(command["name"], help=command["help"])
+
+    if "_ARGCOMPLETE" in os.environ:  # only set while completing
+        try:
+            import argcomplete  # pylint: disable=import-outside-toplevel
+        except ImportError:
+            pass
+        else:
+            argcomplete.autocomplete(parser)
+    return parser
 
-    for module in modules:
-        module.create_parser(subparsers)
 
-    if argcomplete:
-        argcomplete.autocomplete(parser)
-    return parser
+def set_verbosity(verbosity):
+    """Sets the log level for the -v count 'verbosity'"""
+    if verbosity >= 2:
+        log.setLevel(logging.DEBUG)
+    elif verbosity == 1:
+        log.setLevel(logging.INFO)
+    else:
+        log.setLevel(logging.WARNING)
 
 
 def main(params):
     """Create top level command-line parser"""
-    commands = find_commands()
-    command_modules = []
-    for command in commands:
-        new_module = __import__(command)
-        command_modules.append(new_module)
-
-    parser = create_command_line_parser(command_modules)
+    parser = create_command_line_parser(load_manifest(), params)
     parsed_args = parser.parse_args(params)
 
     if not hasattr(parsed_args, "func"):
         parser.print_help()
         return 1
 
-    if parsed_args.verbosity >= 2:
-        log.setLevel(logging.DEBUG)
-    elif parsed_args.verbosity == 1:
-        log.setLevel(logging.INFO)
-    else:
-        log.setLevel(logging.WARNING)
+    set_verbosity(parsed_args.verbosity)
 
     # print("VERBOSITY: {}".format(parsed_args.verbosity))
     # print("LEVEL: {}".format(log.getEffectiveLevel()))
@@ -90,6 +208,18 @@ def main(params):
     # updater.update()
     # initialize_settings("$HOME/.task/settings")
 
+    if _forwardable(parsed_args):
+        try:
+            response = daemon.forward(params, tty=sys.stdout.isatty())
+        except RuntimeError as error:
+            print(error, file=sys.stderr)
+            return 1
+        if response is not None:
+            sys.stdout.write(response["output"])
+            if response["error"]:
+                print(response["error"], file=sys.stderr)
+            return response["status"]
+
     retval = 0
     try:
         parsed_args.func(parsed_args)
@@ -97,3 +227,11 @@ def main(params):
         retval = 1
 
     return retval
+
+
+def _forwardable(parsed_args):
+    """Returns True if the parsed command may run in the task daemon (see
+       daemon), if one is running"""
+    return parsed_args.command not in daemon.LOCAL_COMMANDS and \
+        not getattr(parsed_args, "edit", False) and \
+        not os.environ.get(daemon.WORKER_ENV)
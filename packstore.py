@@ -0,0 +1,324 @@
+"""Packed task store.
+
+All task records live in one append-only segment file ('<name>.pack') next to
+a fixed-width index ('<name>.idx') of (task id, offset, length) entries sorted
+by task id.  Both files are read through mmap: a lookup is a binary search
+over the index plus a zero-copy slice of the segment.  Writes are appended to
+the segment and kept in an in-memory overlay until flush() rewrites the
+index; flush() also compacts the segment once dead (superseded) records take
+up more space than live ones.
+
+The index names the generation of its segment: compaction writes a new
+segment ('<name>.<generation>.pack') & then switches to it by replacing the
+index, so that an interrupted compaction leaves the old pair intact.  A
+store notices an index replaced by another process on refresh().
+"""
+
+import mmap
+import os
+import struct
+import threading
+
+INDEX_MAGIC = b"TASKIDX2"  # followed by the segment generation
+LEGACY_INDEX_MAGIC = b"TASKIDX1"  # no generation: segment '<name>.pack'
+GENERATION = struct.Struct(">Q")
+INDEX_ENTRY = struct.Struct(">32sQI")  # task id, offset, length
+ID_WIDTH = 32  # uuid hex; shorter ids are NUL-padded
+
+
+def parse_header(header):
+    """Returns (header size, segment generation) of the index starting with
+       'header', or None if it is not a task index"""
+    if header[:len(LEGACY_INDEX_MAGIC)] == LEGACY_INDEX_MAGIC:
+        return len(LEGACY_INDEX_MAGIC), 0
+    if header[:len(INDEX_MAGIC)] != INDEX_MAGIC or \
+            len(header) < len(INDEX_MAGIC) + GENERATION.size:
+        return None
+    generation, = GENERATION.unpack_from(header, len(INDEX_MAGIC))
+    return len(INDEX_MAGIC) + GENERATION.size, generation
+
+
+def index_entries(data):
+    """Returns (segment generation, {task id: (offset, length)}) of the
+       index file contents 'data' (bytes).  Raises ValueError if 'data' is
+       not a task index."""
+    header = parse_header(data)
+    if header is None:
+        raise ValueError("Invalid task index")
+    header_size, generation = header
+    end = header_size + \
+        (len(data) - header_size) // INDEX_ENTRY.size * INDEX_ENTRY.size
+    entries = {}
+    for entry_id, offset, length in \
+            INDEX_ENTRY.iter_unpack(data[header_size:end]):
+        entries[entry_id.rstrip(b"\0").decode()] = (offset, length)
+    return generation, entries
+
+
+class PackedTaskStore(object):
+    """Single packed, memory-mapped store of task records keyed by task id.
+       Thread-safe; memoryviews returned by read() stay valid until the
+       caller releases them, even across flush()/compact()."""
+    def __init__(self, directory, name="tasks"):
+        self._directory = directory
+        self._name = name
+        self.index_file = name + ".idx"
+        self._lock = threading.RLock()
+        self._pack_map = None
+        self._index_map = None
+        self._index_stat = None  # (inode, mtime, size) of the mapped index
+        self._index_count = 0
+        self._header_size = len(INDEX_MAGIC) + GENERATION.size
+        self._generation = None  # segment generation; read on first use
+        self._overlay = {}  # task id -> (offset, length) since last flush
+
+    def _pack_name(self, generation):
+        """Returns the segment file name of 'generation'"""
+        if generation == 0:
+            return self._name + ".pack"
+        return "{}.{}.pack".format(self._name, generation)
+
+    @property
+    def pack_file(self):
+        """Property accessor for the current segment file name"""
+        if self._generation is None:
+            self._generation = self._read_generation()
+        return self._pack_name(self._generation)
+
+    def stale_files(self):
+        """Returns the segment file names of the earlier generations"""
+        self.pack_file  # pylint: disable=pointless-statement
+        return [self._pack_name(generation)
+                for generation in range(self._generation)]
+
+    @property
+    def pack_path(self):
+        """Property accessor for the absolute segment file path"""
+        return os.path.join(self._directory, self.pack_file)
+
+    @property
+    def index_path(self):
+        """Property accessor for the absolute index file path"""
+        return os.path.join(self._directory, self.index_file)
+
+    def exists(self):
+        """Returns True if the store has been created on disk"""
+        return os.path.exists(self.index_path)
+
+    @staticmethod
+    def _map(path):
+        """Returns a read-only mmap of 'path', or None if it is empty or does
+           not exist"""
+        try:
+            with open(path, "rb") as infile:
+                if os.fstat(infile.fileno()).st_size == 0:
+                    return None
+                return mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return None
+
+    def _parse_header(self, header):
+        """Returns (header size, segment generation) of the index starting
+           with 'header'"""
+        parsed = parse_header(header)
+        if parsed is None:
+            raise IOError("Invalid task index: '{}'".format(self.index_path))
+        return parsed
+
+    def _read_generation(self):
+        """Returns the segment generation named by the index on disk"""
+        try:
+            with open(self.index_path, "rb") as infile:
+                header = infile.read(len(INDEX_MAGIC) + GENERATION.size)
+        except FileNotFoundError:
+            return 0
+        return self._parse_header(header)[1] if header else 0
+
+    def _stat_index(self):
+        """Returns the (inode, mtime, size) of the index file, or None"""
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _open_index(self):
+        """Maps the index file (& switches to the segment it names)"""
+        self._index_stat = self._stat_index()
+        self._index_map = PackedTaskStore._map(self.index_path)
+        self._index_count = 0
+        generation = 0
+        if self._index_map is not None:
+            self._header_size, generation = \
+                self._parse_header(self._index_map[:len(INDEX_MAGIC) +
+                                                   GENERATION.size])
+            self._index_count = (len(self._index_map) - self._header_size) \
+                // INDEX_ENTRY.size
+        if generation != self._generation:
+            self._generation = generation
+            self._pack_map = None
+
+    def refresh(self):
+        """Drops the mapped index if another store (e.g. in another process)
+           replaced it since it was mapped, so that the next lookup sees the
+           records it saved & the segment it compacted into"""
+        with self._lock:
+            if self._index_map is not None and not self._overlay and \
+                    self._stat_index() != self._index_stat:
+                self._index_map = None
+
+    def _entry(self, position):
+        """Returns the (id, offset, length) index entry at 'position'"""
+        return INDEX_ENTRY.unpack_from(
+            self._index_map, self._header_size + position * INDEX_ENTRY.size)
+
+    def _search(self, key):
+        """Binary search of the on-disk index for the task id 'key' (bytes);
+           returns (offset, length) or None"""
+        low, high = 0, self._index_count
+        while low < high:
+            middle = (low + high) // 2
+            start = self._header_size + middle * INDEX_ENTRY.size
+            entry_id = self._index_map[start:start + ID_WIDTH]
+            if entry_id < key:
+                low = middle + 1
+            elif entry_id > key:
+                high = middle
+            else:
+                _, offset, length = self._entry(middle)
+                return offset, length
+        return None
+
+    def _locate(self, task_id):
+        """Returns (offset, length) of the latest record for 'task_id', or
+           None"""
+        location = self._overlay.get(task_id)
+        if location is not None:
+            return location
+
+        if self._index_map is None:
+            self._open_index()
+            if self._index_map is None:
+                return None
+
+        return self._search(PackedTaskStore._key(task_id))
+
+    @staticmethod
+    def _key(task_id):
+        """Returns the fixed-width index key of 'task_id'"""
+        return task_id.encode().ljust(ID_WIDTH, b"\0")
+
+    def read(self, task_id):
+        """Returns a zero-copy memoryview of the record for 'task_id', or
+           None if the store does not contain it"""
+        with self._lock:
+            for _ in range(2):
+                location = self._locate(task_id)
+                if location is None:
+                    return None
+
+                offset, length = location
+                if self._pack_map is None or \
+                        offset + length > len(self._pack_map):
+                    # first read, or the segment grew since it was mapped
+                    self._pack_map = PackedTaskStore._map(self.pack_path)
+                if self._pack_map is not None and \
+                        offset + length <= len(self._pack_map):
+                    return memoryview(self._pack_map)[offset:offset + length]
+                # another store compacted the segment away: reload the index
+                self.refresh()
+            raise IOError("Missing task segment: '{}'".format(self.pack_path))
+
+    def write(self, task_id, data):
+        """Appends the record 'data' (bytes) for 'task_id'"""
+        if not task_id or len(task_id.encode()) > ID_WIDTH:
+            raise ValueError("Invalid task id: '{}'".format(task_id))
+
+        with self._lock:
+            if not self._overlay:
+                # another store may have compacted the segment meanwhile
+                self._index_map = None
+                self._pack_map = None
+                self._generation = None
+            with open(self.pack_path, "ab") as outfile:
+                offset = outfile.tell()
+                outfile.write(data)
+            self._overlay[task_id] = (offset, len(data))
+
+    def _entries(self):
+        """Returns the {task id: (offset, length)} map of all live records"""
+        if self._index_map is None:
+            self._open_index()
+
+        entries = {}
+        for position in range(self._index_count):
+            entry_id, offset, length = self._entry(position)
+            entries[entry_id.rstrip(b"\0").decode()] = (offset, length)
+        entries.update(self._overlay)
+        return entries
+
+    def _write_index(self, entries, generation):
+        """Atomically replaces the index with the sorted 'entries' of the
+           segment 'generation'"""
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, "wb") as outfile:
+            outfile.write(INDEX_MAGIC + GENERATION.pack(generation))
+            for task_id in sorted(entries):
+                offset, length = entries[task_id]
+                outfile.write(INDEX_ENTRY.pack(
+                    PackedTaskStore._key(task_id), offset, length))
+        os.replace(temp_path, self.index_path)
+
+        # drop (don't close) old maps: callers may still hold views of them
+        self._index_map = None
+        self._header_size = len(INDEX_MAGIC) + GENERATION.size
+        self._generation = generation
+        self._overlay = {}
+
+    def flush(self):
+        """Publishes appended records to the index, compacting the segment
+           if it holds more dead than live data.  Returns True if anything
+           changed on disk."""
+        with self._lock:
+            if not self._overlay and self.exists():
+                return False
+
+            entries = self._entries()
+            live_bytes = sum(length for _, length in entries.values())
+            pack_size = os.path.getsize(self.pack_path) \
+                if os.path.exists(self.pack_path) else 0
+            if pack_size - live_bytes > live_bytes:
+                self._compact(entries)
+            else:
+                self._write_index(entries, self._generation)
+            return True
+
+    def compact(self):
+        """Rewrites the segment with only the live records"""
+        with self._lock:
+            self._compact(self._entries())
+
+    def _compact(self, entries):
+        """Rewrites the segment with only the records in 'entries', as the
+           next generation"""
+        old_path = self.pack_path
+        pack_map = PackedTaskStore._map(old_path)
+        generation = self._generation + 1
+        compacted = {}
+        with open(os.path.join(self._directory, self._pack_name(generation)),
+                  "wb") as outfile:
+            for task_id in sorted(entries):
+                offset, length = entries[task_id]
+                compacted[task_id] = (outfile.tell(), length)
+                outfile.write(pack_map[offset:offset + length])
+        # the index names its segment: replacing it switches atomically
+        self._write_index(compacted, generation)
+        self._pack_map = None
+        try:
+            os.remove(old_path)
+        except FileNotFoundError:
+            pass
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries())
@@ -1,10 +1,25 @@
-"""Iterable concurrent PriorityQueue implementation"""
+"""Iterable concurrent PriorityQueue implementation
+
+Locking & scalability profile of PriorityQueue:
+* Writers (put/get/remove/change_priority) serialize on one lock & hold it
+  for O(log n) work only.
+* Readers iterate immutable snapshots.  A snapshot is built (O(n log n),
+  under the lock) at most once per queue version & then shared by every
+  reader until the next write, so iteration never blocks writers for long,
+  never observes a half-applied write & is safe while other threads write.
+* size()/empty() are lock-free.
+* get(block=True, timeout=...) waits on a condition variable like
+  queue.Queue, without polling.
+Read-mostly workloads therefore scale with the number of readers; a write
+after every read degrades iteration to one O(n log n) copy per write.  See
+bench_priority_queue.py for a contention benchmark.
+"""
 # pylint: disable=W0511
 # FIXME: It's a bit ridiculous that we have to add the above disable just to
 #        allow TODOs & FIXMEs
-# TODO - currently a VERY dumb, coarse-grained locking implementation
 
 import threading
+import time
 
 from queue import Empty
 
@@ -49,109 +64,163 @@ class IterQueue(object):
 
 
 class PriorityQueue(object):
-    """Simple concurrent priority queue. Follows the Unix priority model."""
+    """Simple concurrent priority queue. Follows the Unix priority model.
+
+       Backed by a binary heap of [priority, sequence, item] entries plus an
+       index of each item's heap position, so put/get/remove/change_priority
+       are O(log n) while size & peek are O(1).  The sequence number keeps
+       items of equal priority in FIFO order.  Items must be hashable & may
+       only be queued once."""
     DEFAULT_PRIORITY = 0
 
     def __init__(self):
-        self._levels = []
+        self._heap = []
         self._lock = threading.Lock()
-        self._queues = {}
+        self._not_empty = threading.Condition(self._lock)
+        self._positions = {}  # item -> index of its entry in self._heap
+        self._sequence = 0
+        self._version = 0  # bumped by every write
+        self._snapshot = (0, ())  # (version, sorted (item, priority) tuple)
 
     def __iter__(self):
-        """Object iterator"""
-        for level in self._levels:
-            for item in self._queues[level]:
-                yield item
+        """Object iterator (highest priority first) over a snapshot of the
+           queue; concurrent writes do not affect a running iteration"""
+        for item, _ in self._sorted_snapshot():
+            yield item
 
-    def put(self, item, priority=None):
-        """Add an item to the priority queue"""
+    def __len__(self):
+        return len(self._heap)
+
+    def __contains__(self, item):
+        return item in self._positions
+
+    @staticmethod
+    def _less(entry_a, entry_b):
+        """Heap order: priority, then insertion sequence"""
+        return (entry_a[0], entry_a[1]) < (entry_b[0], entry_b[1])
+
+    def _place(self, entry, position):
+        """Stores 'entry' at heap index 'position'"""
+        self._heap[position] = entry
+        self._positions[entry[2]] = position
+
+    def _sift_up(self, position):
+        """Moves the entry at 'position' towards the root"""
+        entry = self._heap[position]
+        while position > 0:
+            parent = (position - 1) // 2
+            if not PriorityQueue._less(entry, self._heap[parent]):
+                break
+            self._place(self._heap[parent], position)
+            position = parent
+        self._place(entry, position)
+
+    def _sift_down(self, position):
+        """Moves the entry at 'position' towards the leaves"""
+        entry = self._heap[position]
+        size = len(self._heap)
+        while True:
+            child = 2 * position + 1
+            if child >= size:
+                break
+            if child + 1 < size and \
+                    PriorityQueue._less(self._heap[child + 1],
+                                        self._heap[child]):
+                child += 1
+            if not PriorityQueue._less(self._heap[child], entry):
+                break
+            self._place(self._heap[child], position)
+            position = child
+        self._place(entry, position)
+
+    def _pop_at(self, position):
+        """Removes & returns the heap entry at 'position'"""
+        entry = self._heap[position]
+        last = self._heap.pop()
+        del self._positions[entry[2]]
+        if position < len(self._heap):
+            self._place(last, position)
+            self._sift_up(position)
+            self._sift_down(self._positions[last[2]])
+        return entry
+
+    def put(self, item, priority=None, sequence=None):
+        """Add an item to the priority queue.  Passing the 'sequence' of a
+           removed item (see sequence()) puts it back in its former place
+           among the items of equal priority."""
         if priority is None:
             priority = PriorityQueue.DEFAULT_PRIORITY
 
-        self._lock.acquire()
-        try:
-            queue = self._queues.get(priority)
-            if queue is None:
-                queue = IterQueue()
-                self._queues[priority] = queue
-                self._levels.append(priority)
-                self._levels.sort()
-
-            queue.put(item)
-            self._queues[priority] = queue
-        finally:
-            self._lock.release()
-
-    def get(self):
-        """Removes & returns the highest priority item"""
-        ret = self.get_tuple()
+        with self._lock:
+            if item in self._positions:
+                raise ValueError(f"Item is already queued: '{item}'")
+
+            if sequence is None:
+                self._sequence += 1
+                sequence = self._sequence
+            self._heap.append([priority, sequence, item])
+            self._sift_up(len(self._heap) - 1)
+            self._version += 1
+            self._not_empty.notify()
+
+    def get(self, block=False, timeout=None):
+        """Removes & returns the highest priority item.  Unlike queue.Queue,
+           does not block by default; see get_tuple()."""
+        ret = self.get_tuple(block, timeout)
         return ret[0]
 
-    def get_tuple(self):
-        """Removes & returns a tuple of (value, priority)"""
-        self._lock.acquire()
-        try:
-            if not self._levels:
-                raise Empty
+    def get_tuple(self, block=False, timeout=None):
+        """Removes & returns a tuple of (value, priority).  If the queue is
+           empty, raises Empty unless 'block' is set, in which case it waits
+           up to 'timeout' seconds (forever if None) for an item."""
+        with self._not_empty:
+            if block:
+                deadline = None if timeout is None \
+                    else time.monotonic() + timeout
+                while not self._heap:
+                    remaining = None if deadline is None \
+                        else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        break
+                    self._not_empty.wait(remaining)
 
-            level = self._levels[0]
-            queue = self._queues[level]
-            ret = queue.get()
-            if queue.empty():
-                del self._queues[level]
-                self._levels.pop(0)
+            if not self._heap:
+                raise Empty
 
-            return ret, level
-        finally:
-            self._lock.release()
+            priority, _, item = self._pop_at(0)
+            self._version += 1
+            return item, priority
 
     def remove(self, item):
-        """Removes & returns a tuple of (value, priority)"""
-        self._lock.acquire()
-        try:
-            if not self._levels:
-                raise Empty
-
-            for level in self._levels:
-                queue = self._queues[level]
-                to_remove = None
-                for idx, queued_item in enumerate(queue):
-                    if queued_item == item:
-                        to_remove = idx
-                        break
-                if to_remove is not None:
-                    ret = queue.get(to_remove)
-                    if queue.empty():
-                        del self._queues[level]
-                        self._levels.pop(0)
-                    return ret
-            raise KeyError
-        finally:
-            self._lock.release()
-
-    # def remove_by_id(self, id):
-    #     """Removes & returns a tuple of (value, priority)"""
-    #     self._lock.acquire()
-    #     try:
-    #         if not self._levels:
-    #             raise Empty
-    #
-    #         for level in self._levels:
-    #             queue = self._queues[level]
-    #             to_remove = None
-    #             for idx, item in enumerate(queue):
-    #                 if item.id.startswith(id):
-    #                     to_remove = idx
-    #                     break
-    #             if to_remove:
-    #                 ret = queue.get(to_remove)
-    #                 if queue.empty():
-    #                     del self._queues[level]
-    #                     self._levels.pop(0)
-    #                 return ret
-    #         raise KeyError
-    #     finally:
-    #         self._lock.release()
+        """Removes & returns 'item'.  Raises KeyError if it is not queued."""
+        with self._lock:
+            if item not in self._positions:
+                raise KeyError(item)
+
+            self._pop_at(self._positions[item])
+            self._version += 1
+            return item
+
+    def change_priority(self, item, priority):
+        """Moves the queued 'item' to 'priority' (behind the items already
+           at that priority).  Raises KeyError if it is not queued."""
+        with self._lock:
+            position = self._positions[item]
+            self._sequence += 1
+            self._heap[position][0:2] = [priority, self._sequence]
+            self._sift_up(position)
+            self._sift_down(self._positions[item])
+            self._version += 1
+
+    def priority(self, item):
+        """Returns the priority of the queued 'item'"""
+        with self._lock:
+            return self._heap[self._positions[item]][0]
+
+    def sequence(self, item):
+        """Returns the insertion sequence number of the queued 'item'"""
+        with self._lock:
+            return self._heap[self._positions[item]][1]
 
     def peek(self):
         """Returns the highest priority item without removing it"""
@@ -160,33 +229,35 @@ class PriorityQueue(object):
 
     def peek_tuple(self):
         """Returns a tuple of (value, priority) without removing it"""
-        self._lock.acquire()
-        try:
-            if not self._levels:
+        with self._lock:
+            if not self._heap:
                 raise Empty
 
-            return self._queues[self._levels[0]].peek()
-        finally:
-            self._lock.release()
+            priority, _, item = self._heap[0]
+            return item, priority
 
     def size(self):
         """Returns the total number of items in the queue"""
-        self._lock.acquire()
-        try:
-            # sum([]) returns 0 in Python; the below expression is always safe
-            return sum([len(queue) for queue in self._queues.values()])
-        finally:
-            self._lock.release()
+        return len(self._heap)
 
     def empty(self):
         """Returns True if there are 0 items in the queue; False otherwise"""
         return self.size() == 0
 
-    def items(self):
-        """Returns a list of (item, priority) tuples"""
-        ret = []
-        for level in self._levels:
-            for item in self._queues[level]:
-                ret.append((item, level))
+    def _sorted_snapshot(self):
+        """Returns the (shared, immutable) tuple of (item, priority) pairs in
+           priority order for the current version of the queue"""
+        snapshot = self._snapshot
+        if snapshot[0] == self._version:
+            return snapshot[1]
+
+        with self._lock:
+            if self._snapshot[0] != self._version:
+                entries = sorted(self._heap, key=lambda entry: entry[:2])
+                self._snapshot = (self._version, tuple(
+                    (item, priority) for priority, _, item in entries))
+            return self._snapshot[1]
 
-        return ret
+    def items(self):
+        """Returns a list of (item, priority) tuples in priority order"""
+        return list(self._sorted_snapshot())
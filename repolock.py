@@ -0,0 +1,104 @@
+"""Cross-process coordination of concurrent task commands.
+
+Every command loads the structure files optimistically, under a brief shared
+lock, & remembers their version stamps.  Saving takes the exclusive lock,
+re-reads the stamps & writes each changed structure: directly if nobody else
+wrote it since the load, or else after a three-way merge of this session's
+changes into the other writer's version.  Locks are fcntl (flock) locks on a
+lock file in the repository, so they are released if a process dies.
+"""
+
+import contextlib
+import fcntl
+import json
+import os
+
+import atomicfile
+
+LOCK_FILE = "task.lock"
+VERSIONS_FILE = "versions.json"
+
+
+class RepositoryLock(object):
+    """Shared/exclusive lock on the repository at 'location'"""
+    def __init__(self, location):
+        self._path = os.path.join(location, LOCK_FILE)
+
+    @contextlib.contextmanager
+    def _locked(self, operation):
+        """Holds the lock in mode 'operation' (fcntl.LOCK_SH or LOCK_EX)"""
+        fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            fcntl.flock(fd, operation)
+            yield self
+        finally:
+            os.close(fd)  # also releases the lock
+
+    def shared(self):
+        """Context manager holding the lock for reading"""
+        return self._locked(fcntl.LOCK_SH)
+
+    def exclusive(self):
+        """Context manager holding the lock for writing"""
+        return self._locked(fcntl.LOCK_EX)
+
+
+def read_versions(location):
+    """Returns the {structure file name: version} stamps of the repository
+       at 'location'"""
+    try:
+        with open(os.path.join(location, VERSIONS_FILE)) as infile:
+            return json.loads(infile.read())
+    except FileNotFoundError:
+        return {}
+
+
+def write_versions(location, versions, writes=None):
+    """Writes the version stamps, through the atomicfile.WriteGroup 'writes'
+       if given (so that they land together with the structures)"""
+    path = os.path.join(location, VERSIONS_FILE)
+    data = json.dumps(versions, sort_keys=True)
+    if writes is not None:
+        writes.write(path, data)
+    else:
+        atomicfile.write_atomic(path, data)
+
+
+def _entries(data):
+    """Returns structure 'data' as a list of hashable entries"""
+    if isinstance(data, dict):  # {key: [values]} adjacency
+        return [(key, value) for key, values in data.items()
+                for value in values]
+    return [tuple(entry) if isinstance(entry, list) else entry
+            for entry in data]
+
+
+def _from_entries(entries, like):
+    """Turns 'entries' back into structure data shaped like 'like'"""
+    if isinstance(like, dict):
+        data = {}
+        for key, value in entries:
+            data.setdefault(key, []).append(value)
+        return {key: sorted(values) for key, values in data.items()}
+    return [list(entry) if isinstance(entry, tuple) else entry
+            for entry in entries]
+
+
+def merge(base, ours, theirs):
+    """Three-way merge of structure data (a list of entries, or a map of
+       key -> list of values): the entries this session added to / removed
+       from 'base' are applied to 'theirs', the version another writer saved
+       meanwhile.  Their order is kept; our additions go last."""
+    base_entries = set(_entries(base))
+    our_entries = _entries(ours)
+    ours_set = set(our_entries)
+    removed = base_entries - ours_set
+    added = [entry for entry in our_entries if entry not in base_entries]
+
+    merged = [entry for entry in _entries(theirs) if entry not in removed]
+    present = set(merged)
+    for entry in added:
+        if entry not in present:
+            merged.append(entry)
+            present.add(entry)
+    return _from_entries(merged, ours if isinstance(ours, dict) else theirs)
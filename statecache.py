@@ -0,0 +1,144 @@
+"""On-disk snapshot of the parsed TaskMaster state.
+
+The snapshot (a pickle) holds the parsed contents of the structure files,
+keyed by their mtime & size, and the data of every task loaded so far, keyed
+by the repository's HEAD commit.  When HEAD has moved, only the tasks changed
+between the two commits (per 'git diff --name-only') are dropped; everything
+else is reused.  A warm start therefore costs one small file read plus a stat
+per structure file.
+"""
+
+import logging
+import os
+import pickle
+
+import atomicfile
+
+# Constants
+FORMAT_VERSION = 1
+
+# Globals
+logger = logging.getLogger("task")
+
+
+class StateCache(object):
+    """Binary snapshot of structure & task data"""
+    def __init__(self, path):
+        self._path = path
+        self._head = None
+        self._structures = {}  # path -> (mtime_ns, size, data)
+        self._tasks = {}  # task id -> task dict
+        self._dirty = False
+
+    def load(self, head, changed_task_ids):
+        """Loads the snapshot & brings it up to date with 'head'.
+           'changed_task_ids(old_head)' must return the ids of the tasks
+           changed since 'old_head', or None if unknown."""
+        try:
+            with open(self._path, "rb") as infile:
+                snapshot = pickle.load(infile)
+            if snapshot.get("version") != FORMAT_VERSION:
+                raise ValueError("unsupported snapshot version")
+        except FileNotFoundError:
+            snapshot = None
+        except Exception as e:  # pylint: disable=broad-except
+            logger.debug("discarding state cache %s: %s", self._path, e)
+            snapshot = None
+
+        if snapshot is None:
+            self._head = head
+            self._dirty = True
+            return
+
+        self._structures = snapshot["structures"]
+        self._tasks = snapshot["tasks"]
+        self._head = snapshot["head"]
+        if self._head == head:
+            return
+
+        # incremental refresh: forget only the tasks changed since
+        stale = None
+        if self._head is not None and head is not None:
+            stale = changed_task_ids(self._head)
+        if stale is None:
+            self._tasks = {}
+        else:
+            for task_id in stale:
+                self._tasks.pop(task_id, None)
+        logger.debug("state cache refreshed %s -> %s", self._head, head)
+        self._head = head
+        self._dirty = True
+
+    def structure(self, path, parse):
+        """Returns the parsed contents of the structure file 'path', or None
+           if it does not exist.  The file is only read (and handed to
+           'parse') if it changed since the snapshot."""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            if self._structures.pop(path, None) is not None:
+                self._dirty = True
+            return None
+
+        cached = self._structures.get(path)
+        if cached is not None and cached[:2] == (stat.st_mtime_ns,
+                                                 stat.st_size):
+            return cached[2]
+
+        with open(path) as infile:
+            data = parse(infile.read())
+        self._structures[path] = (stat.st_mtime_ns, stat.st_size, data)
+        self._dirty = True
+        return data
+
+    def record_structure(self, path, data):
+        """Records 'data' as the parsed contents of the freshly written
+           structure file 'path'"""
+        stat = os.stat(path)
+        self._structures[path] = (stat.st_mtime_ns, stat.st_size, data)
+        self._dirty = True
+
+    @property
+    def tasks(self):
+        """Property accessor for the {task id: task dict} snapshot"""
+        return self._tasks
+
+    def update(self, head, task_dicts, changed=()):
+        """Records the repository 'head' & the dicts of tasks loaded (or
+           written) in this session.  Tasks in 'changed' (changed by others
+           since the session's load; None if unknown) are dropped instead,
+           as the session may hold outdated copies."""
+        if head != self._head:
+            self._head = head
+            self._dirty = True
+
+        if changed is None:
+            self._tasks = {}
+            self._dirty = True
+            return
+        for task_id in changed:
+            if self._tasks.pop(task_id, None) is not None:
+                self._dirty = True
+        task_dicts = {task_id: task_dict
+                      for task_id, task_dict in task_dicts.items()
+                      if task_id not in changed}
+
+        for task_id, task_dict in task_dicts.items():
+            if self._tasks.get(task_id) != task_dict:
+                self._tasks[task_id] = task_dict
+                self._dirty = True
+
+    def save(self):
+        """Writes the snapshot if it changed"""
+        if not self._dirty:
+            return
+
+        snapshot = {
+            "version": FORMAT_VERSION,
+            "head": self._head,
+            "structures": self._structures,
+            "tasks": self._tasks,
+        }
+        atomicfile.write_atomic(
+            self._path, pickle.dumps(snapshot, pickle.HIGHEST_PROTOCOL))
+        self._dirty = False
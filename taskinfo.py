@@ -4,33 +4,71 @@ TaskInfo class to encapsulate data and operations we want want to use
 
 # system imports
 import abc
+import bisect
+import collections
+import collections.abc
 import datetime
 # import enum  # FIXME
 import json
+import logging
 import os
 import platform
 import queue
+import sys
 import tempfile
+import threading
+import time
 import uuid
 
 # local imports
+import atomicfile
+import completion
 import gitrepo
+import graveyard
 import priority_queue
+import repolock
+import statecache
+import timing_wheel
 
 # FIXME - hardcoded structure files (no versioncontrol)
 DEFAULT_STACK = os.path.join(gitrepo.DEFAULT_REPOSITORY_PATH, "stack.json")
 DEFAULT_QUEUE = os.path.join(gitrepo.DEFAULT_REPOSITORY_PATH, "queue.json")
 DEFAULT_LIMBO = os.path.join(gitrepo.DEFAULT_REPOSITORY_PATH, "limbo.json")
+DEFAULT_LIMBO_LOG = os.path.join(gitrepo.DEFAULT_REPOSITORY_PATH, "limbo.log")
 DEFAULT_DORM = os.path.join(gitrepo.DEFAULT_REPOSITORY_PATH, "dorm.json")
+DEFAULT_STATE_CACHE = os.path.join(gitrepo.DEFAULT_REPOSITORY_PATH,
+                                   "state.cache")
+DEFAULT_GRAVEYARD = os.path.join(gitrepo.DEFAULT_REPOSITORY_PATH,
+                                 "graveyard")
+DEFAULT_ID_INDEX = os.path.join(gitrepo.DEFAULT_REPOSITORY_PATH,
+                                completion.ID_INDEX_FILE)
+DEFAULT_ID_LOG = completion.log_file(DEFAULT_ID_INDEX)
+WHEEL_ENV = "TASKWHEEL"  # "1" keeps the dorm in a timing wheel
+FSYNC_ENV = "TASKFSYNC"  # "1" fsyncs the structure files on save
+WORKER_ENV = "TASKWORKER"  # worker name: use that worker's own stack
+DEFAULT_STACKS = os.path.join(gitrepo.DEFAULT_REPOSITORY_PATH, "stacks")
+DEFAULT_LEASE = 30 * 60  # seconds
+
+logger = logging.getLogger("task")
 
 
 class TaskSyntaxError(ValueError):
     """Represents a user syntax error when authoring a task spec"""
 
 
+class AmbiguousTaskId(LookupError):
+    """Raised when a task id prefix matches more than one task"""
+    def __init__(self, prefix, candidates):
+        self.prefix = prefix
+        self.candidates = candidates
+        super().__init__(f"Ambiguous task id '{prefix}' matches: " +
+                         ", ".join(candidates))
+
+
 class ISerializable(object):
     """Base class representing a (JSON) serializable object"""
     __metaclass__ = abc.ABCMeta
+    __slots__ = ()
 
     @classmethod
     def format(cls):
@@ -55,11 +93,44 @@ class ISerializable(object):
         raise NotImplementedError
 
 
-class TasksInProgress(ISerializable):
+class Undoable(object):
+    """Mixin keeping, once a savepoint is taken, an undo log of the changes
+       made to a structure, so that rolling back costs as much as the
+       changes made since the savepoint (not as the whole structure)"""
+    _journal = None  # undo callables, latest last; None until a savepoint
+
+    def _record(self, undo):
+        """Records the callable 'undo', reverting the change being made"""
+        if self._journal is not None:
+            self._journal.append(undo)
+
+    def savepoint(self):
+        """Starts logging changes (if needed) & returns a marker of the
+           current state, for rollback_to()"""
+        if self._journal is None:
+            self._journal = []
+        return len(self._journal)
+
+    def rollback_to(self, savepoint):
+        """Undoes the changes made since 'savepoint'"""
+        journal, self._journal = self._journal, None  # undoing isn't logged
+        try:
+            while len(journal) > savepoint:
+                journal.pop()()
+        finally:
+            self._journal = journal
+
+    def release_savepoints(self):
+        """Stops logging changes; earlier savepoints become invalid"""
+        self._journal = None
+
+
+class TasksInProgress(ISerializable, Undoable):
     """LIFO stack for capturing tasks as they come in.  This structure is used
        for storing interrupt items until they can be moved to the Backlog"""
     def __init__(self):
         self.stack = list()
+        self.dirty = False  # True once changed since load/serialize
 
     def __iter__(self):
         """Object iterator"""
@@ -69,15 +140,31 @@ class TasksInProgress(ISerializable):
     def push(self, task):
         """Push a task onto the stack"""
         self.stack.append(task)
+        self._record(self.stack.pop)
+        self.dirty = True
 
     def pop(self):
         """Pop a task from the stack"""
-        return self.stack.pop()
+        task = self.stack.pop()
+        self._record(lambda: self.stack.append(task))
+        self.dirty = True
+        return task
 
     def peek(self):
         """Returns the most recently added item without removing it"""
         return self.stack[-1]
 
+    def remove(self, task_id):
+        """Removes the task 'task_id' from wherever it is in the stack &
+           returns it, or None if it is not stacked"""
+        for position, task in enumerate(self.stack):
+            if task.id == task_id:
+                del self.stack[position]
+                self._record(lambda: self.stack.insert(position, task))
+                self.dirty = True
+                return task
+        return None
+
     def empty(self):
         """Returns True if the stack is empty; False otherwise"""
         return len(self.stack) == 0
@@ -95,13 +182,19 @@ class TasksInProgress(ISerializable):
 
         raise LookupError(f"No such task in stack: '{task_id}'")
 
+    def data(self):
+        """Returns the JSON-serializable form of the stack"""
+        return [task.id for task in self.stack]
+
+    def dumps(self):
+        """Returns the serialized (JSON) form of the stack"""
+        return self.pretty(self.data())
+
     def serialize(self, to_file=None):
         """Saves the stack to 'to_file'"""
         assert to_file is not None  # FIXME
-        task_list = [task.id for task in self.stack]
-        with open(to_file, "w") as outfile:
-            outfile.write(json.dumps(task_list, sort_keys=True, indent=4,
-                                     separators=(',', ': ')))
+        atomicfile.write_atomic(to_file, self.dumps())
+        self.dirty = False
 
     def __len__(self):
         return len(self.stack)
@@ -110,46 +203,71 @@ class TasksInProgress(ISerializable):
     def load(cls, from_file):
         """Loads a stack from 'from_file'"""
         with open(from_file) as infile:
-            task_list = json.loads(infile.read())
+            return cls.from_data(json.loads(infile.read()))
 
+    @classmethod
+    def from_data(cls, task_list):
+        """Creates a stack from its data() form"""
         stack = cls()
         for task_id in task_list:
-            stack.push(TaskInfo.from_id(task_id))
+            stack.push(TaskProxy(task_id))
 
+        stack.dirty = False
         return stack
 
 
-class TaskBacklog(ISerializable):
+class TaskBacklog(ISerializable, Undoable):
     """Priority queue for managing a backlog of tasks.  Tasks are moved to and
-       from the TasksInProgress stack as they are activated/deactivated."""
+       from the TasksInProgress stack as they are activated/deactivated.
+
+       In work-queue mode, workers claim() tasks under a time-limited lease;
+       a task whose lease expires before it is released returns to the
+       queue (so a task is claimed by one worker at a time, but may be
+       processed again if its worker stalls)."""
     def __init__(self):
         self.queue = priority_queue.PriorityQueue()
+        self.leases = {}  # task id -> (task, priority, worker, expiry time)
+        self.dirty = False  # True once changed since load/serialize
 
     def __iter__(self):
         """Object iterator"""
         for item in self.queue:
             yield item
 
-    def put(self, task):
-        """Insert a task into the backlog"""
-        self.queue.put(task, task.priority)
+    def put(self, task, priority=None):
+        """Insert a task into the backlog, ordered by 'priority' (defaults to
+           the task's own priority)"""
+        if priority is None:
+            priority = task.priority
+        self.queue.put(task, priority)
+        self._record(lambda: self.queue.remove(task))
+        self.dirty = True
+
+    def _take(self, task=None):
+        """Removes 'task' (defaults to the highest priority task) from the
+           queue & returns (task, priority)"""
+        if task is None:
+            task = self.queue.peek()
+        priority = self.queue.priority(task)
+        sequence = self.queue.sequence(task)
+        self.queue.remove(task)
+        self._record(lambda: self.queue.put(task, priority, sequence))
+        self.dirty = True
+        return task, priority
 
     def get(self, task_id=None):
         """Remove a task from the backlog"""
         if task_id:
-            item = self.find(task_id)
-            self.queue.remove(item)
-        else:
-            item = self.queue.get()
-        return item
+            return self._take(self.find(task_id))[0]
+        return self._take()[0]
 
     def empty(self):
         """Returns True if the queue is empty; False otherwise"""
         return self.queue.empty()
 
-    def peek(self):  # pylint: disable=R0201
+    def peek(self):
         """Look at the next task on the queue without removing it"""
-        assert False, "Not implemented due to PriorityQueue limitations"
+        return self.queue.peek()
 
     def find(self, task_id):
         """Searches for a task by 'task_id'. Uses prefix-matching."""
@@ -162,91 +280,357 @@ class TaskBacklog(ISerializable):
     def remove(self, task_id):
         """Searches for a task by 'task_id', removes it, and returns it.
            Uses prefix-matching."""
-        task_obj = self.find(task_id)
-        self.queue.remove(task_obj)
-        return task_obj
+        return self._take(self.find(task_id))[0]
+
+    def claim(self, worker, duration, now=None):
+        """Removes the highest priority task & leases it to 'worker' for
+           'duration' seconds.  Expired leases are returned to the queue
+           first.  Raises queue.Empty if there is nothing to claim."""
+        if now is None:
+            now = time.time()
+        self.expire_leases(now)
+
+        task, priority = self._take()
+        self._set_lease(task.id, (task, priority, worker, now + duration))
+        return task
+
+    def _set_lease(self, task_id, lease):
+        """Sets (or with 'lease' None, ends) the lease on 'task_id'"""
+        old_lease = self.leases.pop(task_id, None)
+        if lease is not None:
+            self.leases[task_id] = lease
+
+        def undo():
+            """Restores the former lease"""
+            self.leases.pop(task_id, None)
+            if old_lease is not None:
+                self.leases[task_id] = old_lease
+        self._record(undo)
+        self.dirty = True
+
+    def renew(self, task_id, worker, duration, now=None):
+        """Extends the lease of 'worker' on 'task_id' by 'duration' seconds.
+           Raises LookupError if the worker does not hold the lease."""
+        if now is None:
+            now = time.time()
+        task, priority, holder, _ = self._lease(task_id, worker)
+        self._set_lease(task_id, (task, priority, holder, now + duration))
+
+    def release(self, task_id, worker):
+        """Ends the lease of 'worker' on 'task_id' (e.g. as the task is done)
+           & returns the task.  Raises LookupError if the worker does not
+           hold the lease."""
+        task = self._lease(task_id, worker)[0]
+        self._set_lease(task_id, None)
+        return task
+
+    def _lease(self, task_id, worker):
+        """Returns the lease of 'worker' on 'task_id'"""
+        lease = self.leases.get(task_id)
+        if lease is None or lease[2] != worker:
+            raise LookupError(
+                f"Task '{task_id}' is not leased to worker '{worker}'")
+        return lease
+
+    def expired(self, now=None):
+        """Returns the leases which expired before 'now'"""
+        if now is None:
+            now = time.time()
+        return [lease for lease in self.leases.values() if lease[3] <= now]
+
+    def expire_leases(self, now=None):
+        """Returns the tasks whose lease expired before 'now' to the queue &
+           returns them"""
+        expired = self.expired(now)
+        for task, priority, _, _ in expired:
+            self._set_lease(task.id, None)
+            self.put(task, priority)
+        return [lease[0] for lease in expired]
+
+    def data(self):
+        """Returns the JSON-serializable form of the queue: a list of
+           [id, priority] pairs, so that it can be loaded without reading
+           any task, followed by [id, priority, worker, expiry] leases"""
+        queued = [[task.id, priority] for task, priority in self.queue.items()]
+        leased = [[task_id, priority, worker, expiry]
+                  for task_id, (_, priority, worker, expiry)
+                  in sorted(self.leases.items())]
+        return queued + leased
+
+    def dumps(self):
+        """Returns the serialized (JSON) form of the queue"""
+        return self.pretty(self.data(), sort=False)
 
     def serialize(self, to_file=None):
         """Saves the queue to 'to_file'"""
         assert to_file is not None  # FIXME
-        task_list = [task.id for task in self.queue]
-        with open(to_file, "w") as outfile:
-            outfile.write(self.pretty(task_list))
+        atomicfile.write_atomic(to_file, self.dumps())
+        self.dirty = False
 
     @classmethod
     def load(cls, from_file):
         """Loads a queue from 'from_file'"""
         with open(from_file) as infile:
-            task_list = json.loads(infile.read())
+            return cls.from_data(json.loads(infile.read()))
 
+    @classmethod
+    def from_data(cls, task_list):
+        """Creates a queue from its data() form"""
         queue_obj = cls()
-        for task_id in task_list:
-            queue_obj.put(TaskInfo.from_id(task_id))
+        for entry in task_list:
+            if isinstance(entry, str):
+                # legacy format (id only): the task knows its priority
+                queue_obj.put(TaskProxy(entry))
+            elif len(entry) == 4:
+                task_id, priority, worker, expiry = entry
+                queue_obj.leases[task_id] = \
+                    (TaskProxy(task_id), priority, worker, expiry)
+            else:
+                task_id, priority = entry
+                queue_obj.put(TaskProxy(task_id), priority)
 
+        queue_obj.dirty = False
         return queue_obj
 
 
-class TaskLimbo(object):
-    """Reference-counted dictionary of sets indexed by blocker. When a stored
-       item loses all of its references, the item is removed and the
-       registered callback is triggered returning a reference to the item"""
+class TaskLimbo(ISerializable, Undoable):
+    """Dependency graph of blocked tasks, kept as two adjacency maps of task
+       ids (blocker -> dependents & dependent -> blockers).  A blocker may
+       itself be blocked, forming chains; edges that would close a cycle are
+       rejected.  When a task is unblocked by its last blocker, it is removed
+       and the registered callback is triggered returning a reference to
+       it.  The blocked tasks changed since the load are tracked, so saving
+       can log just their changes (see changes())."""
     def __init__(self, callback):
         """Constructor for TaskLimbo class"""
-        if not callable(callback):
-            raise TypeError("'callback' must be callable")
-
-        self._callback = callback
-        self._blocked_items = {}
-        self._blockers = {}
+        self._callback = None
+        self._items = {}  # blocked task id -> task
+        self._order = {}  # blocked task id -> blocking sequence number
+        self._sequence = 0
+        self._dependents = {}  # blocker id -> set of blocked task ids
+        self._blockers = {}  # blocked task id -> set of blocker ids
+        self._touched = {}  # changed task id -> True if (re)blocked
+        self.dirty = False  # True once changed since load/serialize
+        self.set_callback(callback)
 
     def __iter__(self):
         """Object iterator"""
-        for item in self._blocked_items:
+        for item in list(self._items.values()):
             yield item
 
-    def block(self, item, blocked_by):
-        """Stores 'item' internally, indexed by 'blocked_by'"""
-        item_meta = self._blocked_items.get(item)
-        if item_meta is None:
-            item_meta = RefCount(item)
-            self._blocked_items[item] = item_meta
+    def __len__(self):
+        return len(self._items)
 
-        blocked_items = self._blockers.get(blocked_by, set())
-        if item_meta in blocked_items:
-            raise ValueError(f"'{str(item_meta.data)}' " +
-                             f"is already blocked by '{str(blocked_by)}'")
+    def set_callback(self, callback):
+        """Sets the internal callback"""
+        if not callable(callback):
+            raise TypeError("'callback' must be callable")
 
-        blocked_items.add(item_meta)
-        self._blockers[blocked_by] = blocked_items
-        item_meta.add_ref()
+        self._callback = callback
 
-    def unblock(self, completed_item):
-        """Unblock all items blocked by 'completed_item'"""
-        blocked_items = self._blockers.get(completed_item, set())
-        for item_meta in blocked_items:
-            item_meta.remove_ref()
-            if item_meta.refcount == 0:
-                self._callback(item_meta.data)
-                del self._blocked_items[item_meta.data]
+    def _blocks(self, task_id, other_id):
+        """Returns True if 'task_id' (transitively) blocks 'other_id'"""
+        pending = [task_id]
+        seen = set(pending)
+        while pending:
+            for dependent_id in self._dependents.get(pending.pop(), ()):
+                if dependent_id == other_id:
+                    return True
+                if dependent_id not in seen:
+                    seen.add(dependent_id)
+                    pending.append(dependent_id)
+        return False
 
-        del self._blockers[completed_item]
+    def block(self, item, blocked_by):
+        """Stores 'item' internally, blocked by the task 'blocked_by'.
+           Raises ValueError if the edge exists or would close a cycle."""
+        blockers = self._blockers.get(item.id, set())
+        if blocked_by.id in blockers:
+            raise ValueError(f"'{item.id}' " +
+                             f"is already blocked by '{blocked_by.id}'")
+        if item.id == blocked_by.id or self._blocks(item.id, blocked_by.id):
+            raise ValueError(f"'{blocked_by.id}' is blocked by " +
+                             f"'{item.id}'; blocking would form a cycle")
+
+        new_item = item.id not in self._items
+        if new_item:
+            self._items[item.id] = item
+            self._order[item.id] = self._sequence
+            self._sequence += 1
+        blockers.add(blocked_by.id)
+        self._blockers[item.id] = blockers
+        if new_item:
+            self._touched[item.id] = True
+        else:
+            self._touched.setdefault(item.id, False)
+        self._dependents.setdefault(blocked_by.id, set()).add(item.id)
+
+        def undo():
+            """Removes the edge (& the item, if it was not blocked yet)"""
+            dependents = self._dependents[blocked_by.id]
+            dependents.discard(item.id)
+            if not dependents:
+                del self._dependents[blocked_by.id]
+            blockers.discard(blocked_by.id)
+            if new_item:
+                del self._items[item.id], self._order[item.id], \
+                    self._blockers[item.id]
+        self._record(undo)
+        self.dirty = True
+
+    def unblock(self, completed_item):
+        """Unblock all items blocked by 'completed_item'; items left without
+           blockers are released in the order they were blocked.  Only the
+           completed item's own edges are visited."""
+        dependent_ids = self._dependents.pop(completed_item.id, ())
+        released = []
+        for dependent_id in dependent_ids:
+            self._touched.setdefault(dependent_id, False)
+            blockers = self._blockers[dependent_id]
+            blockers.discard(completed_item.id)
+            if not blockers:
+                del self._blockers[dependent_id]
+                released.append((self._order.pop(dependent_id),
+                                 self._items.pop(dependent_id)))
+
+        if dependent_ids:
+            def undo():
+                """Restores the completed item's edges & released items"""
+                self._dependents[completed_item.id] = dependent_ids
+                for dependent_id in dependent_ids:
+                    self._blockers.setdefault(dependent_id, set()).add(
+                        completed_item.id)
+                for order, item in released:
+                    self._items[item.id] = item
+                    self._order[item.id] = order
+            self._record(undo)
+            self.dirty = True
+        for _, item in sorted(released, key=lambda entry: entry[0]):
+            self._callback(item)
+
+    def blockers(self, task_id):
+        """Returns the set of ids of the tasks directly blocking 'task_id'"""
+        return set(self._blockers.get(task_id, ()))
 
     def find(self, task_id):
         """Searches for a task by 'task_id'. Uses prefix-matching."""
-        for task_obj in self._blocked_items:
+        for task_obj in self._items.values():
             if task_obj.id.startswith(task_id):
                 return task_obj
 
         raise LookupError(f"No such task in limbo: '{task_id}'")
 
+    def data(self):
+        """Returns the JSON-serializable form of limbo: a map of blocked
+           task id -> sorted list of blocker ids, in blocking order"""
+        return {task_id: sorted(self._blockers[task_id])
+                for task_id in self._items}
+
+    def dumps(self):
+        """Returns the serialized (JSON) form of limbo"""
+        return self.pretty(self.data(), sort=False)
+
+    def changes(self):
+        """Returns the changes made since the load/last save as a list of
+           [task id, sorted blocker ids or None (unblocked)] pairs which
+           turn the saved data() into the current one (see apply_changes()).
+           Only the changed tasks are visited."""
+        changes = []
+        for task_id, reblocked in self._touched.items():
+            if reblocked or task_id not in self._items:
+                changes.append([task_id, None])
+            else:
+                changes.append([task_id, sorted(self._blockers[task_id])])
+        # (re)blocked tasks go last, in blocking order
+        reblocked = [task_id for task_id, new in self._touched.items()
+                     if new and task_id in self._items]
+        for task_id in sorted(reblocked, key=self._order.get):
+            changes.append([task_id, sorted(self._blockers[task_id])])
+        return changes
+
+    def saved(self):
+        """Marks limbo as saved: changes() starts over"""
+        self._touched = {}
+        self.dirty = False
+
+    def track_changes(self, data):
+        """Marks the tasks blocked differently than in the data() form
+           'data' (the saved limbo) as changed, so changes() turns 'data'
+           into this limbo"""
+        for task_id, blocker_ids in data.items():
+            if task_id not in self._items or \
+                    sorted(self._blockers[task_id]) != blocker_ids:
+                self._touched.setdefault(task_id, False)
+        for task_id in self._items:
+            if task_id not in data:
+                self._touched[task_id] = True
+
+    @staticmethod
+    def apply_changes(data, changes):
+        """Applies the changes() 'changes' to the data() form 'data'"""
+        for task_id, blocker_ids in changes:
+            if blocker_ids is None:
+                data.pop(task_id, None)
+            else:
+                data[task_id] = blocker_ids
+
+    @classmethod
+    def apply_log(cls, data, log_file):
+        """Returns a copy of the data() form 'data' with the changes logged
+           to 'log_file' (one changes() list per line) applied"""
+        data = dict(data)
+        try:
+            with open(log_file) as infile:
+                for line in infile:
+                    cls.apply_changes(data, json.loads(line))
+        except FileNotFoundError:
+            pass
+        return data
+
+    def serialize(self, to_file=None):
+        """Saves limbo to 'to_file'"""
+        assert to_file is not None  # FIXME
+        atomicfile.write_atomic(to_file, self.dumps())
+        self.saved()
+
+    @classmethod
+    def load(cls, from_file, log_file=None):
+        """Loads limbo from 'from_file' & the changes logged to 'log_file'"""
+        with open(from_file) as infile:
+            data = json.loads(infile.read())
+        if log_file is not None:
+            data = cls.apply_log(data, log_file)
+        return cls.from_data(data)
 
-class TaskDorm(ISerializable):
+    @classmethod
+    def from_data(cls, blocked):
+        """Creates limbo from its data() form"""
+        limbo = cls(_dummy_callback)
+        for task_id, blocker_ids in blocked.items():
+            limbo._items[task_id] = TaskProxy(task_id)
+            limbo._order[task_id] = limbo._sequence
+            limbo._sequence += 1
+            limbo._blockers[task_id] = set(blocker_ids)
+            for blocker_id in blocker_ids:
+                limbo._dependents.setdefault(blocker_id, set()).add(task_id)
+
+        return limbo
+
+
+class TaskDorm(ISerializable, Undoable):
     """Stores sleeping Tasks in the order that they will wake up. Items
-       can be woken/fetched by id, but it may be inefficient"""
-    def __init__(self, callback):
+       can be woken/fetched by id, but it may be inefficient.  With 'wheel'
+       set, items are kept in a hierarchical timing wheel instead of a
+       priority queue, which scales better for very large dorms."""
+    def __init__(self, callback, wheel=False):
         """Constructor for TaskDorm class"""
         self._callback = None
-        self._queue = priority_queue.PriorityQueue()
+        if wheel:
+            self._queue = timing_wheel.TimingWheel()
+        else:
+            self._queue = priority_queue.PriorityQueue()
+        self._next_wake = None  # lower bound of the earliest wake-up time
+        self.dirty = False  # True once changed since load/serialize
         self.set_callback(callback)
 
     def __iter__(self):
@@ -274,28 +658,68 @@ class TaskDorm(ISerializable):
                 "')")
 
         self._queue.put(item, timestamp)
+        next_wake = self._next_wake
+        if self._next_wake is None or timestamp < self._next_wake:
+            self._next_wake = timestamp
+
+        def undo():
+            """Removes the item again"""
+            self._queue.remove(item)
+            self._next_wake = next_wake
+        self._record(undo)
+        self.dirty = True
+
+    def _restore(self, entries, next_wake):
+        """Undo: puts back the removed (item, timestamp, sequence) entries"""
+        for item, timestamp, sequence in entries:
+            self._queue.put(item, timestamp, sequence)
+        self._next_wake = next_wake
+
+    def wake(self, item_id):
+        """Immediately wake the item with id 'item_id' (prefix-matched) &
+           return it"""
+        item = self.find(item_id)
+        entry = (item, self._queue.priority(item), self._queue.sequence(item))
+        next_wake = self._next_wake
+        self._queue.remove(item)
+        self._record(lambda: self._restore([entry], next_wake))
+        self.dirty = True
+        self._callback(item)
+        return item
 
-    def wake(self, item_id):  # pylint: disable=R0201,W0613
-        """Immediately wake the item with id 'item_id'"""
-        assert False, "Not implemented due to PriorityQueue limitations"""
-
-    # NOTE: Due to how iteration & our stack work, if multiple items are
-    #       woken at the same time, they will be placed on the stack in a
-    #       rather 'backwards' manner, where the task set to wake most urgently
-    #       is actually blocked by tasks set to wake afterwards. This is
-    #       currently a design limitation and should be addressed as needed.
-    def reveille(self):
-        """Wake up all items that are ready to wake"""
-        now = datetime.datetime.now()
-        # TODO: this logic can be optimized if our queue has a peek() method
-        while self._queue.size() > 0:
-            item = self._queue.get_tuple()
-            if item[1] <= now:
-                self._callback(item[0])
-            else:
-                # put the item back & terminate iteration
-                self._queue.put(item[0], item[1])
-                break
+    @property
+    def next_wake(self):
+        """Property accessor for the time (datetime) by which the next item
+           may be due, or None if the dorm is empty"""
+        return self._next_wake
+
+    def reveille(self, now=None):
+        """Wake up all items that are ready to wake.  They are handed to the
+           callback as one batch, latest first, so that the most urgent item
+           ends up on top of the stack."""
+        if now is None:
+            now = datetime.datetime.now()
+        if self._next_wake is None or self._next_wake > now:
+            return  # nothing is due (the common case)
+
+        if isinstance(self._queue, timing_wheel.TimingWheel):
+            due = self._queue.expire_entries(now)
+        else:
+            due = []
+            while self._queue.size() > 0 and \
+                    self._queue.peek_tuple()[1] <= now:
+                item, timestamp = self._queue.peek_tuple()
+                due.append((item, timestamp, self._queue.sequence(item)))
+                self._queue.remove(item)
+
+        next_wake = self._next_wake
+        self._next_wake = \
+            self._queue.peek_tuple()[1] if self._queue.size() > 0 else None
+        if due:
+            self._record(lambda: self._restore(due, next_wake))
+            self.dirty = True
+        for item, _, _ in reversed(due):
+            self._callback(item)
 
     def find(self, task_id):
         """Searches for a task by 'task_id'. Uses prefix-matching."""
@@ -312,29 +736,41 @@ class TaskDorm(ISerializable):
 
         self._callback = callback
 
-    def serialize(self, to_file=None):
-        """Saves the dorm to 'to_file'"""
-        assert to_file is not None  # FIXME
+    def data(self):
+        """Returns the JSON-serializable form of the dorm: a list of
+           (id, UTC wake timestamp) pairs"""
         wake_list = []
         for task_obj, timestamp in self._queue.items():
             utc_timestamp = \
                 timestamp.replace(tzinfo=datetime.timezone.utc).timestamp()
             wake_list.append((task_obj.id, utc_timestamp))
+        return wake_list
 
-        with open(to_file, "w") as outfile:
-            outfile.write(self.pretty(wake_list))
+    def dumps(self):
+        """Returns the serialized (JSON) form of the dorm"""
+        return self.pretty(self.data())
+
+    def serialize(self, to_file=None):
+        """Saves the dorm to 'to_file'"""
+        assert to_file is not None  # FIXME
+        atomicfile.write_atomic(to_file, self.dumps())
+        self.dirty = False
 
     @classmethod
     def load(cls, from_file):
         """Loads a dorm from 'from_file'"""
         with open(from_file) as infile:
-            wake_list = json.loads(infile.read())
+            return cls.from_data(json.loads(infile.read()))
 
-        dorm_obj = cls(_dummy_callback)
+    @classmethod
+    def from_data(cls, wake_list, wheel=False):
+        """Creates a dorm from its data() form"""
+        dorm_obj = cls(_dummy_callback, wheel)
         for task_id, timestamp in wake_list:
             datetime_obj = datetime.datetime.utcfromtimestamp(timestamp)
-            dorm_obj.wake_at(TaskInfo.from_id(task_id), datetime_obj)
+            dorm_obj.wake_at(TaskProxy(task_id), datetime_obj)
 
+        dorm_obj.dirty = False
         return dorm_obj
 
 
@@ -350,80 +786,570 @@ class TaskMaster(object):
        * TasksInProgress (current context stack)
        * TaskBacklog (backlog priority queue)
        * TaskLimbo (blocked items in a ref-counted dictionary)
-       * TaskDorm (sleeping items in a sorted list)
-       * Graveyard (closed issues in a simple list)
+       * TaskDorm (sleeping items in a priority queue or timing wheel)
+       * Graveyard (closed issues in a lazily opened archive)
+
+       Used as a context manager, all task writes made during the session
+       are published as one commit on exit (and discarded on error).
+       Sessions nest: while one is open, TaskMaster() (in the same thread)
+       returns the open session, whose changes are only saved when the
+       outermost context exits (so that e.g. a batch of commands shares one
+       load & commit).  Other threads get sessions of their own.
     """
-    def __init__(self):
-        """TaskMaster constructor"""
+    _local = threading.local()  # .active: the thread's open session, if any
+
+    @classmethod
+    def _active(cls):
+        """Returns the session opened (entered) by this thread, or None"""
+        return getattr(cls._local, "active", None)
+
+    def __new__(cls, worker=None):  # pylint: disable=unused-argument
+        active = cls._active()
+        if active is not None:
+            return active
+        return super().__new__(cls)
+
+    def __init__(self, worker=None):
+        """TaskMaster constructor.  A 'worker' (defaults to $TASKWORKER)
+           gets its own stack but shares the backlog & everything else."""
+        if worker is None:
+            worker = os.environ.get(WORKER_ENV) or None
+        active = TaskMaster._active()
+        if self is active:
+            # nested session (__new__ returned the open one): already loaded
+            if worker != active.worker:
+                raise ValueError(f"Cannot switch to worker '{worker}' in "
+                                 f"the session of worker '{active.worker}'")
+            return
+
+        TASK_CACHE.clear()  # the identity map is per session
+        if worker is not None and \
+                (os.path.basename(worker) != worker or worker in (".", "..")):
+            raise ValueError(f"Invalid worker name: '{worker}'")
+        self.worker = worker
+        self.persistent = False  # True keeps the repository open on exit
+        self._depth = 0  # number of entered contexts
+        self._stack_file = self._stack_path(worker)
+        self._stacks = {}  # stack file -> stack of another worker changed
         self.backlog = None
         self.blocked = None
-        self.graveyard = []  # TODO - just load from file; not memory
+        self.graveyard = graveyard.Graveyard(DEFAULT_GRAVEYARD)
         self.sleeping = None
         self.stack = None
+        self._index = None
+        self._head = None  # repository HEAD when loaded
+        self._state = None
+        self._base = {}  # structure file -> data() as loaded
+        self._versions = {}  # structure file name -> version as loaded
+        self._wheel = os.environ.get(WHEEL_ENV) == "1"
         self._load()
 
     def __enter__(self):
+        if self._depth == 0:
+            # group every task write of this session into a single commit
+            gitrepo.get_repository().begin()
+            TaskMaster._local.active = self
+        self._depth += 1
         return self
 
-    def __exit__(self, *args):
-        self._save()
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._depth -= 1
+        if self._depth > 0:
+            return  # the outermost context saves (or discards) the session
+
+        TaskMaster._local.active = None
+        for _, struct in self._structures():
+            struct.release_savepoints()
+        if self._index is not None:
+            self._index.release_savepoints()
+        taskrepo = gitrepo.get_repository()
+        try:
+            if exc_type is not None:
+                # the session failed: commit nothing
+                taskrepo.abort()
+                return
+
+            if not self._modified():
+                taskrepo.commit()  # nothing to publish; no lock needed
+                return
+
+            # short critical section: publish the tasks & merge-save the
+            # structures while no other task command can
+            os.makedirs(gitrepo.DEFAULT_REPOSITORY_PATH, exist_ok=True)
+            lock = repolock.RepositoryLock(gitrepo.DEFAULT_REPOSITORY_PATH)
+            with lock.exclusive():
+                try:
+                    self._check_releases()
+                except LookupError:
+                    taskrepo.abort()
+                    raise
+                taskrepo.commit()
+                self._save()
+        finally:
+            if not self.persistent:
+                # stop the blob reader kept open for the session
+                gitrepo.close()
+            logger.debug("task cache: %(hits)d hits, %(misses)d misses, "
+                         "%(size)d tasks", TASK_CACHE.stats())
+
+    def is_current(self):
+        """Returns True if no other command saved structures or tasks since
+           this session was loaded (or last saved), so that it can be
+           entered again instead of being reloaded"""
+        location = gitrepo.DEFAULT_REPOSITORY_PATH
+        if self._head is None or not os.path.exists(location):
+            return False
+        versions = repolock.read_versions(location)
+        for path, _ in self._structures():
+            name = os.path.relpath(path, location)
+            if versions.get(name, 0) != self._versions.get(name, 0):
+                return False
+        return gitrepo.get_repository().head() == self._head
+
+    def _modified(self):
+        """Returns True if the session changed any task or structure"""
+        return gitrepo.get_repository().pending or \
+            self.graveyard.pending or \
+            any(struct.dirty for _, struct in self._structures())
 
     def _load(self):
         """Load structure from file"""
-        if os.path.exists(DEFAULT_STACK):
-            self.stack = TasksInProgress.load(DEFAULT_STACK)
+        if os.path.exists(gitrepo.DEFAULT_REPOSITORY_PATH):
+            # a consistent snapshot: no command is saving meanwhile
+            lock = repolock.RepositoryLock(gitrepo.DEFAULT_REPOSITORY_PATH)
+            with lock.shared():
+                self._versions = repolock.read_versions(
+                    gitrepo.DEFAULT_REPOSITORY_PATH)
+                self._load_state_cache()
+                self._load_structures()
+        else:
+            self._load_structures()
+
+    def _load_structures(self):
+        """Builds the structures from their files"""
+        stack_data = self._read_structure(self._stack_file)
+        if stack_data is not None:
+            self.stack = TasksInProgress.from_data(stack_data)
         else:
             self.stack = TasksInProgress()
 
-        if os.path.exists(DEFAULT_QUEUE):
-            self.backlog = TaskBacklog.load(DEFAULT_QUEUE)
+        queue_data = self._read_structure(DEFAULT_QUEUE)
+        if queue_data is not None:
+            self.backlog = TaskBacklog.from_data(queue_data)
         else:
             self.backlog = TaskBacklog()
 
-        self.blocked = TaskLimbo(callback=self.stack.push)
-        # FIXME: implement serialization for TaskLimbo
-        # if os.path.exists(DEFAULT_LIMBO):
-        #     self.blocked.load(DEFAULT_LIMBO)
+        limbo_data = self._read_structure(DEFAULT_LIMBO)
+        if limbo_data is not None:
+            self.blocked = TaskLimbo.from_data(limbo_data)
+            self.blocked.set_callback(self._push)
+        else:
+            self.blocked = TaskLimbo(callback=self._push)
+
+        dorm_data = self._read_structure(DEFAULT_DORM)
+        if dorm_data is not None:
+            self.sleeping = TaskDorm.from_data(dorm_data, self._wheel)
+            self.sleeping.set_callback(self._push)
+        else:
+            self.sleeping = TaskDorm(callback=self._push, wheel=self._wheel)
+
+    def _load_state_cache(self):
+        """Loads the parsed-state snapshot (see statecache), refreshed for
+           the current repository HEAD, & seeds the task cache with it"""
+        taskrepo = gitrepo.get_repository()
+        head = self._head = taskrepo.head()
+        self._state = statecache.StateCache(DEFAULT_STATE_CACHE)
+        self._state.load(
+            head, lambda old_head: taskrepo.changed_task_ids(old_head, head))
+        TASK_CACHE.seed(self._state.tasks)
+
+    def _read_structure(self, path):
+        """Returns the parsed contents of structure file 'path', or None if
+           it does not exist; the result is kept as the merge base"""
+        if self._state is not None:
+            data = self._state.structure(path, json.loads)
+        elif not os.path.exists(path):
+            data = None
+        else:
+            with open(path) as infile:
+                data = json.loads(infile.read())
+
+        data = self._with_log(path, data)
+        self._base[path] = data
+        return data
+
+    @staticmethod
+    def _with_log(path, data):
+        """Returns the 'data' read from structure file 'path' with the
+           changes logged since applied (limbo only, see _log_limbo())"""
+        if path != DEFAULT_LIMBO or data is None:
+            return data
+        return TaskLimbo.apply_log(data, DEFAULT_LIMBO_LOG)
+
+    @staticmethod
+    def _stack_path(worker):
+        """Returns the stack file of 'worker' (None: the default stack)"""
+        if worker is None:
+            return DEFAULT_STACK
+        return os.path.join(DEFAULT_STACKS, worker + ".json")
+
+    def _structures(self):
+        """Returns the (file, structure) pairs of the persisted structures"""
+        return [
+            (self._stack_file, self.stack),
+            (DEFAULT_QUEUE, self.backlog),
+            (DEFAULT_LIMBO, self.blocked),
+            (DEFAULT_DORM, self.sleeping),
+        ] + sorted(self._stacks.items())
+
+    def _merge(self, path, struct):
+        """Merges this session's changes to 'struct' into the version of
+           'path' saved by another command since the load & returns the
+           merged structure (which replaces 'struct')"""
+        with open(path) as infile:
+            theirs = self._with_log(path, json.loads(infile.read()))
+        ours = struct.data()
+        base = self._base.get(path)
+        if base is None:
+            base = type(ours)()
+        merged = repolock.merge(base, ours, theirs)
+        self._base[path] = theirs
+        logger.debug("merged concurrent changes to %s", path)
+        struct = self._replace(struct, merged)
+        if isinstance(struct, TaskLimbo):
+            struct.track_changes(theirs)
+        return struct
+
+    def _replace(self, struct, data):
+        """Replaces 'struct' with a structure built from 'data' & returns
+           the new structure"""
+        if isinstance(struct, TaskDorm):
+            new_struct = TaskDorm.from_data(data, self._wheel)
+        else:
+            new_struct = type(struct).from_data(data)
+        for name in ("stack", "backlog", "blocked", "sleeping"):
+            if getattr(self, name) is struct:
+                setattr(self, name, new_struct)
+        for path, stack in self._stacks.items():
+            if stack is struct:
+                self._stacks[path] = new_struct
+        self.blocked.set_callback(self._push)
+        self.sleeping.set_callback(self._push)
+        self._changed()
+        return new_struct
+
+    def savepoint(self):
+        """Returns a marker of the session's unsaved changes, to undo the
+           changes made after it with rollback().  Its cost does not depend
+           on the size of the structures: their changes are logged from the
+           first savepoint of the session on."""
+        index = self._index
+        return {
+            "structures": [(struct, struct.savepoint(), struct.dirty)
+                           for _, struct in self._structures()],
+            "index": (index, index.savepoint() if index else None),
+            "tasks": gitrepo.get_repository().savepoint(),
+            "buried": self.graveyard.savepoint(),
+            "changed": set(TASK_CACHE.changed),
+        }
 
-        if os.path.exists(DEFAULT_DORM):
-            self.sleeping = TaskDorm.load(DEFAULT_DORM)
-            self.sleeping.set_callback(self.stack.push)
+    def rollback(self, savepoint):
+        """Undoes the changes made to tasks & structures since 'savepoint'
+           (see savepoint())"""
+        gitrepo.get_repository().rollback_to(savepoint["tasks"])
+        self.graveyard.rollback_to(savepoint["buried"])
+        # tasks may have been changed in memory: reload them as needed
+        TASK_CACHE.clear()
+        TASK_CACHE.changed.update(savepoint["changed"])
+
+        for struct, marker, dirty in savepoint["structures"]:
+            struct.rollback_to(marker)
+            struct.dirty = dirty
+        index, marker = savepoint["index"]
+        if index is not None and index is self._index:
+            index.rollback_to(marker)
         else:
-            self.sleeping = TaskDorm(callback=self.stack.push)
+            self._changed()  # built (or replaced) since the savepoint
+
+    def _refresh(self, path, struct):
+        """Brings 'struct' up to date with changes saved to 'path' by other
+           commands since the load (keeping this session's changes).  Must
+           hold the exclusive repository lock."""
+        location = gitrepo.DEFAULT_REPOSITORY_PATH
+        name = os.path.relpath(path, location)
+        version = repolock.read_versions(location).get(name, 0)
+        if version == self._versions.get(name, 0) or not os.path.exists(path):
+            return struct
+
+        dirty = struct.dirty
+        struct = self._merge(path, struct)
+        struct.dirty = dirty
+        self._versions[name] = version
+        return struct
 
     def _save(self):
-        """Save structures to file"""
+        """Save modified structures to file.  Must hold the exclusive
+           repository lock.  Structures saved by another command since the
+           load are merged rather than overwritten."""
         if not os.path.exists(gitrepo.DEFAULT_REPOSITORY_PATH):
             # there is no data yet --> nothing to save
             return
 
-        self.stack.serialize(DEFAULT_STACK)
-        self.backlog.serialize(DEFAULT_QUEUE)
-        # self.blocked.serialize(DEFAULT_LIMBO)
-        self.sleeping.serialize(DEFAULT_DORM)
+        location = gitrepo.DEFAULT_REPOSITORY_PATH
+        versions = repolock.read_versions(location)
+        writes = atomicfile.WriteGroup(fsync=os.environ.get(FSYNC_ENV) == "1")
+        written = []
+        logged = set()  # paths of the structures only logged
+        for path, struct in self._structures():
+            if not struct.dirty and os.path.exists(path):
+                continue
+
+            name = os.path.relpath(path, location)
+            if versions.get(name, 0) != self._versions.get(name, 0) and \
+                    os.path.exists(path):
+                struct = self._merge(path, struct)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if path == DEFAULT_LIMBO and self._log_limbo(struct, writes):
+                logged.add(path)
+            else:
+                writes.write(path, struct.dumps())
+            versions[name] = versions.get(name, 0) + 1
+            written.append((path, struct))
+        if written:
+            repolock.write_versions(location, versions, writes)
+        self._save_id_index(written, writes)
+        writes.commit()
+        TASK_CACHE.changed.clear()  # the index has their summaries now
+        for path, struct in written:
+            if isinstance(struct, TaskLimbo):
+                struct.saved()
+            struct.dirty = False
+            self._base[path] = struct.data()
+            name = os.path.relpath(path, location)
+            self._versions[name] = versions[name]
+
+        self.graveyard.flush()
+        head = gitrepo.get_repository().head()
+        if written or head != self._head:
+            self._save_state_cache(
+                [(path, struct) for path, struct in written
+                 if path not in logged], head)
+
+    @staticmethod
+    def _log_limbo(limbo, writes):
+        """Schedules the changes made to 'limbo' for appending to the limbo
+           log & returns True, or returns False if limbo.json must be
+           rewritten instead (on first save, or once the log outgrew it), in
+           which case the log is scheduled for emptying"""
+        try:
+            log_size = os.path.getsize(DEFAULT_LIMBO_LOG)
+        except FileNotFoundError:
+            log_size = 0
+        if os.path.exists(DEFAULT_LIMBO) and \
+                log_size < os.path.getsize(DEFAULT_LIMBO):
+            changes = limbo.changes()
+            if changes:
+                writes.append(DEFAULT_LIMBO_LOG, json.dumps(changes) + "\n")
+            return True
+
+        if log_size:
+            writes.write(DEFAULT_LIMBO_LOG, "")
+        return False
+
+    @staticmethod
+    def _location(path):
+        """Returns the id index name of the structure saved to 'path'"""
+        names = {DEFAULT_STACK: "stack", DEFAULT_QUEUE: "backlog",
+                 DEFAULT_LIMBO: "limbo", DEFAULT_DORM: "dorm"}
+        if path in names:
+            return names[path]
+        return "stack:" + os.path.splitext(os.path.basename(path))[0]
+
+    @staticmethod
+    def _held_ids(data):
+        """Returns the set of ids of the tasks held by the structure data()
+           'data' (queued, not leased, in the case of the backlog)"""
+        if data is None:
+            return set()
+        if isinstance(data, dict):
+            return set(data)  # limbo
+        return {entry if isinstance(entry, str) else entry[0]
+                for entry in data
+                if isinstance(entry, str) or len(entry) == 2}
+
+    def _save_id_index(self, written, writes):
+        """Records the changes to the id/summary index of the live tasks
+           (read by the shell completers, see completion) made by saving the
+           'written' (file, structure) pairs & the changed tasks: schedules
+           them for appending to the index log, or the snapshot for
+           rewriting (on first use, or once the log outgrew it).  Only the
+           written structures & changed tasks are read, unless the snapshot
+           must be built from scratch."""
+        def summary(task):
+            """Returns the summary of 'task', loading it only if needed"""
+            if task.id not in TASK_CACHE.changed:
+                task_dict = TASK_CACHE.seeded(task.id)
+                if task_dict is not None:
+                    return task_dict.get("description")
+            return task.description
+
+        if not os.path.exists(DEFAULT_ID_INDEX):
+            self._build_id_index(writes, summary)
+            return
+
+        changes = {}
+        renamed = set(TASK_CACHE.changed)
+        for path, struct in written:
+            held = self._held_ids(self._base.get(path))
+            tasks = {}
+            for task in struct:
+                if task.id not in held or task.id in renamed:
+                    tasks[task.id] = summary(task)
+                held.discard(task.id)
+                renamed.discard(task.id)
+            tasks.update(dict.fromkeys(held))  # no longer held: removed
+            if tasks:
+                changes[self._location(path)] = tasks
+        renamed = [task for task_id in sorted(renamed)
+                   for task in [TASK_CACHE.get(task_id)] if task is not None]
+        if renamed:
+            changes[completion.ANY_LOCATION] = {
+                task.id: task.description for task in renamed}
+        if not changes:
+            return
+
+        try:
+            log_size = os.path.getsize(DEFAULT_ID_LOG)
+        except FileNotFoundError:
+            log_size = 0
+        if log_size < os.path.getsize(DEFAULT_ID_INDEX):
+            writes.append(DEFAULT_ID_LOG,
+                          json.dumps(changes, sort_keys=True) + "\n")
+            return
+
+        # compact: fold the log into the snapshot
+        try:
+            index = completion.load_index(DEFAULT_ID_INDEX)
+        except (OSError, ValueError, AttributeError):
+            self._build_id_index(writes, summary)
+            return
+        completion.apply_changes(index, changes)
+        writes.write(DEFAULT_ID_INDEX, json.dumps(index, sort_keys=True))
+        writes.write(DEFAULT_ID_LOG, "")
+
+    def _build_id_index(self, writes, summary):
+        """Schedules the id index snapshot, built from all the structures
+           (& 'summary' of their tasks), for writing & empties its log"""
+        stack = "stack" if self.worker is None else f"stack:{self.worker}"
+        structures = [(stack, self.stack),
+                      ("backlog", self.backlog),
+                      ("limbo", self.blocked),
+                      ("dorm", self.sleeping)]
+        for path, struct in sorted(self._stacks.items()):
+            structures.append((self._location(path), struct))
+        index = {location: {task.id: summary(task) for task in struct}
+                 for location, struct in structures}
+        writes.write(DEFAULT_ID_INDEX, json.dumps(index, sort_keys=True))
+        writes.write(DEFAULT_ID_LOG, "")
+
+    def _save_state_cache(self, written, head):
+        """Updates the parsed-state snapshot with this session's data"""
+        if self._state is None:
+            self._state = statecache.StateCache(DEFAULT_STATE_CACHE)
+            self._state.load(None, lambda old_head: None)
+
+        changed = ()
+        if self._head is not None and head != self._head:
+            # other commands may have changed tasks read by this one
+            changed = gitrepo.get_repository().changed_task_ids(
+                self._head, head)
+        for path, struct in written:
+            self._state.record_structure(path, struct.data())
+        self._state.update(head, TASK_CACHE.committed(), changed)
+        self._state.save()
+        self._head = head
+
+    @property
+    def index(self):
+        """Property accessor for the TaskIndex of all structures, built on
+           first use (& after a structure was replaced wholesale) & kept up
+           to date as tasks move"""
+        if self._index is None:
+            _structs = [
+                ("stack", self.stack),
+                ("backlog", self.backlog),
+                ("limbo", self.blocked),
+                ("dorm", self.sleeping),
+                ("graveyard", self.graveyard),
+            ]
+            self._index = TaskIndex.build(
+                (task_obj, location)
+                for location, struct in _structs for task_obj in struct)
+        return self._index
+
+    def _changed(self):
+        """Marks the structures as replaced (invalidating the index)"""
+        self._index = None
+
+    def _moved(self, task, location):
+        """Records (if the index is built) that 'task' is now held by the
+           structure named 'location', or by none if 'location' is None"""
+        if self._index is None:
+            return
+        if location is None:
+            self._index.discard(task.id)
+        else:
+            self._index.add(task, location)
+
+    def _push(self, task):
+        """Pushes 'task' on the stack (also called back by the limbo & the
+           dorm as they release tasks)"""
+        self.stack.push(task)
+        self._moved(task, "stack")
 
     def find(self, task_id):
-        """Searches for a task by 'task_id'. Uses prefix-matching."""
-        _structs = [
-            self.stack,
-            self.backlog,
-            self.blocked,
-            self.sleeping,
-        ]
-        for struct in _structs:
-            try:
-                task_obj = struct.find(task_id)
-                return task_obj
-            except LookupError:
-                # not found; try next structure
-                continue
+        """Searches for a task by 'task_id'. Uses prefix-matching; raises
+           AmbiguousTaskId if the prefix matches several tasks.  The archive
+           of closed tasks is only searched if no live task matches."""
+        task_obj, _ = self._lookup(task_id)
+        return task_obj
 
-        # the graveyard is just a list; search it
-        for task_obj in self.graveyard:
-            if task_obj.id.startswith(task_id):
-                return task_obj
+    def locate(self, task_id):
+        """Returns the name of the structure holding the task 'task_id'
+           (prefix-matched): stack, backlog, limbo, dorm or graveyard"""
+        _, location = self._lookup(task_id)
+        return location
+
+    def _lookup(self, task_id):
+        """Returns (task, structure name) for the task 'task_id'"""
+        try:
+            return self.index.lookup(task_id)
+        except AmbiguousTaskId:
+            raise
+        except LookupError:
+            pass
 
-        raise LookupError(f"No such task: '{task_id}'")
+        archived = self.graveyard.matches(task_id) if task_id else []
+        if not archived:
+            raise LookupError(f"No such task: '{task_id}'")
+        if len(archived) > 1:
+            raise AmbiguousTaskId(task_id, archived)
+
+        task_obj = TASK_CACHE.get(archived[0])
+        if task_obj is None:
+            _, task_dict = self.graveyard.find(archived[0])
+            task_obj = TASK_CACHE.add(TaskInfo(**task_dict))
+        return task_obj, "graveyard"
+
+    def history(self, since=None, until=None):
+        """Returns the list of (local close datetime, task) pairs of the
+           tasks closed between the local datetime.date 'since' & 'until'
+           (inclusive)"""
+        closed_tasks = []
+        for closed, task_dict in self.graveyard.history(since, until):
+            closed_at = datetime.datetime.fromtimestamp(closed)
+            closed_tasks.append((closed_at, TaskInfo(**task_dict)))
+        return closed_tasks
 
     def active_item(self, remove=True):
         """Returns the active item"""
@@ -432,21 +1358,27 @@ class TaskMaster(object):
             pass
         elif not self.backlog.empty():
             # feed the stack the top priority item from the queue
-            self.stack.push(self.backlog.get())
+            self._push(self.backlog.get())
         else:  # both the stack & queue are empty
             raise queue.Empty
 
         assert not self.stack.empty(), "BUG: empty stack"
 
         if remove:
-            return self.stack.pop()
+            active_item = self.stack.pop()
+            self._moved(active_item, None)
+            return active_item
 
         return self.stack.peek()
 
+    def wake_due(self):
+        """Moves the sleeping items whose timer expired to the stack"""
+        self.sleeping.reveille()
+
     def add(self, item):
         """Places the given item on top of the stack"""
         self.sleeping.reveille()  # wake items whose sleep timer has expired
-        self.stack.push(item)
+        self._push(item)
 
     # Calling self.active_item() could potentially wake items that we are not
     # expecting and cause unexpected behavior. Most methods (move, sleep, etc)
@@ -458,27 +1390,124 @@ class TaskMaster(object):
     def move(self):
         """Move the active item on the stack to the backlog"""
         active_item = self.stack.pop()
+        self._release(active_item)
         self.backlog.put(active_item)
+        self._moved(active_item, "backlog")
+
+    def claim(self, duration=DEFAULT_LEASE):
+        """Work-queue mode: atomically (across processes & hosts sharing
+           the repository) claims the highest priority backlog task for
+           this worker, for 'duration' seconds, & pushes it on the worker's
+           stack.  The session's changes so far are published with the
+           claim (a later rollback or failure cannot undo them).  Raises
+           queue.Empty if the backlog is empty."""
+        if self.worker is None:
+            raise ValueError("claim() needs a worker name")
+
+        os.makedirs(gitrepo.DEFAULT_REPOSITORY_PATH, exist_ok=True)
+        lock = repolock.RepositoryLock(gitrepo.DEFAULT_REPOSITORY_PATH)
+        with lock.exclusive():
+            self._refresh(DEFAULT_QUEUE, self.backlog)
+            now = time.time()
+            expired = self.backlog.expired(now)
+            task = self.backlog.claim(self.worker, duration, now)
+            self._changed()  # expired leases may have returned to the queue
+            for lost, _, holder, _ in expired:
+                # the stalled worker must not close the re-queued task
+                self._unstack(lost, holder)
+            self.stack.push(task)
+            # publish the claim before releasing the lock, with the tasks
+            # written so far that the saved structures may refer to
+            gitrepo.get_repository().flush()
+            self._save()
+        return task
+
+    def _unstack(self, task, worker):
+        """Removes 'task' from the stack of 'worker'.  Must hold the
+           exclusive repository lock."""
+        if worker == self.worker:
+            self.stack.remove(task.id)
+            return
+
+        path = self._stack_path(worker)
+        if path not in self._stacks:
+            stack_data = self._read_structure(path)
+            if stack_data is None:
+                return
+            self._stacks[path] = TasksInProgress.from_data(stack_data)
+        self._stacks[path].remove(task.id)
+
+    def _release(self, task):
+        """Ends this worker's lease on 'task', if it holds one.  Raises
+           LookupError if the lease expired & went to another worker."""
+        if self.worker is not None and task.id in self.backlog.leases:
+            try:
+                self.backlog.release(task.id, self.worker)
+            except LookupError as error:
+                raise LookupError(
+                    f"Lease on task '{task.id}' was lost") from error
+
+    def _check_releases(self):
+        """Raises LookupError if a lease released in this session expired
+           & was returned to the queue by another command meanwhile.  Must
+           hold the exclusive repository lock."""
+        location = gitrepo.DEFAULT_REPOSITORY_PATH
+        name = os.path.relpath(DEFAULT_QUEUE, location)
+        released = [entry[0] for entry in self._base.get(DEFAULT_QUEUE) or []
+                    if len(entry) == 4 and entry[2] == self.worker and
+                    entry[0] not in self.backlog.leases]
+        if not released or repolock.read_versions(location).get(name, 0) == \
+                self._versions.get(name, 0):
+            return
+
+        with open(DEFAULT_QUEUE) as infile:
+            held = {entry[0] for entry in json.loads(infile.read())
+                    if len(entry) == 4 and entry[2] == self.worker}
+        for task_id in released:
+            if task_id not in held:
+                raise LookupError(f"Lease on task '{task_id}' was lost")
 
     def activate(self, id):
         """Move an item from the backlog to the top of the stack"""
-        active_item = self.backlog.get(id)
-        self.stack.push(active_item)
+        task_obj, location = self.index.lookup(id)
+        if location != "backlog":
+            raise LookupError(f"Task '{id}' is not in the backlog " +
+                              f"(found in {location})")
+
+        active_item = self.backlog.get(task_obj.id)
+        self._push(active_item)
 
     def sleep(self, duration):
         """Puts the active item to sleep for timedelta 'duration'"""
         active_item = self.stack.pop()
         self.sleeping.sleep(active_item, duration)
+        self._moved(active_item, "dorm")
 
     def wake_at(self, timestamp):
         """Puts the active item to sleep until datetime 'timestamp'"""
         active_item = self.stack.pop()
         self.sleeping.wake_at(active_item, timestamp)
+        self._moved(active_item, "dorm")
+
+    def block(self, blocker_id):
+        """Moves the active item to limbo until the task 'blocker_id' (which
+           may itself be blocked) is closed"""
+        blocker, location = self._lookup(blocker_id)
+        if location == "graveyard":
+            # it would never be closed again to release the active item
+            raise LookupError(f"Task '{blocker_id}' is already closed")
+        active_item = self.stack.peek()
+        self.blocked.block(active_item, blocker)  # may refuse a cycle
+        self.stack.pop()
+        self._moved(active_item, "limbo")
 
     def close(self):
-        """Closes out the active item"""
+        """Closes out the active item, releasing the items it blocked"""
         active_item = self.stack.pop()
-        self.graveyard.append(active_item)
+        self._release(active_item)
+        self.graveyard.bury(active_item)
+        self._moved(active_item, "graveyard")
+        self.blocked.unblock(active_item)
 
     @property
     def current_task(self):
@@ -501,7 +1530,12 @@ class TaskPriority:  # pylint: disable=too-few-public-methods
 
 
 class TaskInfo(ISerializable):
-    """Stores all information about a task"""
+    """Stores all information about a task.  Instances are compact (no
+       per-instance __dict__, interned type strings, no storage for absent
+       extra fields); view() exposes the task as a read-only mapping."""
+    __slots__ = ("id", "description", "type", "priority", "_unknown_args",
+                 "_view")
+
     _READ_ONLY_FIELDS = [
         "id",
     ]
@@ -509,17 +1543,18 @@ class TaskInfo(ISerializable):
     def __init__(self, description, task_type, **kwargs):
         self.id = uuid.uuid4().hex
         self.description = description
-        self.type = task_type
+        self.type = TaskInfo._intern(task_type)
         self.priority = None
         self._unknown_args = None
+        self._view = None
 
         self._load_dict(kwargs)
 
-    def _load_dict(self, kwargs):
-        """Loads keyword arguments from 'kwargs' dictionary"""
+    def _load_dict(self, keyword_args):
+        """Loads keyword arguments from the 'keyword_args' dictionary, which
+           is consumed (callers pass a dictionary they own)"""
         # TaskInfo always needs a description and task_type, but all other
         # supported (optional) parameters are loaded from kwargs to
-        keyword_args = dict(kwargs)
         task_id = TaskInfo._dpop(keyword_args, "id")
         if task_id is not None:
             self.id = task_id
@@ -534,16 +1569,25 @@ class TaskInfo(ISerializable):
         if description is not None:
             self.description = description
 
-        task_type = TaskInfo._dpop(keyword_args, "type")
+        # "task_type" is how the type is named in dict() (and the editor)
+        task_type = TaskInfo._dpop(keyword_args, "task_type")
+        task_type = TaskInfo._dpop(keyword_args, "type", task_type)
         if task_type is not None:
-            self.type = task_type
+            self.type = TaskInfo._intern(task_type)
 
         # store unknown args so that they are not lost across
         # serialization/deserialization
-        self._unknown_args = keyword_args
+        self._unknown_args = keyword_args or None
 
         self.set_priority(priority)
 
+    @staticmethod
+    def _intern(value):
+        """Interns string values so that tasks share their type strings"""
+        if isinstance(value, str):
+            return sys.intern(value)
+        return value
+
     @staticmethod
     def _dpop(dictionary, key, default=None):
         """Removes & returns the value of 'key' from dictionary"""
@@ -577,8 +1621,8 @@ class TaskInfo(ISerializable):
             "priority",
         ]
 
-        temp_dict = self.dict()
-        filtered_dict = {key: temp_dict[key] for key in _str_keys}
+        view = self.view()
+        filtered_dict = {key: view[key] for key in _str_keys}
         return self.pretty(filtered_dict)
 
     def dict(self):
@@ -590,10 +1634,18 @@ class TaskInfo(ISerializable):
             "priority": self.priority,
         }
 
-        retval.update(self._unknown_args)
+        if self._unknown_args:
+            retval.update(self._unknown_args)
 
         return retval
 
+    def view(self):
+        """Returns a read-only mapping with the same contents as dict(),
+           backed by the task itself (no copy; created once per task)"""
+        if self._view is None:
+            self._view = TaskView(self)
+        return self._view
+
     def edit(self):
         """Opens up an editor and allows the user to update the task directly.
         """
@@ -746,7 +1798,10 @@ class TaskInfo(ISerializable):
                 "TaskInfo does not support serialization to a custom filename")
 
         to_file = self.filename
-        gitrepo.write_task(to_file, self.pretty(self.dict()))
+        task_dict = self.dict()
+        gitrepo.write_task(to_file, self.pretty(task_dict))
+        # this instance is now the authoritative copy of the task
+        TASK_CACHE.replace(self, task_dict)
 
     @staticmethod
     def _filename(task_id):
@@ -767,34 +1822,287 @@ class TaskInfo(ISerializable):
 
     @classmethod
     def from_id(cls, task_id):
-        """Returns a task object for the given task id"""
-        return cls.load(TaskInfo._filename(task_id))
+        """Returns the task object for the given task id.  Tasks are loaded
+           once per session: every call for the same id returns the same
+           instance (see TaskCache)."""
+        task = TASK_CACHE.get(task_id)
+        if task is None:
+            task_dict = TASK_CACHE.seeded(task_id)
+            if task_dict is not None:
+                task = cls(**task_dict)  # from the state snapshot
+            else:
+                task = cls.load(TaskInfo._filename(task_id))
+                TASK_CACHE.record(task_id, task.dict())
+            task = TASK_CACHE.add(task)
+        return task
+
+
+class TaskCache(threading.local):
+    """Identity map of loaded tasks, guaranteeing one TaskInfo instance per
+       task id.  With 'maxsize' set, it becomes a bounded LRU cache (the
+       least recently used tasks are forgotten) for long-running embedders.
+       Hit & miss counts are kept for reporting.  Like sessions, the map is
+       per-thread: each thread sees only the tasks it loaded or saved."""
+    def __init__(self, maxsize=None):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._tasks = collections.OrderedDict()
+        self._seeds = {}
+        self._committed = {}  # task id -> dict as read from/written to git
+        self.changed = set()  # ids of the tasks saved in this session
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def get(self, task_id):
+        """Returns the cached task for 'task_id', or None"""
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            if self.maxsize is not None:
+                self._tasks.move_to_end(task_id)
+            return task
+
+    def add(self, task):
+        """Caches 'task' & returns the canonical instance for its id (an
+           already cached instance wins)"""
+        with self._lock:
+            cached = self._tasks.setdefault(task.id, task)
+            if self.maxsize is not None:
+                self._tasks.move_to_end(task.id)
+                while len(self._tasks) > self.maxsize:
+                    self._tasks.popitem(last=False)
+            return cached
+
+    def invalidate(self, task_id):
+        """Drops the cached entry for 'task_id', if any"""
+        with self._lock:
+            self._tasks.pop(task_id, None)
+            self._seeds.pop(task_id, None)
+
+    def replace(self, task, task_dict):
+        """Makes the just saved 'task' (saved as 'task_dict') the cached
+           instance for its id & records it as changed"""
+        self.invalidate(task.id)
+        self.add(task)
+        with self._lock:
+            self.changed.add(task.id)
+            self._committed[task.id] = task_dict
+
+    def record(self, task_id, task_dict):
+        """Records 'task_dict' as the data of 'task_id' read from the
+           repository"""
+        with self._lock:
+            self._committed[task_id] = task_dict
+
+    def seed(self, task_dicts):
+        """Registers the {task id: task dict} map of known task data (e.g.
+           from a state snapshot) from which tasks can be built instead of
+           being read from the repository"""
+        with self._lock:
+            self._seeds = task_dicts
+
+    def seeded(self, task_id):
+        """Returns a copy of the seeded task dict for 'task_id', or None"""
+        with self._lock:
+            task_dict = self._seeds.get(task_id)
+            return dict(task_dict) if task_dict is not None else None
+
+    def committed(self):
+        """Returns (& forgets) the {task id: task dict} map of the tasks
+           read from or written to the repository since the last call, as
+           they were read or written (later changes made in memory only are
+           not included)"""
+        with self._lock:
+            committed, self._committed = self._committed, {}
+        return committed
+
+    def clear(self):
+        """Drops all cached entries & resets the statistics"""
+        with self._lock:
+            self._tasks.clear()
+            self._seeds = {}
+            self._committed = {}
+            self.changed = set()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Returns a dictionary of cache statistics"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._tasks),
+            }
+
+
+# per-session (so per-thread) identity map used by TaskInfo.from_id()
+TASK_CACHE = TaskCache()
+
+
+class TaskIndex(Undoable):
+    """Sorted index of the ids of all known tasks, recording the task object
+       & the name of the structure holding each one.  Prefix lookups are a
+       binary search (O(log n)) over the sorted ids."""
+    MIN_PREFIX = 7  # display abbreviation; widened only when ambiguous
+
+    def __init__(self):
+        self._ids = []
+        self._entries = {}  # task id -> (task, structure name)
+
+    @classmethod
+    def build(cls, entries):
+        """Creates an index of the (task, structure name) pairs 'entries'
+           (a later pair for the same id wins), sorting the ids once"""
+        index = cls()
+        index._entries = {task.id: (task, location)
+                          for task, location in entries}
+        index._ids = sorted(index._entries)
+        return index
+
+    def __len__(self):
+        return len(self._ids)
 
+    def __contains__(self, task_id):
+        return task_id in self._entries
 
-class RefCount(object):
-    """Reference counter wrapper for an object"""
-    def __init__(self, data, count=0):
-        self.data = data
-        self._refcount = count
+    def add(self, task, location):
+        """Records 'task' as held by the structure named 'location'"""
+        entry = self._entries.get(task.id)
+        if entry is None:
+            bisect.insort(self._ids, task.id)
+            self._record(lambda: self.discard(task.id))
+        else:
+            self._record(lambda: self.add(*entry))
+        self._entries[task.id] = (task, location)
+
+    def discard(self, task_id):
+        """Forgets 'task_id', if known"""
+        entry = self._entries.pop(task_id, None)
+        if entry is not None:
+            del self._ids[bisect.bisect_left(self._ids, task_id)]
+            self._record(lambda: self.add(*entry))
+
+    def matches(self, prefix):
+        """Returns the sorted list of ids starting with 'prefix'"""
+        start = bisect.bisect_left(self._ids, prefix)
+        end = start
+        while end < len(self._ids) and self._ids[end].startswith(prefix):
+            end += 1
+        return self._ids[start:end]
+
+    def lookup(self, prefix):
+        """Returns (task, structure name) for the single task whose id
+           starts with 'prefix'.  Raises LookupError if there is none &
+           AmbiguousTaskId if there are several."""
+        if not prefix:
+            raise LookupError("Empty task id")
+
+        start = bisect.bisect_left(self._ids, prefix)
+        if start == len(self._ids) or \
+                not self._ids[start].startswith(prefix):
+            raise LookupError(f"No such task: '{prefix}'")
+
+        # an exact id is never ambiguous, even if it prefixes another id
+        if self._ids[start] != prefix and start + 1 < len(self._ids) and \
+                self._ids[start + 1].startswith(prefix):
+            raise AmbiguousTaskId(prefix, self.matches(prefix))
+
+        return self._entries[self._ids[start]]
+
+    def shortest_prefix(self, task_id, minimum=MIN_PREFIX):
+        """Returns the shortest prefix of 'task_id' (but at least 'minimum'
+           characters) that identifies it uniquely"""
+        position = bisect.bisect_left(self._ids, task_id)
+        following = position + 1 if task_id in self._entries else position
+        length = 1
+        for neighbor in (position - 1, following):
+            if 0 <= neighbor < len(self._ids):
+                other = self._ids[neighbor]
+                common = 0
+                for char_a, char_b in zip(task_id, other):
+                    if char_a != char_b:
+                        break
+                    common += 1
+                length = max(length, common + 1)
+        return task_id[:max(length, minimum)]
+
+
+class TaskView(collections.abc.Mapping):
+    """Read-only, copy-free mapping view of a TaskInfo (see dict())"""
+    __slots__ = ("_task",)
+
+    # view key -> TaskInfo attribute
+    _FIELDS = collections.OrderedDict([
+        ("id", "id"),
+        ("description", "description"),
+        ("task_type", "type"),
+        ("priority", "priority"),
+    ])
+
+    def __init__(self, task):
+        self._task = task
+
+    def __getitem__(self, key):
+        attr = TaskView._FIELDS.get(key)
+        if attr is not None:
+            return getattr(self._task, attr)
+
+        unknown_args = self._task._unknown_args  # pylint: disable=W0212
+        if unknown_args and key in unknown_args:
+            return unknown_args[key]
+
+        raise KeyError(key)
+
+    def __iter__(self):
+        yield from TaskView._FIELDS
+        unknown_args = self._task._unknown_args  # pylint: disable=W0212
+        if unknown_args:
+            yield from unknown_args
+
+    def __len__(self):
+        return sum(1 for _ in self)
 
-    # equivalance is useful on its own but is also required for hash support
-    def __eq__(self, other):
-        """equivalence override"""
-        if isinstance(other, RefCount):
-            return self.data == other.data
 
-        return self.data == other
+class TaskProxy(object):
+    """Lightweight handle for a stored task.  Only the id is known up front;
+       the task itself is loaded on first access to any other attribute, so
+       loading a structure never has to read task files."""
+    __slots__ = ("id", "_task")
 
-    def add_ref(self):
-        """Add a reference"""
-        self._refcount += 1
+    def __init__(self, task_id):
+        self._task = None
+        self.id = task_id
+
+    def __getattr__(self, name):
+        """Called for attributes not found on the proxy: delegate to the
+           (loaded) task"""
+        return getattr(self.resolve(), name)
+
+    def __setattr__(self, name, value):
+        if name in TaskProxy.__slots__:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.resolve(), name, value)
+
+    def __str__(self):
+        return str(self.resolve())
 
-    def remove_ref(self):
-        """Remove a reference"""
-        self._refcount -= 1
-        assert self._refcount >= 0, "BUG: negative refcount"
+    def resolve(self):
+        """Returns the proxied TaskInfo, loading it if needed"""
+        if self._task is None:
+            self._task = TaskInfo.from_id(self.id)
+        return self._task
 
     @property
-    def refcount(self):
-        """Property accessor for active reference count"""
-        return self._refcount
+    def loaded(self):
+        """Property accessor: True once the task has been loaded"""
+        return self._task is not None
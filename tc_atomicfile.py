@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+"""
+Test cases for atomicfile.py
+"""
+
+import unittest
+import shutil
+import os
+from unittest.mock import patch
+import atomicfile
+
+
+def identify(testobj):
+    """Identify running test in log"""
+    print(f"\n{'='*72}\n{testobj.id().split('.')[-1]}\n{'='*72}")
+
+
+class TestWriteGroup(unittest.TestCase):
+    """Test WriteGroup class"""
+    def setUp(self):
+        """Set up before test cases"""
+        identify(self)
+        self.test_dir = os.path.realpath("./temp/")
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+        os.makedirs(self.test_dir)
+        self.paths = [os.path.join(self.test_dir, name)
+                      for name in ("a.json", "b.json")]
+
+    def tearDown(self):
+        """Tear down after test cases"""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_grouped_fsync(self):
+        """Test that a group replaces every file & fsyncs the directory once"""
+        atomicfile.write_atomic(self.paths[0], "old")
+        group = atomicfile.WriteGroup(fsync=True)
+        group.write(self.paths[0], "new")
+        group.write(self.paths[1], b"bytes")
+        with patch("os.fsync", wraps=os.fsync) as fsync:
+            group.commit()
+        self.assertEqual(fsync.call_count, 3)  # two files & one directory
+
+        with open(self.paths[0]) as infile:
+            self.assertEqual(infile.read(), "new")
+        self.assertEqual(sorted(os.listdir(self.test_dir)),
+                         ["a.json", "b.json"])
+
+    def test_append(self):
+        """Test that a group appends once the replacements are in place"""
+        group = atomicfile.WriteGroup()
+        group.append(self.paths[0], "first\n")
+        group.write(self.paths[0], "old\n")
+        group.append(self.paths[0], b"second\n")
+        self.assertEqual(len(group), 3)
+        group.commit()
+
+        with open(self.paths[0]) as infile:
+            self.assertEqual(infile.read(), "old\nfirst\nsecond\n")
+        self.assertEqual(len(group), 0)
+
+    def test_failed_write_keeps_old_contents(self):
+        """Test that a failing write leaves the target & no temp file"""
+        atomicfile.write_atomic(self.paths[0], "old")
+        with self.assertRaises(TypeError):
+            atomicfile.write_atomic(self.paths[0], None)
+
+        with open(self.paths[0]) as infile:
+            self.assertEqual(infile.read(), "old")
+        self.assertEqual(os.listdir(self.test_dir), ["a.json"])
+
+
+if __name__ == '__main__':
+    unittest.main()
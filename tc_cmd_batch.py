@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+"""
+Test cases for cmd_batch.py
+"""
+
+import json
+import os
+import unittest
+import fixtures
+
+# commits need an identity, even on hosts without a git configuration
+os.environ.setdefault("GIT_AUTHOR_NAME", "task")
+os.environ.setdefault("GIT_AUTHOR_EMAIL", "task@localhost")
+os.environ.setdefault("GIT_COMMITTER_NAME", "task")
+os.environ.setdefault("GIT_COMMITTER_EMAIL", "task@localhost")
+
+
+def identify(testobj):
+    """Identify running test in log"""
+    print(f"\n{'='*72}\n{testobj.id().split('.')[-1]}\n{'='*72}")
+
+
+class TestBatch(fixtures.SandboxTestCase):
+    """Test the 'batch' command"""
+    def setUp(self):
+        """Set up before test cases"""
+        identify(self)
+        super().setUp()
+        self._task(["add", "-s", "first"])
+
+    def test_one_commit(self):
+        """Test that a batch is saved as one commit, with results streamed
+           per command"""
+        commits = self._commit_count()
+        status, output = self._task(
+            ["batch"], 'add -s "second task"\n\n# comment\n'
+                       '["add", "-s", "third"]\npop\nshow\n')
+        self.assertEqual(status, 0)
+        results = [json.loads(line) for line in output.splitlines()]
+        self.assertEqual([result["line"] for result in results],
+                         [1, 4, 5, 6])
+        self.assertTrue(all(result["ok"] for result in results))
+        self.assertIn("second task", results[-1]["output"])
+
+        self.assertEqual(self._commit_count(), commits + 1)
+        self.assertEqual(self._summaries(), {
+            "stack": ["first", "second task"], "backlog": ["third"]})
+
+    def test_stop_on_error(self):
+        """Test that a failure discards the whole batch"""
+        commits = self._commit_count()
+        status, output = self._task(["batch"], "add -s x\nactivate zzz\n"
+                                               "add -s y\n")
+        self.assertEqual(status, 1)
+        output = output.splitlines()
+        self.assertEqual(len(output), 2)
+        self.assertFalse(json.loads(output[1])["ok"])
+        self.assertEqual(self._commit_count(), commits)
+        self.assertEqual(self._summaries(), {"stack": ["first"]})
+
+    def test_keep_going(self):
+        """Test that failed commands are undone & skipped"""
+        status, output = self._task(
+            ["batch", "-k"], "add -s x\nadd -s y\ndone\nactivate zzz\n"
+                             "claim\nadd -s z\n")
+        self.assertEqual(status, 1)
+        self.assertEqual([json.loads(line)["ok"]
+                          for line in output.splitlines()],
+                         [True, True, True, False, False, True])
+        self.assertEqual(self._summaries(), {"stack": ["first", "x", "z"]})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+"""
+Test cases for cmd_serve.py & daemon.py
+"""
+
+import concurrent.futures
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import unittest
+import daemon
+import fixtures
+
+# commits need an identity, even on hosts without a git configuration
+os.environ.setdefault("GIT_AUTHOR_NAME", "task")
+os.environ.setdefault("GIT_AUTHOR_EMAIL", "task@localhost")
+os.environ.setdefault("GIT_COMMITTER_NAME", "task")
+os.environ.setdefault("GIT_COMMITTER_EMAIL", "task@localhost")
+
+CLIENTS = 16
+
+
+def identify(testobj):
+    """Identify running test in log"""
+    print(f"\n{'='*72}\n{testobj.id().split('.')[-1]}\n{'='*72}")
+
+
+class TestServe(fixtures.SandboxTestCase):
+    """Test the task daemon & forwarding to it"""
+    def setUp(self):
+        """Set up before test cases"""
+        identify(self)
+        super().setUp()
+        self.socket = os.path.join(self.repository, daemon.SOCKET_FILE)
+        self.server = None
+        self._task(["add", "-s", "first"])
+
+    def tearDown(self):
+        """Tear down after test cases"""
+        self._stop()
+        super().tearDown()
+
+    def _start(self):
+        """Starts the daemon & waits until it serves"""
+        self.server = subprocess.Popen(
+            [sys.executable, "task", "serve"], cwd=self.test_dir,
+            stdout=subprocess.DEVNULL)
+        for _ in range(100):
+            if daemon.is_running(self.socket):
+                return
+            time.sleep(0.05)
+        self.fail("the daemon did not start")
+
+    def _stop(self):
+        """Stops the daemon, if running"""
+        if self.server is not None:
+            self.server.send_signal(signal.SIGTERM)
+            self.assertEqual(self.server.wait(timeout=10), 0)
+            self.server = None
+
+    def test_forward_and_fall_back(self):
+        """Test that commands run in the daemon while it serves, & in the
+           calling process otherwise"""
+        self.assertIsNone(daemon.forward(["show"], path=self.socket))
+        self._start()
+        response = daemon.forward(["add", "-s", "second"], path=self.socket)
+        self.assertEqual(response["status"], 0)
+        response = daemon.forward(["activate", "zzz"], path=self.socket)
+        self.assertEqual(response["status"], 1)
+        self.assertIn("zzz", response["error"])
+
+        status, output = self._task(["show"])
+        self.assertEqual(status, 0)
+        self.assertIn("second", output)
+        self._stop()
+        self.assertFalse(os.path.exists(self.socket))
+        self.assertEqual(self._summaries(), {"stack": ["first", "second"]})
+
+        # a socket left behind by a dead daemon is ignored
+        with socket.socket(socket.AF_UNIX) as stale:
+            stale.bind(self.socket)
+        status, output = self._task(["show"])
+        self.assertEqual(status, 0)
+        self.assertIn("second", output)
+
+    def test_group_commit(self):
+        """Test that concurrent clients are served & their changes saved in
+           fewer commits than requests"""
+        self._start()
+        commits = self._commit_count()
+        with concurrent.futures.ThreadPoolExecutor(CLIENTS) as executor:
+            responses = list(executor.map(
+                lambda i: daemon.forward(["add", "-s", f"task {i}"],
+                                         path=self.socket),
+                range(CLIENTS)))
+        self.assertTrue(all(response["status"] == 0
+                            for response in responses))
+        self.assertLess(self._commit_count() - commits, CLIENTS)
+        self.assertEqual(len(self._summaries()["stack"]), CLIENTS + 1)
+
+    def test_wake_timer(self):
+        """Test that sleeping tasks are woken without another command"""
+        self._start()
+        response = daemon.forward(["sleep", "0"], path=self.socket)
+        self.assertEqual(response["status"], 0)
+        for _ in range(100):
+            if self._summaries() == {"stack": ["first"]}:
+                break
+            time.sleep(0.05)
+        self.assertEqual(self._summaries(), {"stack": ["first"]})
+
+
+if __name__ == '__main__':
+    unittest.main()
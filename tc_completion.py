@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+"""
+Test cases for completion.py
+"""
+
+import json
+import os
+import unittest
+import completion
+import fixtures
+
+# commits need an identity, even on hosts without a git configuration
+os.environ.setdefault("GIT_AUTHOR_NAME", "task")
+os.environ.setdefault("GIT_AUTHOR_EMAIL", "task@localhost")
+os.environ.setdefault("GIT_COMMITTER_NAME", "task")
+os.environ.setdefault("GIT_COMMITTER_EMAIL", "task@localhost")
+
+# adds three tasks, moves one to the backlog & closes another; prints the
+# ids of the tasks left on the stack & in the backlog
+SESSION_SCRIPT = """
+import taskinfo
+with taskinfo.TaskMaster() as taskmaster:
+    for summary in ["first", "second", "third"]:
+        task = taskinfo.TaskInfo(summary, "quick")
+        task.serialize()
+        taskmaster.add(task)
+    taskmaster.move()
+    taskmaster.close()
+    print(taskmaster.stack.peek().id, taskmaster.backlog.peek().id)
+"""
+
+# renames the active task to argv[1] & activates the backlog task, if any
+CHANGE_SCRIPT = """
+import sys
+import taskinfo
+with taskinfo.TaskMaster() as taskmaster:
+    task = taskmaster.current_task
+    task.description = sys.argv[1]
+    task.serialize()
+    if not taskmaster.backlog.empty():
+        taskmaster.activate(taskmaster.backlog.peek().id)
+"""
+
+
+def identify(testobj):
+    """Identify running test in log"""
+    print(f"\n{'='*72}\n{testobj.id().split('.')[-1]}\n{'='*72}")
+
+
+class TestCompletion(fixtures.SandboxTestCase):
+    """Test the task id completers & the index they read"""
+    def setUp(self):
+        """Set up before test cases"""
+        identify(self)
+        super().setUp()
+        self.index_file = os.path.join(self.test_dir,
+                                       completion.ID_INDEX_FILE)
+
+    def test_candidates(self):
+        """Test filtering by prefix & by structure"""
+        with open(self.index_file, "w") as outfile:
+            outfile.write(json.dumps({
+                "stack": {"ab12": "active"},
+                "backlog": {"ab34": "queued", "cd56": "other"},
+            }))
+        self.assertEqual(
+            completion.candidates("ab", index_file=self.index_file),
+            {"ab12": "active", "ab34": "queued"})
+        self.assertEqual(
+            completion.candidates("", ["backlog"], self.index_file),
+            {"ab34": "queued", "cd56": "other"})
+        self.assertEqual(
+            completion.candidates("", index_file=self.index_file + "x"), {})
+
+    def test_log(self):
+        """Test that the logged changes are applied to the snapshot"""
+        with open(self.index_file, "w") as outfile:
+            outfile.write(json.dumps({
+                "stack": {"ab12": "active"},
+                "backlog": {"ab34": "queued", "cd56": "other"},
+            }))
+        with open(completion.log_file(self.index_file), "w") as outfile:
+            for changes in [{"backlog": {"ab34": None},
+                             "stack": {"ab34": "queued"}},
+                            {"*": {"ab12": "renamed", "ef78": "unknown"}}]:
+                outfile.write(json.dumps(changes) + "\n")
+        self.assertEqual(completion.load_index(self.index_file), {
+            "stack": {"ab12": "renamed", "ab34": "queued"},
+            "backlog": {"cd56": "other"},
+        })
+
+    def test_index_written_on_save(self):
+        """Test that saving a session updates the index"""
+        active_id, queued_id = self._run(SESSION_SCRIPT).split()
+
+        index_file = os.path.join(self.repository, completion.ID_INDEX_FILE)
+        self.assertEqual(completion.candidates("", index_file=index_file),
+                         {active_id: "first", queued_id: "third"})
+        self.assertEqual(
+            completion.candidates("", ["backlog"], index_file),
+            {queued_id: "third"})
+
+        # a later save only logs its changes
+        with open(index_file) as infile:
+            snapshot = infile.read()
+        self._run(CHANGE_SCRIPT, "renamed")
+        with open(index_file) as infile:
+            self.assertEqual(infile.read(), snapshot)
+        self.assertEqual(completion.candidates("", ["stack"], index_file),
+                         {active_id: "renamed", queued_id: "third"})
+        self.assertEqual(completion.candidates("", ["backlog"], index_file),
+                         {})
+
+        # the snapshot is rewritten once the log outgrows it
+        for summary in ["again", "last"]:
+            self._run(CHANGE_SCRIPT, summary)
+        with open(index_file) as infile:
+            self.assertNotEqual(infile.read(), snapshot)
+        self.assertEqual(completion.candidates("", index_file=index_file),
+                         {active_id: "renamed", queued_id: "last"})
+
+
+if __name__ == '__main__':
+    unittest.main()
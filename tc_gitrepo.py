@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+
+"""
+Test cases for gitrepo.py
+"""
+
+import concurrent.futures
+import unittest
+import shutil
+import os
+import subprocess
+import sys
+import threading
+from unittest import mock
+import gitrepo
+import packstore
+import repolock
+
+# commits need an identity, even on hosts without a git configuration
+os.environ.setdefault("GIT_AUTHOR_NAME", "task")
+os.environ.setdefault("GIT_AUTHOR_EMAIL", "task@localhost")
+os.environ.setdefault("GIT_COMMITTER_NAME", "task")
+os.environ.setdefault("GIT_COMMITTER_EMAIL", "task@localhost")
+
+# writes (& compacts, with "compact" as last argument) in another process
+OUTSIDE_WRITE_SCRIPT = """
+import sys
+import packstore
+store = packstore.PackedTaskStore(sys.argv[1])
+for record in sys.argv[2:]:
+    if record == "compact":
+        store.compact()
+    else:
+        store.write("abc", record.encode())
+        store.flush()
+"""
+
+
+def identify(testobj):
+    """Identify running test in log"""
+    print(f"\n{'='*72}\n{testobj.id().split('.')[-1]}\n{'='*72}")
+
+
+class TestTaskRepo(unittest.TestCase):
+    """Test TaskRepo class"""
+    BARE = False
+    PACKED = False
+
+    def setUp(self):
+        """Set up before test cases"""
+        identify(self)
+        self.test_dir = os.path.realpath("./temp/")
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+        self.repo = gitrepo.TaskRepo(self.test_dir, bare=self.BARE,
+                                     packed=self.PACKED)
+
+    def tearDown(self):
+        """Tear down after test cases"""
+        self.repo.close()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_read_task_round_trip(self):
+        """Test that committed tasks are read back through the blob reader"""
+        self.repo.write_task("abc.json", '{"id": "abc"}')
+        self.assertEqual(self.repo.read_task("abc.json"), '{"id": "abc"}')
+        self.repo.write_task("abc.json", '{"id": "abc", "x": 1}')
+        self.assertEqual(self.repo.read_task("abc.json"),
+                         '{"id": "abc", "x": 1}')
+
+    def test_read_task_missing(self):
+        """Test that reading an unknown task raises an IOError"""
+        with self.assertRaises(IOError):
+            self.repo.read_task("missing.json")
+
+    def _commit_count(self):
+        """Returns the number of commits in the test repository"""
+        output = subprocess.check_output(
+            ["git", "rev-list", "--count", "HEAD"], cwd=self.test_dir)
+        return int(output)
+
+    def test_transaction_single_commit(self):
+        """Test that a transaction publishes all writes in one commit"""
+        with self.repo.transaction():
+            for i in range(5):
+                self.repo.write_task(f"t{i}.json", str(i))
+            # buffered writes are visible to readers of this repo
+            self.assertEqual(self.repo.read_task("t3.json"), "3")
+
+        self.assertEqual(self._commit_count(), 1)
+        self.assertEqual(self.repo.read_task("t4.json"), "4")
+
+    def test_transaction_abort(self):
+        """Test that nothing is committed when a transaction raises"""
+        with self.assertRaises(KeyError):
+            with self.repo.transaction():
+                self.repo.write_task("t.json", "{}")
+                raise KeyError
+
+        with self.assertRaises(IOError):
+            self.repo.read_task("t.json")
+
+    def test_transaction_savepoint(self):
+        """Test undoing the writes made after a savepoint"""
+        with self.repo.transaction():
+            self.repo.write_task("kept.json", "1")
+            savepoint = self.repo.savepoint()
+            self.repo.write_task("kept.json", "2")
+            self.repo.write_task("undone.json", "3")
+            self.repo.rollback_to(savepoint)
+            self.assertEqual(self.repo.read_task("kept.json"), "1")
+
+        self.assertEqual(self._commit_count(), 1)
+        self.assertEqual(self.repo.read_task("kept.json"), "1")
+        with self.assertRaises(IOError):
+            self.repo.read_task("undone.json")
+
+    def test_transaction_flush(self):
+        """Test publishing the writes buffered so far, keeping the
+           transaction open"""
+        with self.assertRaises(KeyError):
+            with self.repo.transaction():
+                self.repo.write_task("flushed.json", "1")
+                self.repo.flush()
+                self.repo.write_task("aborted.json", "2")
+                raise KeyError
+
+        self.assertEqual(self._commit_count(), 1)
+        self.assertEqual(self.repo.read_task("flushed.json"), "1")
+        with self.assertRaises(IOError):
+            self.repo.read_task("aborted.json")
+
+    def test_changed_task_ids(self):
+        """Test that exactly the tasks written between two heads are
+           reported as changed"""
+        self.repo.write_task("aaa.json", "a" * 100)
+        self.repo.write_task("bbb.json", "b" * 100)
+        old_head = self.repo.head()
+        self.repo.write_task("aaa.json", "a" * 60)
+        self.repo.write_task("ccc.json", "c" * 100)
+        self.assertEqual(
+            self.repo.changed_task_ids(old_head, self.repo.head()),
+            {"aaa", "ccc"})
+        self.assertEqual(self.repo.changed_task_ids(old_head, old_head),
+                         set())
+
+    def test_thread_pool(self):
+        """Test concurrent writes & reads from a thread pool, alongside a
+           second repository in the same process"""
+        other = gitrepo.TaskRepo(os.path.join(self.test_dir, "other"),
+                                 bare=self.BARE, packed=self.PACKED)
+        cwd = os.getcwd()
+
+        def write_and_read(i):
+            """Writes a task to both repositories & reads it back"""
+            for repo in (self.repo, other):
+                repo.write_task(f"t{i}.json", str(i))
+            return self.repo.read_task(f"t{i}.json"), \
+                other.read_task(f"t{i}.json")
+
+        try:
+            with concurrent.futures.ThreadPoolExecutor(8) as pool:
+                results = list(pool.map(write_and_read, range(16)))
+        finally:
+            other.close()
+
+        self.assertEqual(results, [(str(i), str(i)) for i in range(16)])
+        self.assertEqual(os.getcwd(), cwd)
+
+    def test_fanout_migration(self):
+        """Test that flat-layout tasks stay readable & are migrated"""
+        self.repo.repo.write_files({"tasks/abcd.json": "flat"}, "legacy")
+        self.repo.write_task("ef01.json", "new")
+        self.assertEqual(self.repo.flat_task_files(), ["abcd.json"])
+        self.assertEqual(self.repo.read_task("abcd.json"), "flat")
+
+        self.assertEqual(self.repo.migrate(), 1)
+        self.assertEqual(self.repo.flat_task_files(), [])
+        self.assertEqual(self.repo.read_task("abcd.json"), "flat")
+        self.assertEqual(self.repo.repo.list_tree("tasks"),
+                         [("tree", "ab"), ("tree", "ef")])
+
+    def test_migration_locks(self):
+        """Test that a migration waits for the exclusive repository lock"""
+        self.repo.repo.write_files({"tasks/abcd.json": "flat"}, "legacy")
+        counts = []
+        migration = threading.Thread(
+            target=lambda: counts.append(self.repo.migrate()))
+        with repolock.RepositoryLock(self.test_dir).exclusive():
+            migration.start()
+            migration.join(0.5)
+            self.assertTrue(migration.is_alive())
+            self.assertEqual(self.repo.flat_task_files(), ["abcd.json"])
+        migration.join()
+        self.assertEqual(counts, [1])
+
+    def test_quick_validation(self):
+        """Test that a validated repository is re-opened without running git
+           & that a broken marker falls back to the full check"""
+        self.repo.write_task("abc.json", "{}")
+        with mock.patch("subprocess.run") as run:
+            gitrepo.GitRepository(self.test_dir, bare=self.BARE)
+            self.assertFalse(run.called)
+
+        git_dir = self.repo.repo._git_dir  # pylint: disable=protected-access
+        with open(os.path.join(git_dir, gitrepo.VALIDATED_MARKER), 'w'):
+            pass
+        with mock.patch("subprocess.run", wraps=subprocess.run) as run:
+            gitrepo.GitRepository(self.test_dir, bare=self.BARE)
+            self.assertTrue(run.called)
+
+
+class TestBareTaskRepo(TestTaskRepo):
+    """Test TaskRepo class in bare (working-tree-free) mode"""
+    BARE = True
+
+    def test_no_working_tree(self):
+        """Test that bare mode never materializes task files"""
+        self.repo.write_task("abc.json", "{}")
+        self.assertFalse(os.path.exists(os.path.join(self.test_dir, "tasks")))
+        self.assertTrue(gitrepo.TaskRepo(self.test_dir).repo.bare)
+
+
+class TestPackedTaskRepo(TestTaskRepo):
+    """Test TaskRepo class with the packed task store"""
+    PACKED = True
+
+    def test_fanout_migration(self):
+        """Test that flat-layout tasks stay readable & move into the pack"""
+        self.repo.repo.write_files({"tasks/abcd.json": "flat"}, "legacy")
+        self.assertEqual(self.repo.read_task("abcd.json"), "flat")
+        self.assertEqual(self.repo.migrate(), 1)
+        self.assertEqual(self.repo.repo.list_tree("tasks"), [])
+        self.assertEqual(self.repo.read_task("abcd.json"), "flat")
+
+    def test_compaction_commit(self):
+        """Test that a compacted segment replaces the old one in git"""
+        for content in ["first version", "x"]:
+            self.repo.write_task("abc.json", content)
+        files = subprocess.check_output(
+            ["git", "ls-tree", "--name-only", "HEAD"], cwd=self.test_dir,
+            text=True).split()
+        self.assertEqual(files, ["tasks.1.pack", "tasks.idx"])
+        self.assertEqual(gitrepo.TaskRepo(self.test_dir).read_task(
+            "abc.json"), "x")
+
+    def test_changed_ids_after_compaction(self):
+        """Test that changes across a compaction are reported as unknown"""
+        self.repo.write_task("abc.json", "first version")
+        old_head = self.repo.head()
+        self.repo.write_task("abc.json", "x")  # compacts
+        self.assertIsNone(
+            self.repo.changed_task_ids(old_head, self.repo.head()))
+
+
+    def test_transaction_sees_outside_writes(self):
+        """Test that a transaction reads what another process saved since
+           the repository was last used"""
+        self.repo.write_task("abc.json", "initial")
+        self.assertEqual(self.repo.read_task("abc.json"), "initial")
+        subprocess.run(
+            [sys.executable, "-c", OUTSIDE_WRITE_SCRIPT, self.test_dir,
+             "changed", "changed2"],
+            cwd=os.path.dirname(os.path.realpath(__file__)), check=True)
+        with self.repo.transaction():
+            self.assertEqual(self.repo.read_task("abc.json"), "changed2")
+
+
+class TestPackedTaskStore(unittest.TestCase):
+    """Test PackedTaskStore class"""
+    def setUp(self):
+        """Set up before test cases"""
+        identify(self)
+        self.test_dir = os.path.realpath("./temp/")
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+        os.makedirs(self.test_dir)
+        self.store = packstore.PackedTaskStore(self.test_dir)
+
+    def tearDown(self):
+        """Tear down after test cases"""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_read_write_compact(self):
+        """Test reads through the overlay, the index & after compaction"""
+        ids = [f"{i:032x}" for i in range(50)]
+        for task_id in ids:
+            self.store.write(task_id, task_id.encode())
+        self.assertEqual(bytes(self.store.read(ids[7])), ids[7].encode())
+        self.store.flush()
+
+        store = packstore.PackedTaskStore(self.test_dir)
+        self.assertEqual(len(store), 50)
+        self.assertIsNone(store.read("f" * 32))
+        for task_id in ids:
+            self.assertEqual(bytes(store.read(task_id)), task_id.encode())
+
+        # superseding every record leaves more dead than live data
+        pack_size = os.path.getsize(store.pack_path)
+        for task_id in ids:
+            store.write(task_id, b"x")
+        store.flush()
+        self.assertEqual(os.path.getsize(store.pack_path), 50)
+        self.assertLess(os.path.getsize(store.pack_path), pack_size)
+        self.assertEqual(bytes(store.read(ids[-1])), b"x")
+
+    def test_interrupted_compaction(self):
+        """Test that a compaction interrupted before switching to the new
+           segment leaves the old segment & index consistent"""
+        ids = [f"{i:032x}" for i in range(10)]
+        for task_id in ids:
+            self.store.write(task_id, task_id.encode() * 2)
+        self.store.flush()
+        for task_id in ids[:5]:
+            self.store.write(task_id, b"x")
+        with mock.patch("os.replace", side_effect=OSError("crash")):
+            with self.assertRaises(OSError):
+                self.store.compact()
+
+        store = packstore.PackedTaskStore(self.test_dir)
+        self.assertEqual(store.pack_file, "tasks.pack")
+        for task_id in ids:
+            self.assertEqual(bytes(store.read(task_id)), task_id.encode() * 2)
+
+    def _write_outside(self, *records):
+        """Writes 'records' for task "abc" in another process"""
+        subprocess.run(
+            [sys.executable, "-c", OUTSIDE_WRITE_SCRIPT, self.test_dir,
+             *records], cwd=os.path.dirname(os.path.realpath(__file__)),
+            check=True)
+
+    def test_refresh_after_outside_writes(self):
+        """Test that records saved & compacted by another process are read
+           after a refresh"""
+        self.store.write("abc", b"initial")
+        self.store.flush()
+        self.assertEqual(bytes(self.store.read("abc")), b"initial")
+
+        self._write_outside("changed", "changed1", "changed2")
+        self.store.refresh()
+        self.assertEqual(bytes(self.store.read("abc")), b"changed2")
+
+        pack_file = self.store.pack_file
+        self._write_outside("compact")
+        self.assertFalse(os.path.exists(
+            os.path.join(self.test_dir, pack_file)))
+        self.store.refresh()
+        self.assertEqual(bytes(self.store.read("abc")), b"changed2")
+        self.assertNotEqual(self.store.pack_file, pack_file)
+
+        # without a refresh, a read finding its segment gone reloads the index
+        store = packstore.PackedTaskStore(self.test_dir)
+        self.assertEqual(len(store), 1)  # maps the index only
+        self._write_outside("compacted", "compact")
+        self.assertEqual(bytes(store.read("abc")), b"compacted")
+
+    def test_legacy_index(self):
+        """Test that an index without a segment generation is read"""
+        self.store.write("abc", b"record")
+        self.store.flush()
+        with open(self.store.index_path, "rb") as infile:
+            index = infile.read()
+        with open(self.store.index_path, "wb") as outfile:
+            outfile.write(packstore.LEGACY_INDEX_MAGIC +
+                          index[len(packstore.INDEX_MAGIC) +
+                                packstore.GENERATION.size:])
+
+        store = packstore.PackedTaskStore(self.test_dir)
+        self.assertEqual(bytes(store.read("abc")), b"record")
+        store.compact()
+        self.assertEqual(store.pack_file, "tasks.1.pack")
+        self.assertEqual(store.stale_files(), ["tasks.pack"])
+        self.assertFalse(os.path.exists(
+            os.path.join(self.test_dir, "tasks.pack")))
+        self.assertEqual(bytes(packstore.PackedTaskStore(
+            self.test_dir).read("abc")), b"record")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+"""
+Test cases for graveyard.py
+"""
+
+import datetime
+import unittest
+import shutil
+import os
+import time
+from unittest.mock import patch
+import graveyard
+import taskinfo
+
+
+def identify(testobj):
+    """Identify running test in log"""
+    print(f"\n{'='*72}\n{testobj.id().split('.')[-1]}\n{'='*72}")
+
+
+class TestGraveyard(unittest.TestCase):
+    """Test Graveyard class"""
+    def setUp(self):
+        """Set up before test cases"""
+        identify(self)
+        self.test_dir = os.path.realpath("./temp/")
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+        self.graveyard = graveyard.Graveyard(self.test_dir)
+
+    def tearDown(self):
+        """Tear down after test cases"""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    @staticmethod
+    def _closed(day):
+        """Returns the epoch time of noon (UTC) on datetime.date 'day'"""
+        return datetime.datetime.combine(
+            day, datetime.time(12), datetime.timezone.utc).timestamp()
+
+    def test_segments_and_lookup(self):
+        """Test monthly segments, appends, prefix matches & lookups"""
+        days = [datetime.date(2024, 1, 5), datetime.date(2024, 1, 20),
+                datetime.date(2024, 3, 1)]
+        tasks = []
+        for day in days:
+            task = taskinfo.TaskInfo(str(day), "quick")
+            self.graveyard.bury(task, self._closed(day))
+            self.graveyard.flush()  # appends to an existing segment
+            tasks.append(task)
+
+        self.assertEqual(self.graveyard.segments(), ["2024-01", "2024-03"])
+        self.assertEqual(self.graveyard.matches(tasks[1].id), [tasks[1].id])
+        self.assertEqual(len(self.graveyard.matches("")), 3)
+        closed, task_dict = self.graveyard.find(tasks[1].id)
+        self.assertEqual(closed, self._closed(days[1]))
+        self.assertEqual(task_dict, tasks[1].dict())
+        self.assertIsNone(self.graveyard.find("0" * 32))
+
+        history = graveyard.Graveyard(self.test_dir).history(
+            since=datetime.date(2024, 1, 10), until=datetime.date(2024, 3, 1))
+        self.assertEqual([record[1]["description"] for record in history],
+                         ["2024-01-20", "2024-03-01"])
+
+    def test_history_in_local_time(self):
+        """Test that history dates are local days, even across the month
+           boundary of the (UTC) segments"""
+        timezone = patch.dict(os.environ, {"TZ": "EST+5"})
+        timezone.start()
+        self.addCleanup(time.tzset)
+        self.addCleanup(timezone.stop)
+        time.tzset()
+
+        # 2024-01-31 21:00 local time is 2024-02-01 02:00 UTC
+        closed = datetime.datetime(2024, 1, 31, 21).timestamp()
+        self.graveyard.bury(taskinfo.TaskInfo("late", "quick"), closed)
+        self.graveyard.flush()
+        self.assertEqual(self.graveyard.segments(), ["2024-02"])
+        january = datetime.date(2024, 1, 31)
+        self.assertEqual(len(self.graveyard.history(until=january)), 1)
+        self.assertEqual(len(self.graveyard.history(
+            since=january + datetime.timedelta(1))), 0)
+
+    def test_nothing_opened_until_needed(self):
+        """Test that an empty or unused graveyard touches no files"""
+        self.assertEqual(self.graveyard.matches("a"), [])
+        self.graveyard.flush()
+        self.assertFalse(os.path.exists(self.test_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
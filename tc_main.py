@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+"""
+Test cases for main.py
+"""
+
+import io
+import os
+import shutil
+import sys
+import unittest
+from unittest.mock import patch
+import main
+
+
+def identify(testobj):
+    """Identify running test in log"""
+    print(f"\n{'='*72}\n{testobj.id().split('.')[-1]}\n{'='*72}")
+
+
+COMMAND_ONE = """
+def _level(text):
+    return int(text)
+def _complete_level(prefix, **_):
+    return [level for level in ["1", "2"] if level.startswith(prefix)]
+def process_command(args):
+    print("one", args.count, args.level)
+def create_parser(subparsers):
+    subparser = subparsers.add_parser("one", help="First command")
+    subparser.set_defaults(func=process_command)
+    subparser.add_argument("-c", "--count", type=int, default=1)
+    level = subparser.add_argument("level", type=_level, choices=[1, 2])
+    level.completer = _complete_level
+"""
+
+COMMAND_TWO = """
+def process_command(args):
+    print("two", args.fast)
+def create_parser(subparsers):
+    subparser = subparsers.add_parser("two", help="Second command")
+    subparser.set_defaults(func=process_command)
+    group = subparser.add_mutually_exclusive_group()
+    group.add_argument("--fast", action="store_true")
+"""
+
+
+class TestFindCommands(unittest.TestCase):
+    """Test command discovery & the cached command manifest"""
+    def setUp(self):
+        """Set up before test cases"""
+        identify(self)
+        self.test_dir = os.path.realpath("./temp/")
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+        os.makedirs(os.path.join(self.test_dir, ".tasks"))
+        self._write("cmd_one.py", COMMAND_ONE)
+        self._write("cmd_two.py", COMMAND_TWO)
+        self._write("other.py", "")
+        self._write(os.path.join(".tasks", "cmd_nested.py"), "")
+        sys.path.insert(0, self.test_dir)
+
+    def tearDown(self):
+        """Tear down after test cases"""
+        sys.path.remove(self.test_dir)
+        for module in ["cmd_one", "cmd_two", "cmd_three"]:
+            sys.modules.pop(module, None)
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _write(self, filename, text, mtime_ns=None):
+        """Writes 'filename' in the test directory"""
+        path = os.path.join(self.test_dir, filename)
+        with open(path, "w") as outfile:
+            outfile.write(text)
+        if mtime_ns is not None:
+            os.utime(path, ns=(mtime_ns, mtime_ns))
+
+    def test_top_level_only(self):
+        """Test that only the program directory itself is searched"""
+        self.assertEqual(main.find_commands(self.test_dir),
+                         ["cmd_one", "cmd_two"])
+        self.assertTrue(os.path.exists(
+            os.path.join(self.test_dir, main.MANIFEST_FILE)))
+
+    def test_manifest_reuse_and_refresh(self):
+        """Test that the directory is only listed again after a change"""
+        main.find_commands(self.test_dir)
+        with patch("os.listdir") as listdir:
+            self.assertEqual(main.find_commands(self.test_dir),
+                             ["cmd_one", "cmd_two"])
+            self.assertFalse(listdir.called)
+
+        self._write("cmd_two.py", COMMAND_TWO, mtime_ns=10**9)
+        with patch("main._describe_command", return_value=None) as describe:
+            main.find_commands(self.test_dir)
+            describe.assert_called_once_with("cmd_two")
+
+        os.remove(os.path.join(self.test_dir, "cmd_two.py"))
+        self._write("cmd_three.py", COMMAND_TWO.replace('"two"', '"three"'))
+        self.assertEqual(main.find_commands(self.test_dir),
+                         ["cmd_one", "cmd_three"])
+
+    def test_damaged_manifest(self):
+        """Test that an unreadable manifest is rebuilt"""
+        self._write(main.MANIFEST_FILE, "[not a manifest")
+        self.assertEqual(main.find_commands(self.test_dir),
+                         ["cmd_one", "cmd_two"])
+
+    def test_lazy_import(self):
+        """Test that only the module of the selected command is imported"""
+        main.load_manifest(self.test_dir)
+        for module in ["cmd_one", "cmd_two"]:
+            sys.modules.pop(module)
+        manifest = main.load_manifest(self.test_dir)
+        self.assertEqual(manifest["cmd_two"],
+                         {"name": "two", "help": "Second command"})
+
+        parser = main.create_command_line_parser(manifest, ["--help"])
+        self.assertIn("Second command", parser.format_help())
+        self.assertNotIn("cmd_one", sys.modules)
+        self.assertNotIn("cmd_two", sys.modules)
+
+        parser = main.create_command_line_parser(manifest, ["-v", "one"])
+        self.assertNotIn("cmd_two", sys.modules)
+        # pylint: disable=protected-access
+        subparser = parser._subparsers._group_actions[0].choices["one"]
+        level = [action for action in subparser._actions
+                 if action.dest == "level"][0]
+        self.assertEqual(level.completer(prefix="2", action=level), ["2"])
+
+        args = parser.parse_args(["one", "-c", "3", "2"])
+        self.assertEqual((args.count, args.level), (3, 2))
+        with self.assertRaises(SystemExit):
+            parser.parse_args(["one", "3"])  # not a choice
+
+        with patch("sys.stdout", new_callable=io.StringIO) as stdout:
+            args.func(args)
+            self.assertEqual(stdout.getvalue(), "one 3 2\n")
+            # without command-line arguments, every command is built
+            parser = main.create_command_line_parser(manifest)
+            args = parser.parse_args(["two", "--fast"])
+            args.func(args)
+            self.assertEqual(stdout.getvalue(), "one 3 2\ntwo True\n")
+
+    def test_completion_selects_command(self):
+        """Test that the line being completed selects the command"""
+        manifest = main.load_manifest(self.test_dir)
+        sys.modules.pop("cmd_one")
+        environment = {"_ARGCOMPLETE": "1", "COMP_LINE": "task two --f",
+                       "COMP_POINT": "9"}
+        with patch.dict(os.environ, environment), \
+                patch.dict(sys.modules, {"argcomplete": None}):
+            main.create_command_line_parser(manifest, [])
+        self.assertNotIn("cmd_one", sys.modules)
+        self.assertIn("cmd_two", sys.modules)
+
+
+if __name__ == '__main__':
+    unittest.main()
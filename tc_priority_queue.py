@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+"""
+Test cases for priority_queue.py
+"""
+
+import random
+import threading
+import unittest
+from queue import Empty
+import priority_queue
+
+
+def identify(testobj):
+    """Identify running test in log"""
+    print(f"\n{'='*72}\n{testobj.id().split('.')[-1]}\n{'='*72}")
+
+
+class Item(object):  # pylint: disable=too-few-public-methods
+    """Hashable queue item (identity semantics, like tasks)"""
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+
+class TestPriorityQueue(unittest.TestCase):
+    """Test PriorityQueue class"""
+    def setUp(self):
+        """Set up before test cases"""
+        identify(self)
+        self.queue = priority_queue.PriorityQueue()
+
+    def test_fifo_within_priority(self):
+        """Test that equal priorities are served in insertion order"""
+        items = [Item(str(i)) for i in range(6)]
+        for i, item in enumerate(items):
+            self.queue.put(item, i % 2)
+        expected = items[0::2] + items[1::2]
+        self.assertEqual(list(self.queue), expected)
+        self.assertEqual(self.queue.peek(), items[0])
+        self.assertEqual([self.queue.get() for _ in items], expected)
+        with self.assertRaises(Empty):
+            self.queue.get()
+
+    def test_remove_and_change_priority(self):
+        """Test removal & reprioritization against a sorted reference"""
+        rand = random.Random(4)
+        reference = {}
+        for i in range(200):
+            item = Item(str(i))
+            reference[item] = (rand.randint(0, 9), i)
+            self.queue.put(item, reference[item][0])
+
+        sequence = 200
+        for item in rand.sample(list(reference), 50):
+            self.assertIs(self.queue.remove(item), item)
+            del reference[item]
+        for item in rand.sample(list(reference), 50):
+            sequence += 1
+            reference[item] = (rand.randint(0, 9), sequence)
+            self.queue.change_priority(item, reference[item][0])
+            self.assertEqual(self.queue.priority(item), reference[item][0])
+
+        self.assertEqual(len(self.queue), 150)
+        expected = sorted(reference, key=reference.get)
+        self.assertEqual(list(self.queue), expected)
+        self.assertEqual([self.queue.get() for _ in expected], expected)
+
+    def test_duplicate_and_missing(self):
+        """Test that an item can only be queued once"""
+        item = Item("a")
+        with self.assertRaises(KeyError):
+            self.queue.remove(item)  # from an empty queue
+        self.queue.put(item, 1)
+        self.assertIn(item, self.queue)
+        with self.assertRaises(ValueError):
+            self.queue.put(item, 2)
+        with self.assertRaises(KeyError):
+            self.queue.remove(Item("b"))
+
+    def test_blocking_get(self):
+        """Test get() timeouts & wake-up by a concurrent put()"""
+        with self.assertRaises(Empty):
+            self.queue.get(block=True, timeout=0.05)
+
+        item = Item("late")
+        timer = threading.Timer(0.05, self.queue.put, (item, 1))
+        timer.start()
+        self.assertIs(self.queue.get(block=True, timeout=5), item)
+        timer.join()
+
+    def test_snapshot_iteration(self):
+        """Test that iteration is unaffected by concurrent writes"""
+        items = [Item(str(i)) for i in range(10)]
+        for item in items:
+            self.queue.put(item, 1)
+
+        seen = []
+        for item in self.queue:
+            seen.append(item)
+            if self.queue:
+                self.queue.get()
+        self.assertEqual(seen, items)
+        self.assertTrue(self.queue.empty())
+
+
+if __name__ == '__main__':
+    unittest.main()
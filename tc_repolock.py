@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+"""
+Test cases for repolock.py
+"""
+
+import json
+import os
+import subprocess
+import sys
+import unittest
+import fixtures
+import repolock
+
+# commits need an identity, even on hosts without a git configuration
+os.environ.setdefault("GIT_AUTHOR_NAME", "task")
+os.environ.setdefault("GIT_AUTHOR_EMAIL", "task@localhost")
+os.environ.setdefault("GIT_COMMITTER_NAME", "task")
+os.environ.setdefault("GIT_COMMITTER_EMAIL", "task@localhost")
+
+WORKERS = 32
+SESSIONS = 2  # per worker
+
+# each session adds a task & every other one also moves the top of the
+# stack (possibly another worker's task) to the backlog
+WORKER_SCRIPT = """
+import sys
+import taskinfo
+for session in range({sessions}):
+    with taskinfo.TaskMaster() as taskmaster:
+        task = taskinfo.TaskInfo(sys.argv[1], "quick")
+        task.serialize()
+        taskmaster.add(task)
+        if session % 2:
+            taskmaster.move()
+    print(task.id)
+"""
+
+# each worker claims & closes backlog tasks until the backlog is empty
+CLAIM_SCRIPT = """
+import queue
+import sys
+import taskinfo
+while True:
+    with taskinfo.TaskMaster(worker=sys.argv[1]) as taskmaster:
+        try:
+            task = taskmaster.claim()
+        except queue.Empty:
+            break
+        taskmaster.close()
+    print(task.id)
+"""
+CLAIM_TASKS = 64
+
+SETUP_SCRIPT = """
+import taskinfo
+with taskinfo.TaskMaster() as taskmaster:
+    for i in range({count}):
+        task = taskinfo.TaskInfo(f"task {{i}}", "quick")
+        task.serialize()
+        taskmaster.backlog.put(task)
+        print(task.id)
+"""
+
+
+def identify(testobj):
+    """Identify running test in log"""
+    print(f"\n{'='*72}\n{testobj.id().split('.')[-1]}\n{'='*72}")
+
+
+class TestMerge(unittest.TestCase):
+    """Test the three-way structure merge"""
+    def setUp(self):
+        """Set up before test cases"""
+        identify(self)
+
+    def test_merge_lists(self):
+        """Test that both sides' additions & removals survive"""
+        base = ["a", "b", "c"]
+        ours = ["a", "c", "d"]  # removed b, added d
+        theirs = ["b", "c", "e"]  # removed a, added e
+        self.assertEqual(repolock.merge(base, ours, theirs), ["c", "e", "d"])
+
+    def test_merge_pairs_and_maps(self):
+        """Test [id, value] entries & id -> [ids] adjacency maps"""
+        self.assertEqual(
+            repolock.merge([["a", 1]], [["a", 2]], [["a", 1], ["b", 3]]),
+            [["b", 3], ["a", 2]])
+        self.assertEqual(
+            repolock.merge({"x": ["a"]}, {"x": ["a", "b"]}, {}),
+            {"x": ["b"]})
+
+
+class TestConcurrentCommands(fixtures.SandboxTestCase):
+    """Stress test: many processes updating one repository"""
+    def setUp(self):
+        """Set up before test cases"""
+        identify(self)
+        super().setUp()
+
+    def _run_workers(self, count, sessions, script=None):
+        """Runs 'count' worker processes in parallel; returns the ids of
+           all the tasks they printed"""
+        if script is None:
+            script = WORKER_SCRIPT.format(sessions=sessions)
+        workers = [subprocess.Popen(
+            [sys.executable, "-c", script, f"worker {i}"],
+            cwd=self.test_dir, stdout=subprocess.PIPE, text=True)
+                   for i in range(count)]
+        task_ids = []
+        for worker in workers:
+            output, _ = worker.communicate()
+            self.assertEqual(worker.returncode, 0)
+            task_ids.extend(output.split())
+        return task_ids
+
+    def test_no_lost_updates(self):
+        """Test that every task added by 32 parallel writers is kept exactly
+           once across the stack & the backlog"""
+        task_ids = self._run_workers(1, 1)  # create the repository
+        task_ids.extend(self._run_workers(WORKERS, SESSIONS))
+        self.assertEqual(len(task_ids), WORKERS * SESSIONS + 1)
+
+        repository = os.path.join(self.test_dir, ".tasks")
+        with open(os.path.join(repository, "stack.json")) as infile:
+            stored = json.loads(infile.read())
+        with open(os.path.join(repository, "queue.json")) as infile:
+            stored.extend(task_id for task_id, _ in json.loads(infile.read()))
+        self.assertEqual(sorted(stored), sorted(task_ids))
+
+    def test_claims_exactly_once(self):
+        """Test that parallel workers sharing a backlog claim every task
+           exactly once"""
+        script = SETUP_SCRIPT.format(count=CLAIM_TASKS)
+        task_ids = self._run_workers(1, 1, script)
+        self.assertEqual(len(task_ids), CLAIM_TASKS)
+
+        claimed = self._run_workers(WORKERS // 4, 0, CLAIM_SCRIPT)
+        self.assertEqual(sorted(claimed), sorted(task_ids))
+
+        repository = os.path.join(self.test_dir, ".tasks")
+        with open(os.path.join(repository, "queue.json")) as infile:
+            self.assertEqual(json.loads(infile.read()), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+"""
+Test cases for statecache.py
+"""
+
+import json
+import unittest
+import shutil
+import os
+from unittest.mock import Mock, patch
+import statecache
+import taskinfo
+
+
+def identify(testobj):
+    """Identify running test in log"""
+    print(f"\n{'='*72}\n{testobj.id().split('.')[-1]}\n{'='*72}")
+
+
+class TestStateCache(unittest.TestCase):
+    """Test StateCache class"""
+    def setUp(self):
+        """Set up before test cases"""
+        identify(self)
+        self.test_dir = os.path.realpath("./temp/")
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+        os.makedirs(self.test_dir)
+        self.cache_file = os.path.join(self.test_dir, "state.cache")
+        self.stack_file = os.path.join(self.test_dir, "stack.json")
+        with open(self.stack_file, "w") as outfile:
+            outfile.write('["a", "b"]')
+
+    def tearDown(self):
+        """Tear down after test cases"""
+        taskinfo.TASK_CACHE.clear()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _warm(self, head="h1"):
+        """Writes a snapshot holding the stack & two tasks at 'head'"""
+        state = statecache.StateCache(self.cache_file)
+        state.load(head, lambda old_head: None)
+        self.assertEqual(state.structure(self.stack_file, json.loads),
+                         ["a", "b"])
+        state.update(head, {"a": {"id": "a"}, "b": {"id": "b"}})
+        state.save()
+
+    def test_warm_start_skips_parsing(self):
+        """Test that unchanged structures & tasks come from the snapshot"""
+        self._warm()
+        state = statecache.StateCache(self.cache_file)
+        state.load("h1", self.fail)
+        parse = Mock()
+        self.assertEqual(state.structure(self.stack_file, parse), ["a", "b"])
+        self.assertFalse(parse.called)
+        self.assertEqual(set(state.tasks), {"a", "b"})
+
+    def test_incremental_refresh(self):
+        """Test that only tasks changed since the cached HEAD are dropped"""
+        self._warm()
+        state = statecache.StateCache(self.cache_file)
+        state.load("h2", lambda old_head: {"b"} if old_head == "h1" else None)
+        self.assertEqual(set(state.tasks), {"a"})
+
+        # unknown history drops every task
+        state = statecache.StateCache(self.cache_file)
+        state.load("h3", lambda old_head: None)
+        self.assertEqual(state.tasks, {})
+
+    def test_corrupt_snapshot(self):
+        """Test that an unreadable snapshot is discarded"""
+        with open(self.cache_file, "wb") as outfile:
+            outfile.write(b"garbage")
+        state = statecache.StateCache(self.cache_file)
+        state.load("h1", lambda old_head: None)
+        self.assertEqual(state.tasks, {})
+
+    def test_from_id_uses_seed(self):
+        """Test that seeded task data is used instead of the repository"""
+        task = taskinfo.TaskInfo("seeded", "quick")
+        taskinfo.TASK_CACHE.seed({task.id: task.dict()})
+        with patch("gitrepo.read_task") as read_task:
+            loaded = taskinfo.TaskInfo.from_id(task.id)
+            self.assertFalse(read_task.called)
+        self.assertEqual(loaded.dict(), task.dict())
+
+
+if __name__ == '__main__':
+    unittest.main()
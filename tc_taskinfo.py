@@ -4,11 +4,282 @@
 Test cases for taskinfo.py
 """
 
+import datetime
+import json
 import unittest
 import shutil
 import os
+import queue
+from unittest.mock import patch
+import fixtures
 import taskinfo
-# from mock import patch
+
+# commits need an identity, even on hosts without a git configuration
+os.environ.setdefault("GIT_AUTHOR_NAME", "task")
+os.environ.setdefault("GIT_AUTHOR_EMAIL", "task@localhost")
+os.environ.setdefault("GIT_COMMITTER_NAME", "task")
+os.environ.setdefault("GIT_COMMITTER_EMAIL", "task@localhost")
+
+# moves tasks between all structures, checking after each step that the
+# incrementally maintained index matches one built from scratch
+INDEX_SCRIPT = """
+import datetime
+import taskinfo
+
+def check(taskmaster):
+    entries = {task_id: (task.id, location) for task_id, (task, location)
+               in taskmaster.index._entries.items()}
+    taskmaster._changed()
+    rebuilt = {task_id: (task.id, location) for task_id, (task, location)
+               in taskmaster.index._entries.items()}
+    assert entries == rebuilt, (entries, rebuilt)
+    assert taskmaster.index._ids == sorted(rebuilt)
+
+with taskinfo.TaskMaster() as taskmaster:
+    tasks = []
+    for summary in ["first", "second", "third", "fourth"]:
+        task = taskinfo.TaskInfo(summary, "quick")
+        task.serialize()
+        taskmaster.add(task)
+        tasks.append(task)
+        check(taskmaster)
+    for step in [taskmaster.move,
+                 lambda: taskmaster.sleep(datetime.timedelta(0)),
+                 lambda: taskmaster.block(tasks[0].id),
+                 lambda: taskmaster.activate(tasks[3].id),
+                 taskmaster.close, taskmaster.close, taskmaster.wake_due]:
+        step()
+        check(taskmaster)
+    print(*[taskmaster.locate(task.id) for task in tasks])
+"""
+
+# moves tasks between all structures after a savepoint, then checks that
+# rolling back restores every structure, without reading them as a whole
+ROLLBACK_SCRIPT = """
+import datetime
+import taskinfo
+
+def state(taskmaster):
+    return [struct.data() for _, struct in taskmaster._structures()] + \\
+        [sorted((task_id, location) for task_id, (_, location)
+                in taskmaster.index._entries.items())]
+
+with taskinfo.TaskMaster() as taskmaster:
+    tasks = []
+    for summary in ["first", "second", "third", "fourth", "fifth"]:
+        task = taskinfo.TaskInfo(summary, "quick")
+        task.serialize()
+        taskmaster.add(task)
+        tasks.append(task)
+    taskmaster.move()
+    taskmaster.move()
+    taskmaster.sleep(datetime.timedelta(0))
+    taskmaster.block(tasks[0].id)
+    before = state(taskmaster)
+
+    def unexpected(*_):
+        raise AssertionError("structure read as a whole")
+    data = {}
+    for cls in [taskinfo.TasksInProgress, taskinfo.TaskBacklog,
+                taskinfo.TaskLimbo, taskinfo.TaskDorm]:
+        data[cls], cls.data = cls.data, unexpected
+    savepoint = taskmaster.savepoint()
+    taskmaster.activate(tasks[3].id)
+    taskmaster.close()
+    taskmaster.close()
+    taskmaster.wake_due()
+    taskmaster.move()
+    taskmaster.current_task
+    taskmaster.rollback(savepoint)
+    for cls, method in data.items():
+        cls.data = method
+    assert state(taskmaster) == before, (state(taskmaster), before)
+    assert [struct.dirty for _, struct in taskmaster._structures()] == \\
+        [True] * 4
+    print(*[task.description for task in taskmaster.backlog])
+"""
+
+# opens a session in another thread while this thread's session is open
+THREAD_SESSION_SCRIPT = """
+import threading
+import taskinfo
+with taskinfo.TaskMaster() as taskmaster:
+    sessions = []
+    thread = threading.Thread(
+        target=lambda: sessions.append(taskinfo.TaskMaster()))
+    thread.start()
+    thread.join()
+    print(taskinfo.TaskMaster() is taskmaster, sessions[0] is taskmaster)
+"""
+
+# while this thread's session is open, another thread's session adds a task
+# & saves; this session then fails, which must not discard the other's task
+THREAD_FAILURE_SCRIPT = """
+import os
+import threading
+import taskinfo
+
+def add(summary):
+    with taskinfo.TaskMaster() as taskmaster:
+        task = taskinfo.TaskInfo(summary, "quick")
+        task.serialize()
+        taskmaster.add(task)
+
+try:
+    with taskinfo.TaskMaster():
+        add("failed")
+        thread = threading.Thread(target=add, args=("saved",))
+        thread.start()
+        thread.join()
+        raise RuntimeError("failure")
+except RuntimeError:
+    pass
+os.remove(taskinfo.DEFAULT_STATE_CACHE)
+with taskinfo.TaskMaster() as taskmaster:
+    print(*[task.description for task in taskmaster.stack])
+"""
+
+# changes a task in memory only, while saving another one; run twice, the
+# second run prints the summaries it finds
+UNSAVED_CHANGE_SCRIPT = """
+import taskinfo
+with taskinfo.TaskMaster() as taskmaster:
+    if taskmaster.stack.empty():
+        for summary in ["first", "second"]:
+            task = taskinfo.TaskInfo(summary, "quick")
+            task.serialize()
+            taskmaster.add(task)
+    else:
+        print(*[task.description for task in taskmaster.stack])
+        first, second = list(taskmaster.stack)
+        first.description = "changed in memory"
+        second.description = "saved"
+        second.serialize()
+"""
+
+# tries to block the active task on a closed one
+BLOCK_CLOSED_SCRIPT = """
+import taskinfo
+with taskinfo.TaskMaster() as taskmaster:
+    for summary in ["first", "second"]:
+        task = taskinfo.TaskInfo(summary, "quick")
+        task.serialize()
+        taskmaster.add(task)
+    taskmaster.close()
+with taskinfo.TaskMaster() as taskmaster:
+    try:
+        taskmaster.block(task.id)
+    except LookupError as error:
+        print(error)
+    print(taskmaster.current_task.description, len(taskmaster.blocked))
+"""
+
+# worker a stalls with the task open while its lease expires & b claims the
+# task, then c claims it once b's lease expired too
+LOST_LEASE_SCRIPT = """
+import subprocess
+import sys
+import taskinfo
+
+def claim(worker, duration):
+    subprocess.run([sys.executable, "-c", "import taskinfo\\n"
+                    f"with taskinfo.TaskMaster(worker='{worker}') as tm:\\n"
+                    f"    tm.claim({duration})"], check=True)
+
+with taskinfo.TaskMaster() as taskmaster:
+    task = taskinfo.TaskInfo("first", "quick")
+    task.serialize()
+    taskmaster.backlog.put(task)
+claim("a", 0)
+try:
+    with taskinfo.TaskMaster(worker="a") as taskmaster:
+        claim("b", 0)
+        taskmaster.close()
+except LookupError as error:
+    print(error)
+claim("c", 60)
+for worker in "abc":
+    with taskinfo.TaskMaster(worker=worker) as taskmaster:
+        task = taskmaster.current_task
+        print(worker, task and task.description, len(taskmaster.history()))
+"""
+
+# a session adds a task, claims another & then fails: the claim must not be
+# saved pointing at the added task without publishing it
+CLAIM_FAILURE_SCRIPT = """
+import os
+import taskinfo
+
+def new_task(summary):
+    task = taskinfo.TaskInfo(summary, "quick")
+    task.serialize()
+    return task
+
+with taskinfo.TaskMaster() as taskmaster:
+    taskmaster.backlog.put(new_task("claimed"))
+try:
+    with taskinfo.TaskMaster(worker="w") as taskmaster:
+        taskmaster.add(new_task("added"))
+        taskmaster.claim()
+        raise RuntimeError("failure")
+except RuntimeError:
+    pass
+os.remove(taskinfo.DEFAULT_STATE_CACHE)
+with taskinfo.TaskMaster(worker="w") as taskmaster:
+    print(*[task.description for task in taskmaster.stack])
+"""
+
+# blocks a task per session: the second save only logs its change to limbo,
+# which reads back with & without the state cache
+LIMBO_LOG_SCRIPT = """
+import json
+import os
+import taskinfo
+
+def blocked():
+    with taskinfo.TaskMaster() as taskmaster:
+        return [task.description for task in taskmaster.blocked]
+
+with taskinfo.TaskMaster() as taskmaster:
+    tasks = []
+    for summary in ["first", "second", "third", "fourth"]:
+        task = taskinfo.TaskInfo(summary, "quick")
+        task.serialize()
+        taskmaster.add(task)
+        tasks.append(task)
+    taskmaster.block(tasks[0].id)
+with open(taskinfo.DEFAULT_LIMBO) as infile:
+    snapshot = infile.read()
+with taskinfo.TaskMaster() as taskmaster:
+    taskmaster.block(tasks[0].id)
+with open(taskinfo.DEFAULT_LIMBO) as infile:
+    assert infile.read() == snapshot
+with open(taskinfo.DEFAULT_LIMBO_LOG) as infile:
+    lines = infile.readlines()
+assert len(lines) == 1
+assert {task_id for task_id, _ in json.loads(lines[0])} == {tasks[2].id}
+print(*blocked())
+os.remove(taskinfo.DEFAULT_STATE_CACHE)
+print(*blocked())
+"""
+
+# shows the current task, failing if that builds the index of all tasks
+SHOW_SCRIPT = """
+import argparse
+import cmd_show
+import taskinfo
+
+with taskinfo.TaskMaster() as taskmaster:
+    for summary in ["first", "second"]:
+        task = taskinfo.TaskInfo(summary, "quick")
+        task.serialize()
+        taskmaster.add(task)
+
+def unexpected(*_):
+    raise AssertionError("index built")
+taskinfo.TaskIndex.build = unexpected
+cmd_show.process_command(argparse.Namespace(show_all=False, id=None))
+"""
 
 
 def identify(testobj):
@@ -56,6 +327,212 @@ class TestTaskInfo(unittest.TestCase):
         print(f"task type = {self.task.type}")
         self.assertEqual(self.task.description, 'Do the second thing')
 
+    def test_taskinfo_view(self):
+        """Test that the read-only view matches dict() without copying"""
+        self.task = taskinfo.TaskInfo('Do the third thing', 'build',
+                                      priority=1, owner='me')
+        self.assertFalse(hasattr(self.task, "__dict__"))
+        view = self.task.view()
+        self.assertEqual(dict(view), self.task.dict())
+        self.assertIs(self.task.view(), view)
+        self.task.description = 'Changed'
+        self.assertEqual(view["description"], 'Changed')
+        with self.assertRaises(TypeError):
+            view["description"] = 'Read-only'  # pylint: disable=E1137
+
+
+class TestTaskCache(unittest.TestCase):
+    """Test the TaskInfo.from_id identity map"""
+    def setUp(self):
+        """Set up before test cases"""
+        identify(self)
+        taskinfo.TASK_CACHE.clear()
+        self.task = taskinfo.TaskInfo("cached", "quick")
+        self.task_json = taskinfo.TaskInfo.pretty(self.task.dict())
+
+    def tearDown(self):
+        """Tear down after test cases"""
+        taskinfo.TASK_CACHE.clear()
+        taskinfo.TASK_CACHE.maxsize = None
+
+    def test_one_instance_per_id(self):
+        """Test that from_id returns the same instance for the same id"""
+        with patch("gitrepo.read_task") as read_task:
+            read_task.return_value = self.task_json
+            first = taskinfo.TaskInfo.from_id(self.task.id)
+            second = taskinfo.TaskInfo.from_id(self.task.id)
+            self.assertIs(first, second)
+            read_task.assert_called_once_with(self.task.filename)
+
+        stats = taskinfo.TASK_CACHE.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+
+    def test_serialize_replaces_entry(self):
+        """Test that serialize() makes the written instance canonical"""
+        with patch("gitrepo.write_task"):
+            self.task.serialize()
+        self.assertIs(taskinfo.TaskInfo.from_id(self.task.id), self.task)
+
+    def test_lru_bound(self):
+        """Test that a bounded cache forgets the least recently used task"""
+        taskinfo.TASK_CACHE.maxsize = 2
+        tasks = [taskinfo.TaskInfo(f"t{i}", "quick") for i in range(3)]
+        for task in tasks:
+            taskinfo.TASK_CACHE.add(task)
+        self.assertEqual(len(taskinfo.TASK_CACHE), 2)
+        self.assertIsNone(taskinfo.TASK_CACHE.get(tasks[0].id))
+        self.assertIs(taskinfo.TASK_CACHE.get(tasks[2].id), tasks[2])
+
+
+class TestTaskIndex(unittest.TestCase):
+    """Test TaskIndex class"""
+    def setUp(self):
+        """Set up before test cases"""
+        identify(self)
+        self.index = taskinfo.TaskIndex()
+        for task_id in ["abc123", "abd456", "b00000", "abc1234"]:
+            self.index.add(taskinfo.TaskProxy(task_id), "backlog")
+
+    def test_lookup(self):
+        """Test unique, missing, exact & ambiguous prefix lookups"""
+        task, location = self.index.lookup("abd")
+        self.assertEqual((task.id, location), ("abd456", "backlog"))
+        self.assertEqual(self.index.lookup("abc123")[0].id, "abc123")
+        with self.assertRaises(LookupError):
+            self.index.lookup("c")
+        with self.assertRaises(taskinfo.AmbiguousTaskId) as context:
+            self.index.lookup("ab")
+        self.assertEqual(context.exception.candidates,
+                         ["abc123", "abc1234", "abd456"])
+
+    def test_build(self):
+        """Test that a built index matches one filled task by task"""
+        built = taskinfo.TaskIndex.build(
+            [(taskinfo.TaskProxy("b00000"), "stack"),
+             (taskinfo.TaskProxy("abc123"), "stack"),
+             (taskinfo.TaskProxy("abc123"), "graveyard")])
+        self.assertEqual(len(built), 2)
+        self.assertEqual(built.matches("a"), ["abc123"])
+        self.assertEqual(built.lookup("abc")[1], "graveyard")
+
+    def test_shortest_prefix(self):
+        """Test the shortest unique prefix used for display"""
+        self.assertEqual(self.index.shortest_prefix("abd456", minimum=1),
+                         "abd")
+        self.assertEqual(self.index.shortest_prefix("b00000", minimum=1),
+                         "b")
+        self.assertEqual(self.index.shortest_prefix("b00000"), "b00000")
+        self.index.discard("abc1234")
+        self.assertEqual(self.index.shortest_prefix("abc123", minimum=1),
+                         "abc")
+
+
+class TestTaskDorm(unittest.TestCase):
+    """Test TaskDorm class"""
+    WHEEL = False
+
+    def setUp(self):
+        """Set up before test cases"""
+        identify(self)
+        self.woken = []
+        self.dorm = taskinfo.TaskDorm(callback=self.woken.append,
+                                      wheel=self.WHEEL)
+
+    def test_reveille_and_wake(self):
+        """Test that due items wake & that an item can be woken early"""
+        now = datetime.datetime.now()
+        due, later = taskinfo.TaskProxy("due"), taskinfo.TaskProxy("later")
+        self.dorm.wake_at(later, now + datetime.timedelta(hours=1))
+        self.dorm.wake_at(due, now - datetime.timedelta(seconds=1))
+        self.dorm.reveille()
+        self.assertEqual(self.woken, [due])
+
+        self.assertIs(self.dorm.wake("lat"), later)
+        self.assertEqual(self.woken, [due, later])
+        self.assertEqual(list(self.dorm), [])
+
+    def test_reveille_batch_order(self):
+        """Test that a mass wakeup leaves the most urgent item on top"""
+        now = datetime.datetime.now()
+        items = [taskinfo.TaskProxy(str(i)) for i in range(3)]
+        for minutes, item in enumerate(items):
+            self.dorm.wake_at(item, now + datetime.timedelta(minutes=minutes))
+
+        self.dorm.reveille(now - datetime.timedelta(minutes=1))
+        self.assertEqual(self.woken, [])
+        self.dorm.reveille(now + datetime.timedelta(minutes=5))
+        self.assertEqual(self.woken, list(reversed(items)))
+
+
+class TestTaskDormWheel(TestTaskDorm):
+    """Test TaskDorm class backed by a timing wheel"""
+    WHEEL = True
+
+
+class TestTaskLimbo(unittest.TestCase):
+    """Test TaskLimbo class"""
+    def setUp(self):
+        """Set up before test cases"""
+        identify(self)
+        self.released = []
+        self.limbo = taskinfo.TaskLimbo(callback=self.released.append)
+        self.tasks = {name: taskinfo.TaskProxy(name) for name in "abcd"}
+
+    def test_chain_and_cycle(self):
+        """Test transitive chains, cycle detection & cascading unblock"""
+        tasks = self.tasks
+        self.limbo.block(tasks["b"], tasks["a"])
+        self.limbo.block(tasks["c"], tasks["b"])
+        self.limbo.block(tasks["d"], tasks["b"])
+        self.limbo.block(tasks["d"], tasks["a"])
+        with self.assertRaises(ValueError):
+            self.limbo.block(tasks["a"], tasks["c"])  # a -> b -> c -> a
+        with self.assertRaises(ValueError):
+            self.limbo.block(tasks["c"], tasks["b"])  # duplicate edge
+
+        self.limbo.unblock(tasks["a"])
+        self.assertEqual(self.released, [tasks["b"]])
+        self.assertEqual(self.limbo.blockers("d"), {"b"})
+        self.limbo.unblock(tasks["b"])
+        self.assertEqual(self.released, [tasks["b"], tasks["c"], tasks["d"]])
+        self.assertEqual(len(self.limbo), 0)
+
+    def test_round_trip(self):
+        """Test that limbo survives serialization"""
+        self.limbo.block(self.tasks["b"], self.tasks["a"])
+        self.limbo.block(self.tasks["c"], self.tasks["b"])
+        self.assertTrue(self.limbo.dirty)
+
+        limbo = taskinfo.TaskLimbo.from_data(
+            json.loads(taskinfo.TaskLimbo.pretty(self.limbo.data())))
+        limbo.set_callback(self.released.append)
+        self.assertEqual([task.id for task in limbo], ["b", "c"])
+        self.assertFalse(limbo.dirty)
+        with self.assertRaises(ValueError):
+            limbo.block(self.tasks["a"], self.tasks["c"])
+        limbo.unblock(self.tasks["a"])
+        self.assertEqual([task.id for task in self.released], ["b"])
+
+    def test_changes(self):
+        """Test that changes() lists only the changed tasks & turns the
+           saved limbo into the current one, keeping the blocking order"""
+        tasks = self.tasks
+        self.limbo.block(tasks["b"], tasks["a"])
+        self.limbo.block(tasks["c"], tasks["a"])
+        self.limbo.block(tasks["d"], tasks["c"])
+        saved = self.limbo.data()
+        self.limbo.saved()
+        self.assertEqual(self.limbo.changes(), [])
+
+        self.limbo.block(tasks["c"], tasks["b"])
+        self.limbo.unblock(tasks["a"])  # releases b
+        self.limbo.block(tasks["b"], tasks["a"])  # blocked last now
+        changes = self.limbo.changes()
+        self.assertEqual({task_id for task_id, _ in changes}, {"b", "c"})
+        taskinfo.TaskLimbo.apply_changes(saved, changes)
+        self.assertEqual(list(saved.items()),
+                         list(self.limbo.data().items()))
+
 
 class TestTasksInProgress(unittest.TestCase):
     """Test TasksInProgress class"""
@@ -92,6 +569,178 @@ class TestTasksInProgress(unittest.TestCase):
         self.tasks_in_progress.dump()
 
 
+class TestTaskBacklog(unittest.TestCase):
+    """Test TaskBacklog class"""
+    def setUp(self):
+        """Set up before test cases"""
+        identify(self)
+        self.test_dir = os.path.realpath("./temp/")
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+        os.makedirs(self.test_dir)
+        self.queue_file = os.path.join(self.test_dir, "queue.json")
+
+    def tearDown(self):
+        """Tear down after test cases"""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_backlog_load_is_lazy(self):
+        """Test that loading the backlog does not read any task"""
+        backlog = taskinfo.TaskBacklog()
+        low = taskinfo.TaskInfo("low", "quick", priority=4)
+        high = taskinfo.TaskInfo("high", "quick", priority=1)
+        backlog.put(low)
+        backlog.put(high)
+        backlog.serialize(self.queue_file)
+
+        with patch("gitrepo.read_task") as read_task:
+            backlog = taskinfo.TaskBacklog.load(self.queue_file)
+            self.assertEqual([task.id for task in backlog],
+                             [high.id, low.id])
+            self.assertFalse(read_task.called)
+
+            read_task.return_value = taskinfo.TaskInfo.pretty(high.dict())
+            task = backlog.get()
+            self.assertEqual(task.description, "high")
+            read_task.assert_called_once_with(high.filename)
+
+    def test_backlog_load_legacy_format(self):
+        """Test loading a backlog that only lists task ids"""
+        task = taskinfo.TaskInfo("legacy", "quick", priority=2)
+        with open(self.queue_file, "w") as outfile:
+            outfile.write(taskinfo.TaskInfo.pretty([task.id]))
+
+        with patch("gitrepo.read_task") as read_task:
+            read_task.return_value = taskinfo.TaskInfo.pretty(task.dict())
+            backlog = taskinfo.TaskBacklog.load(self.queue_file)
+            self.assertEqual(backlog.queue.items()[0][1], 2)
+
+    def test_backlog_dirty_tracking(self):
+        """Test that only changes mark the backlog for saving"""
+        task = taskinfo.TaskInfo("task", "quick")
+        backlog = taskinfo.TaskBacklog.from_data([[task.id, 2]])
+        self.assertFalse(backlog.dirty)
+        backlog.peek()
+        list(backlog)
+        self.assertFalse(backlog.dirty)
+        backlog.get()
+        self.assertTrue(backlog.dirty)
+        backlog.serialize(self.queue_file)
+        self.assertFalse(backlog.dirty)
+
+    def test_backlog_peek(self):
+        """Test that peek returns the next task without removing it"""
+        backlog = taskinfo.TaskBacklog()
+        low = taskinfo.TaskInfo("low", "quick", priority=4)
+        high = taskinfo.TaskInfo("high", "quick", priority=1)
+        backlog.put(low)
+        backlog.put(high)
+        self.assertIs(backlog.peek(), high)
+        self.assertIs(backlog.get(), high)
+
+    def test_backlog_leases(self):
+        """Test claiming, renewing, releasing & expiring leases"""
+        backlog = taskinfo.TaskBacklog()
+        first = taskinfo.TaskInfo("first", "quick", priority=1)
+        second = taskinfo.TaskInfo("second", "quick", priority=2)
+        backlog.put(first)
+        backlog.put(second)
+
+        self.assertIs(backlog.claim("a", 10, now=100), first)
+        self.assertIs(backlog.claim("b", 10, now=100), second)
+        with self.assertRaises(queue.Empty):
+            backlog.claim("c", 10, now=105)
+        with self.assertRaises(LookupError):
+            backlog.renew(first.id, "b", 10, now=105)
+        backlog.renew(first.id, "a", 10, now=105)
+
+        # b's lease runs out: the task is queued again, for c to claim
+        self.assertIs(backlog.claim("c", 10, now=112), second)
+        with self.assertRaises(LookupError):
+            backlog.release(second.id, "b")
+        self.assertIs(backlog.release(first.id, "a"), first)
+        self.assertEqual(backlog.expire_leases(now=200), [second])
+        self.assertIs(backlog.peek(), second)
+
+    def test_backlog_lease_round_trip(self):
+        """Test that leases survive serialization"""
+        backlog = taskinfo.TaskBacklog()
+        task = taskinfo.TaskInfo("task", "quick", priority=3)
+        backlog.put(task)
+        backlog.claim("a", 10, now=100)
+        self.assertEqual(backlog.data(), [[task.id, 3, "a", 110]])
+
+        loaded = taskinfo.TaskBacklog.from_data(backlog.data())
+        self.assertEqual(loaded.data(), backlog.data())
+        self.assertTrue(loaded.empty())
+        self.assertEqual([lease.id for lease in loaded.expire_leases(110)],
+                         [task.id])
+
+
+class TestTaskMaster(fixtures.SandboxTestCase):
+    """Test TaskMaster class, in sessions run by a separate process"""
+    def setUp(self):
+        """Set up before test cases"""
+        identify(self)
+        super().setUp()
+
+    def test_index_follows_moves(self):
+        """Test that the index is kept up to date as tasks move"""
+        self.assertEqual(self._run(INDEX_SCRIPT).split(),
+                         ["graveyard", "stack", "stack", "graveyard"])
+
+    def test_rollback(self):
+        """Test that a rollback undoes exactly the changes made since the
+           savepoint, with the dorm in a priority queue or a timing wheel"""
+        for wheel in ["0", "1"]:
+            with patch.dict(os.environ, {taskinfo.WHEEL_ENV: wheel}):
+                self.assertEqual(self._run(ROLLBACK_SCRIPT), "fifth fourth\n")
+            shutil.rmtree(os.path.join(self.test_dir, ".tasks"))
+
+    def test_sessions_per_thread(self):
+        """Test that only the thread of an open session joins it"""
+        self.assertEqual(self._run(THREAD_SESSION_SCRIPT), "True False\n")
+
+    def test_session_failure_per_thread(self):
+        """Test that a failing session discards only its own thread's task
+           writes"""
+        self.assertEqual(self._run(THREAD_FAILURE_SCRIPT), "saved\n")
+
+    def test_state_cache_holds_saved_tasks(self):
+        """Test that the state cache records tasks as saved, not as changed
+           in memory"""
+        self._run(UNSAVED_CHANGE_SCRIPT)
+        self.assertEqual(self._run(UNSAVED_CHANGE_SCRIPT), "first second\n")
+        self.assertEqual(self._run(UNSAVED_CHANGE_SCRIPT).splitlines()[0],
+                         "first saved")
+
+    def test_block_on_closed_task(self):
+        """Test that a task cannot be blocked on a closed one"""
+        output = self._run(BLOCK_CLOSED_SCRIPT).splitlines()
+        self.assertTrue(output[0].endswith("' is already closed"))
+        self.assertEqual(output[1], "first 0")
+
+    def test_claim_publishes_tasks(self):
+        """Test that the structures saved by a claim only refer to
+           published tasks, even if the session fails afterwards"""
+        self.assertEqual(self._run(CLAIM_FAILURE_SCRIPT), "added claimed\n")
+
+    def test_show_is_lazy(self):
+        """Test that showing the current task does not build the index"""
+        self.assertTrue(self._run(SHOW_SCRIPT).endswith("second\n"))
+
+    def test_limbo_log(self):
+        """Test that saving limbo appends its changes to the limbo log"""
+        self.assertEqual(self._run(LIMBO_LOG_SCRIPT),
+                         "fourth third\nfourth third\n")
+
+    def test_lost_lease(self):
+        """Test that an expired lease takes the task off its worker's stack,
+           & that the worker cannot close it any more"""
+        output = self._run(LOST_LEASE_SCRIPT).splitlines()
+        self.assertTrue(output[0].endswith("' was lost"))
+        self.assertEqual(output[1:], ["a None 0", "b None 0", "c first 0"])
+
+
 # class TestAdd(unittest.TestCase):
 #     """Test the 'add' command"""
 #     def setUp(self):
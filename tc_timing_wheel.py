@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+"""
+Test cases for timing_wheel.py
+"""
+
+import datetime
+import random
+import unittest
+import timing_wheel
+
+
+def identify(testobj):
+    """Identify running test in log"""
+    print(f"\n{'='*72}\n{testobj.id().split('.')[-1]}\n{'='*72}")
+
+
+class TestTimingWheel(unittest.TestCase):
+    """Test TimingWheel class"""
+    def setUp(self):
+        """Set up before test cases"""
+        identify(self)
+        self.start = datetime.datetime(2020, 1, 1)
+        self.wheel = timing_wheel.TimingWheel(start=self.start)
+
+    def test_expire_matches_sorted_order(self):
+        """Test expiry across all levels & the overflow against a sort"""
+        rand = random.Random(7)
+        reference = {}
+        for i in range(2000):
+            seconds = rand.choice([10, 5000, 10 ** 6, 10 ** 8, 10 ** 10])
+            timestamp = self.start + datetime.timedelta(
+                seconds=rand.uniform(-5, seconds))
+            reference[str(i)] = timestamp
+            self.wheel.put(str(i), timestamp)
+
+        for name in rand.sample(sorted(reference), 100):
+            self.wheel.remove(name)
+            del reference[name]
+
+        earliest = min(reference, key=reference.get)
+        self.assertEqual(self.wheel.peek_tuple(),
+                         (earliest, reference[earliest]))
+
+        now = self.start
+        expired = []
+        while reference:
+            now += datetime.timedelta(seconds=rand.choice([1, 3000, 10 ** 7]))
+            due = [name for name in reference if reference[name] <= now]
+            due.sort(key=lambda name: (reference[name], int(name)))
+            self.assertEqual(self.wheel.expire(now), due)
+            for name in due:
+                del reference[name]
+            expired.extend(due)
+        self.assertEqual(len(expired), 1900)
+        self.assertTrue(self.wheel.empty())
+
+    def test_overdue_and_duplicate(self):
+        """Test that overdue items expire immediately & duplicates fail"""
+        past = self.start - datetime.timedelta(days=1)
+        self.wheel.put("late", past)
+        with self.assertRaises(ValueError):
+            self.wheel.put("late", past)
+        self.assertEqual(self.wheel.expire(self.start), ["late"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+"""Hierarchical timing wheel
+
+Stores items by (naive) datetime in LEVELS wheels of SLOTS buckets each: a
+bucket of level 'l' spans SLOTS**l ticks of 'resolution' seconds.  An item is
+kept in the lowest level whose wheel still contains its time (relative to the
+wheel's current tick), items beyond the top level wait in an overflow list.
+Inserting & removing are O(1); expiring costs O(LEVELS * SLOTS) bucket visits
+plus the number of items that expire or move down a level, independently of
+how many items are stored or how much time has passed.
+
+The wheel exposes the subset of the PriorityQueue interface used by TaskDorm
+(put/remove/priority/sequence/peek_tuple/items/size), plus expire() &
+expire_entries() for batch wakeups.
+"""
+
+import datetime
+import itertools
+
+from queue import Empty
+
+EPOCH = datetime.datetime(1970, 1, 1)
+LEVELS = 5
+SLOTS = 64  # 64**5 one-second ticks span ~34 years
+
+
+class TimingWheel(object):
+    """Hierarchical timing wheel of items keyed by wake-up datetime"""
+    def __init__(self, resolution=1.0, start=None):
+        if start is None:
+            start = datetime.datetime.now()
+
+        self._resolution = resolution
+        self._current = self._tick(start)
+        self._wheels = [[{} for _ in range(SLOTS)] for _ in range(LEVELS)]
+        self._overflow = {}
+        self._entries = {}  # item -> (timestamp, sequence, bucket)
+        self._sequence = itertools.count()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, item):
+        return item in self._entries
+
+    def __iter__(self):
+        """Object iterator (earliest first)"""
+        for item, _ in self.items():
+            yield item
+
+    def _tick(self, timestamp):
+        """Returns the tick number of datetime 'timestamp'"""
+        return int((timestamp - EPOCH).total_seconds() // self._resolution)
+
+    def _bucket(self, tick):
+        """Returns the bucket holding items due at 'tick'"""
+        tick = max(tick, self._current)  # overdue items are due right away
+        for level in range(LEVELS):
+            span = SLOTS ** (level + 1)
+            if tick // span == self._current // span:
+                return self._wheels[level][(tick // SLOTS ** level) % SLOTS]
+        return self._overflow
+
+    def put(self, item, timestamp, sequence=None):
+        """Adds 'item', due at datetime 'timestamp'.  Passing the 'sequence'
+           of a removed item (see sequence()) puts it back in its former
+           place among the items due at the same time."""
+        if item in self._entries:
+            raise ValueError(f"Item is already queued: '{item}'")
+
+        if sequence is None:
+            sequence = next(self._sequence)
+        bucket = self._bucket(self._tick(timestamp))
+        bucket[item] = timestamp
+        self._entries[item] = (timestamp, sequence, bucket)
+
+    def priority(self, item):
+        """Returns the due datetime of the stored 'item'"""
+        return self._entries[item][0]
+
+    def sequence(self, item):
+        """Returns the insertion sequence number of the stored 'item'"""
+        return self._entries[item][1]
+
+    def remove(self, item):
+        """Removes & returns 'item'.  Raises KeyError if it is not queued."""
+        _, _, bucket = self._entries.pop(item)
+        del bucket[item]
+        return item
+
+    def _first_bucket(self):
+        """Returns the non-empty bucket holding the earliest item, or None"""
+        for level in range(LEVELS):
+            start = (self._current // SLOTS ** level) % SLOTS
+            for bucket in self._wheels[level][start:]:
+                if bucket:
+                    return bucket
+        return self._overflow or None
+
+    def peek_tuple(self):
+        """Returns the earliest (item, timestamp) without removing it"""
+        bucket = self._first_bucket()
+        if bucket is None:
+            raise Empty
+
+        item = min(bucket, key=lambda item: self._entries[item][:2])
+        return item, bucket[item]
+
+    def expire(self, now):
+        """Removes & returns the list of items due at or before datetime
+           'now', earliest first"""
+        return [item for item, _, _ in self.expire_entries(now)]
+
+    def expire_entries(self, now):
+        """Removes the items due at or before datetime 'now' & returns their
+           (item, timestamp, sequence) entries, earliest first"""
+        target = max(self._tick(now), self._current)
+        due, pending = [], []
+        for level in range(LEVELS):
+            span = SLOTS ** level
+            wheel = self._wheels[level]
+            start = (self._current // span) % SLOTS
+            if target // (span * SLOTS) != self._current // (span * SLOTS):
+                stop = SLOTS  # the whole wheel has passed
+            else:
+                stop = (target // span) % SLOTS
+                # the bucket containing 'target' is split up below
+                pending.extend(wheel[stop].items())
+                wheel[stop].clear()
+            for slot in range(start, stop):
+                due.extend(wheel[slot])
+                wheel[slot].clear()
+
+        if target // SLOTS ** LEVELS != self._current // SLOTS ** LEVELS:
+            pending.extend(self._overflow.items())
+            self._overflow.clear()
+
+        self._current = target
+        for item, timestamp in pending:
+            if timestamp <= now:
+                due.append(item)
+            else:
+                bucket = self._bucket(self._tick(timestamp))
+                bucket[item] = timestamp
+                self._entries[item] = self._entries[item][:2] + (bucket,)
+
+        due.sort(key=lambda item: self._entries[item][:2])
+        return [(item,) + self._entries.pop(item)[:2] for item in due]
+
+    def size(self):
+        """Returns the number of stored items"""
+        return len(self._entries)
+
+    def empty(self):
+        """Returns True if there are 0 items in the wheel; False otherwise"""
+        return self.size() == 0
+
+    def items(self):
+        """Returns a list of (item, timestamp) tuples, earliest first"""
+        ordered = sorted(self._entries.items(), key=lambda entry: entry[1][:2])
+        return [(item, entry[0]) for item, entry in ordered]